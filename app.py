@@ -1,75 +1,313 @@
 import os
-import cv2
-import numpy as np
+import io
+import importlib
+import time
+import datetime
 import base64
 import json
-import requests
-from flask import Flask, request, render_template, jsonify, send_from_directory, abort
-from werkzeug.utils import secure_filename
-import firebase_admin
-from firebase_admin import credentials, auth, firestore
+import itertools
+import zipfile
+import click
+from functools import partial
+from flask import Flask, Request, request, render_template, jsonify, send_from_directory, abort, Response, url_for, stream_with_context, g, got_request_exception
+from werkzeug.middleware.proxy_fix import ProxyFix
 from whitenoise import WhiteNoise
+from blob_store import content_hash, create_blob_store, is_valid_hash, sniff_content_type
+from imaging import build_renditions, decode_image, dhash, read_image_size
+from cartoon import init_worker, pipeline_variant, render_cartoon
+from cartoon_cache import DiskCache, NearDuplicateIndex, ResultCache
+from jobs import JobFailed, JobQueue, JobRejected, create_job_store, run_blocking
+from inference import DEFAULT_MODEL, HUGGINGFACE_BASE_URL, InferenceClient, InferenceError
+from firestore_tracing import current_stats, start_request, totals as firestore_totals, trace_client
+from users import UserDirectory
+from id_tokens import TokenVerifier, firebase_valid_after
+from firestore_queries import get_documents, query_in
+from firestore_writes import commit, write_latency
+from feeds import FEED_MODES, FeedService
+from events import CLOSED, create_event_broker, format_sse
+from search_index import SearchIndex, search_document
+from page_cache import PageCache, create_page_store, tag_page
+from pagination import DEFAULT_PAGE_SIZE, DOCUMENT_ID, InvalidCursor, decode_cursor, encode_cursor, page_size, paginate
+from lazy import LazyClient, lazy_import
+from metrics import Registry, profile_when_requested, stats_metrics
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+firebase_admin = lazy_import('firebase_admin')
+credentials = lazy_import('firebase_admin.credentials')
+firestore = lazy_import('firebase_admin.firestore')
+
+class InMemoryUploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
+app.request_class = InMemoryUploadRequest
 app.wsgi_app = WhiteNoise(app.wsgi_app, root='static/')
+# Behind a load balancer every request comes from the proxy; guests' job limits need the client address.
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES: app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+if os.environ.get('PROFILE_REQUESTS', '').lower() in ('1', 'true', 'yes'):
+    app.wsgi_app = profile_when_requested(app.wsgi_app, profile_dir=os.environ.get('PROFILE_DIR') or None)
 
-db = None
-try:
-    secret_file_path = '/etc/secrets/firebase-service-account.json'
-    if os.path.exists(secret_file_path):
-        cred = credentials.Certificate(secret_file_path)
-        firebase_admin.initialize_app(cred)
-        db = firestore.client()
-    else:
-        cred = credentials.Certificate('firebase-service-account.json')
-        firebase_admin.initialize_app(cred)
-        db = firestore.client()
-except Exception as e:
-    print(f"Firebase initialization failed: {e}")
+PRELOAD_MODULES = ('cv2', 'numpy', 'firebase_admin.firestore', 'google.auth.jwt', 'requests')
+FIREBASE_CREDENTIAL_PATHS = ('/etc/secrets/firebase-service-account.json', 'firebase-service-account.json')
+
+def firebase_app():
+    try: return firebase_admin.get_app()
+    except ValueError: pass
+    secret_file_path = next((path for path in FIREBASE_CREDENTIAL_PATHS if os.path.exists(path)), FIREBASE_CREDENTIAL_PATHS[-1])
+    return firebase_admin.initialize_app(credentials.Certificate(secret_file_path))
+
+def connect_firestore():
+    # A client of our own rather than firestore.client(), which caches one per app (and so across forks).
+    firebase = firebase_app()
+    return trace_client(firestore.Client(project=firebase.project_id, credentials=firebase.credential.get_credential()))
+
+def connect_token_verifier():
+    return TokenVerifier(
+        os.environ.get('FIREBASE_PROJECT_ID') or firebase_app().project_id,
+        check_revoked=os.environ.get('AUTH_CHECK_REVOKED', '').lower() in ('1', 'true', 'yes'),
+        # The Firebase app may not exist yet: routes verify the token before they first touch db.
+        valid_after=lambda uid: firebase_valid_after(uid, app=firebase_app()),
+        max_entries=int(os.environ.get('AUTH_TOKEN_CACHE_ENTRIES', 10000)))
+
+def preload():
+    """Does the slow start-up work up front, so workers forked by a preloading gunicorn master share it."""
+    for name in PRELOAD_MODULES: importlib.import_module(name)
+    search_index.load()
+
+db = LazyClient(connect_firestore, 'Firestore')
+token_verifier = LazyClient(connect_token_verifier, 'Token verifier')
+user_directory = UserDirectory(lambda: db)
+FEED_MODE = os.environ.get('FEED_MODE', 'read')
+if FEED_MODE not in FEED_MODES: raise RuntimeError(f"FEED_MODE must be one of {', '.join(FEED_MODES)}")
+feed_service = FeedService(lambda: db, user_directory, celebrity_threshold=int(os.environ.get('FEED_CELEBRITY_THRESHOLD', 500)),
+                           backfill=int(os.environ.get('FEED_BACKFILL', 20)))
 
-UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 50_000_000))
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 50))
+BATCH_MAX_BYTES = int(os.environ.get('BATCH_MAX_BYTES', 200 * 1024 * 1024))
 HUGGINGFACE_API_KEY = os.environ.get('HUGGINGFACE_API_KEY', "")
+CARTOON_MODE = os.environ.get('CARTOON_MODE', 'fast')
+CARTOON_MAX_DIM = int(os.environ.get('CARTOON_MAX_DIM', 2048))
+CARTOON_VARIANT = pipeline_variant(CARTOON_MODE, CARTOON_MAX_DIM)
+CARTOON_CACHE_DIR = os.environ.get('CARTOON_CACHE_DIR') or None
+cartoon_cache = ResultCache(max_entries=int(os.environ.get('CARTOON_CACHE_ENTRIES', 64)),
+                            ttl=float(os.environ.get('CARTOON_CACHE_TTL', 86400)),
+                            disk=DiskCache(CARTOON_CACHE_DIR) if CARTOON_CACHE_DIR else None)
+
+def stored_phashes():
+    for docs in iter_pages('creations', int(os.environ.get('DUPLICATE_LOAD_BATCH', 500)), db.collection('creations').select(['phash'])):
+        for doc in docs:
+            phash = doc.to_dict().get('phash')
+            if phash: yield doc.id, int(phash, 16)
+
+duplicate_index = NearDuplicateIndex(max_distance=int(os.environ.get('DUPLICATE_MAX_DISTANCE', 6)), load=stored_phashes)
+inference_client = LazyClient(lambda: InferenceClient(
+    HUGGINGFACE_API_KEY, model=os.environ.get('INFERENCE_MODEL', DEFAULT_MODEL),
+    base_url=os.environ.get('INFERENCE_BASE_URL', HUGGINGFACE_BASE_URL),
+    read_timeout=float(os.environ.get('INFERENCE_TIMEOUT', 120)),
+    cache_entries=int(os.environ.get('INFERENCE_CACHE_ENTRIES', 128)),
+    cache_ttl=float(os.environ.get('INFERENCE_CACHE_TTL', 3600))), 'Inference client')
+job_queue = JobQueue(
+    create_job_store(), cpu_workers=int(os.environ.get('JOB_CPU_WORKERS', 0)) or None,
+    io_workers=int(os.environ.get('JOB_IO_WORKERS', 8)), per_user_limit=int(os.environ.get('JOB_PER_USER_LIMIT', 2)),
+    max_pending=int(os.environ.get('JOB_MAX_PENDING', 32)),
+    cpu_initializer=init_worker, cpu_initargs=(int(os.environ.get('JOB_CPU_THREADS', 1)),))
+image_store = create_blob_store()
+event_broker = create_event_broker()
+EVENT_HEARTBEAT = float(os.environ.get('EVENT_HEARTBEAT', 15))
+EVENT_RETRY_MS = 3000
+SEARCH_CHANNEL = '$search-index'
+search_index = SearchIndex(os.environ.get('SEARCH_INDEX_PATH', 'search-index.npz'))
+PAGE_CACHE_CHANNEL = '$page-cache'
+DUPLICATE_CHANNEL = '$duplicate-index'
+page_cache = PageCache(max_entries=int(os.environ.get('PAGE_CACHE_ENTRIES', 1000)), store=create_page_store())
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+metrics = Registry()
+request_latency = metrics.histogram('http_request_duration_seconds', 'Time until the view returned its response, by route.')
+request_exceptions = metrics.counter('http_request_exceptions_total', 'Unhandled exceptions raised while serving requests.')
+request_firestore_operations = metrics.counter('http_request_firestore_operations_total', 'Firestore reads, queries and writes made by requests.')
+request_firestore_latency = metrics.histogram('http_request_firestore_seconds', 'Time each request spent waiting on Firestore.')
+cartoon_stage_latency = metrics.histogram('cartoon_stage_seconds', 'Time spent in each stage of rendering a cartoon.')
+inference_latency = metrics.histogram('inference_generate_seconds', 'Text-to-image generation time, including upstream retries.',
+                                      buckets=(0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300))
+COUNTER_STATS = {'hits', 'misses', 'stale', 'not_modified', 'renders', 'render_seconds', 'memory_hits', 'disk_hits',
+                 'verifications', 'failures', 'verify_seconds', 'certificate_refreshes', 'certificate_refresh_failures',
+                 'upstream_calls', 'upstream_seconds', 'coalesced', 'cache_hits', 'cache_misses', 'commits', 'retries',
+                 'seconds', 'reads', 'queries', 'writes', 'published', 'dropped'}
+IMAGE_FIELDS = ('original', 'generated')
+IMAGE_MAX_AGE = 31536000
+GRID_IMAGE_WIDTH = 512
+# Creations not yet moved by migrate-images still carry their images inline. Migrated ones no longer have
+# the *_image_b64 fields, so projecting them costs nothing for those.
+LIST_FIELDS = ('user_id', 'type', 'prompt', 'tags', 'is_public', 'folder', 'timestamp', 'original_image_hash',
+               'generated_image_hash', 'renditions', 'generated_image_width') + tuple(f'{kind}_image_b64' for kind in IMAGE_FIELDS)
+CHAT_PAGE_SIZE = 50
+GRID_IMAGE_SIZES = '(min-width: 1024px) 33vw, (min-width: 768px) 50vw, 100vw'
+app.jinja_env.globals['grid_image_sizes'] = GRID_IMAGE_SIZES
 
-def verify_firebase_token(request):
+def verify_firebase_token(request, allow_query_token=False):
     auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '): return None
-    id_token = auth_header.split('Bearer ')[1]
-    try: return auth.verify_id_token(id_token)
+    if auth_header and auth_header.startswith('Bearer '): id_token = auth_header.split('Bearer ')[1]
+    elif allow_query_token and request.args.get('token'): id_token = request.args['token']
+    else: return None
+    if not token_verifier: return None
+    try: return token_verifier.verify(id_token)
     except Exception: return None
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def image_to_base64(image_array):
+def encode_image(image_array):
     _, buffer = cv2.imencode('.jpg', image_array)
-    return base64.b64encode(buffer).decode('utf-8')
+    return buffer.tobytes()
 
-def cartoonize_image(image_path):
-    try:
-        img = cv2.imread(image_path)
-        if img is None: return None
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        gray = cv2.medianBlur(gray, 5)
-        edges = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 9, 9)
-        color = cv2.bilateralFilter(img, 9, 250, 250)
-        cartoon = cv2.bitwise_and(color, color, mask=edges)
-        return cartoon
-    except Exception: return None
+@app.template_global()
+def creation_image_src(creation, kind='generated'):
+    image_hash = creation.get(f'{kind}_image_hash')
+    if image_hash: return url_for('serve_image', image_hash=image_hash)
+    image_b64 = creation.get(f'{kind}_image_b64')
+    return f"data:image/jpeg;base64,{image_b64}" if image_b64 else None
+
+@app.template_global()
+def creation_thumbnail_src(creation, width=GRID_IMAGE_WIDTH):
+    renditions = creation.get('renditions') or {}
+    fitting = sorted(int(w) for w in renditions if int(w) >= width)
+    if fitting: return url_for('serve_image', image_hash=renditions[str(fitting[0])])
+    return creation_image_src(creation)
+
+@app.template_global()
+def creation_srcset(creation):
+    renditions = creation.get('renditions') or {}
+    candidates = [f"{url_for('serve_image', image_hash=image_hash)} {width}w" for width, image_hash in sorted(renditions.items(), key=lambda item: int(item[0]))]
+    if candidates and creation.get('generated_image_hash') and creation.get('generated_image_width'):
+        candidates.append(f"{creation_image_src(creation)} {creation['generated_image_width']}w")
+    return ', '.join(candidates)
+
+def put_renditions(renditions):
+    return {str(width): image_store.put(data) for width, data in renditions.items()}
+
+def store_renditions(image_array):
+    return put_renditions(build_renditions(image_array))
 
-def award_points(user_id, is_public, was_public_before):
+def serialize_creation(creation, creation_id=None):
+    if creation_id: creation['id'] = creation_id
+    creation['image_url'] = creation_image_src(creation, 'generated')
+    creation['thumbnail_url'] = creation_thumbnail_src(creation)
+    creation['srcset'] = creation_srcset(creation)
+    creation['original_image_url'] = creation_image_src(creation, 'original')
+    for kind in IMAGE_FIELDS: creation.pop(f'{kind}_image_b64', None)
+    return creation
+
+def award_points(batch, user_id, is_public, was_public_before):
     if not user_id or not db: return
     points_to_add = 0
     if is_public and not was_public_before:
         points_to_add += 10
     if points_to_add > 0:
-        db.collection('users').document(user_id).update({'points': firestore.Increment(points_to_add)})
+        batch.update(db.collection('users').document(user_id), {'points': firestore.Increment(points_to_add)})
+
+def request_page(default=DEFAULT_PAGE_SIZE):
+    """Returns ``(page size, decoded cursor)`` from the ``limit`` and ``cursor`` query arguments."""
+    return page_size(request.args.get('limit'), default), decode_cursor(request.args.get('cursor'))
 
 def get_chat_id(uid1, uid2):
     return '_'.join(sorted([uid1, uid2]))
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def start_firestore_stats():
+    start_request()
+
+@app.before_request
+def follow_search_updates():
+    search_index.follow(event_broker, SEARCH_CHANNEL, save_interval=float(os.environ.get('SEARCH_INDEX_SAVE_INTERVAL', 60)))
+
+@app.before_request
+def follow_page_invalidations():
+    page_cache.follow(event_broker, PAGE_CACHE_CHANNEL)
+
+@app.before_request
+def follow_duplicate_updates():
+    duplicate_index.follow(event_broker, DUPLICATE_CHANNEL)
+
+def invalidate_pages(*tags):
+    page_cache.invalidate(*tags, broker=event_broker, channel=PAGE_CACHE_CHANNEL)
+
+def index_creation(creation_id, data):
+    event_broker.publish(SEARCH_CHANNEL, 'creation', {'id': creation_id, 'document': search_document(data)})
+
+def unindex_creation(creation_id):
+    event_broker.publish(SEARCH_CHANNEL, 'creation-removed', {'id': creation_id})
+
+def index_duplicate(creation_id, phash):
+    duplicate_index.add(creation_id, phash)
+    event_broker.publish(DUPLICATE_CHANNEL, 'add', {'id': creation_id, 'phash': format(phash, '016x')})
+
+def unindex_duplicate(creation_id):
+    duplicate_index.remove(creation_id)
+    event_broker.publish(DUPLICATE_CHANNEL, 'remove', {'id': creation_id})
+
+def index_user(uid, data):
+    event_broker.publish(SEARCH_CHANNEL, 'user', {'uid': uid, 'username': data.get('username'), 'full_name': data.get('fullName')})
+
+@app.after_request
+def add_firestore_stats_headers(response):
+    stats = current_stats()
+    if stats:
+        response.headers['X-Firestore-Reads'] = str(stats.reads)
+        response.headers['X-Firestore-Queries'] = str(stats.queries)
+        response.headers['X-Firestore-Writes'] = str(stats.writes)
+    return response
+
+def request_route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.after_request
+def record_request_metrics(response):
+    route = request_route()
+    started = g.get('request_started')
+    if started is not None:
+        request_latency.observe(time.perf_counter() - started, route=route, method=request.method, status=response.status_code)
+    stats = current_stats()
+    if stats and (stats.reads or stats.queries or stats.writes):
+        for kind in ('reads', 'queries', 'writes'):
+            if getattr(stats, kind): request_firestore_operations.inc(getattr(stats, kind), route=route, kind=kind)
+        request_firestore_latency.observe(stats.seconds, route=route)
+    return response
+
+@got_request_exception.connect_via(app)
+def record_request_exception(sender, exception, **extra):
+    request_exceptions.inc(route=request_route(), exception=type(exception).__name__)
+
+@metrics.collector
+def collect_component_stats():
+    yield from stats_metrics('firestore', 'Firestore calls from this process', [({}, firestore_totals.as_dict())], COUNTER_STATS)
+    yield from stats_metrics('firestore_batch', 'Batched Firestore commits',
+                             [({'endpoint': endpoint}, stats) for endpoint, stats in write_latency.as_dict().items()], COUNTER_STATS)
+    verifier = token_verifier.current()
+    if verifier: yield from stats_metrics('auth_token', 'ID token verification', [({}, verifier.stats())], COUNTER_STATS)
+    inference = inference_client.current()
+    if inference: yield from stats_metrics('inference', 'Text-to-image inference', [({}, inference.stats())], COUNTER_STATS)
+    yield from stats_metrics('cartoon_cache', 'Cartoon result cache', [({}, cartoon_cache.stats())], COUNTER_STATS)
+    yield from stats_metrics('page_cache', 'Public page cache', [({'route': route}, stats) for route, stats in page_cache.stats().items()], COUNTER_STATS)
+    yield from stats_metrics('events', 'Event broker', [({}, {'published': event_broker.published, 'dropped': event_broker.dropped,
+                                                              'connections': event_broker.connections()})], COUNTER_STATS)
+    yield from stats_metrics('jobs', 'Background jobs', [({}, {'pending': job_queue.pending()})], COUNTER_STATS)
+    yield from stats_metrics('search_index', 'Search index', [({}, {'creations': len(search_index), 'ready': int(search_index.ready)})], COUNTER_STATS)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}': abort(401)
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/')
 def home(): return render_template('index.html')
 
@@ -96,59 +334,83 @@ def messages_with_user_page(username):
     return render_template('messages.html', start_chat_with=username)
 
 @app.route('/explore')
+@page_cache.cached('explore', ttl=30, stale=300, args=('q', 'cursor', 'limit'))
 def explore():
     if not db: abort(503, description="Database service is unavailable.")
     search_query = request.args.get('q', '').strip()
-    creations, users = [], []
+    creations, users, next_cursor = [], [], None
+    try: limit, cursor = request_page(default=21)
+    except InvalidCursor as e: abort(400, description=str(e))
     try:
-        if search_query:
-            user_query = db.collection('users').where('username', '>=', search_query).where('username', '<=', search_query + '\uf8ff').limit(5)
-            users = [doc.to_dict() for doc in user_query.stream()]
-            tags = [tag.strip() for tag in search_query.split(',') if tag.strip()]
-            if tags:
-                creation_query = db.collection('creations').where('is_public', '==', True).where('tags', 'array-contains-any', tags).limit(20)
-                creations = [doc.to_dict() for doc in creation_query.stream()]
+        if search_query and search_index.ready:
+            if not cursor:
+                uids = search_index.search_users(search_query)
+                profiles = user_directory.get_profiles(uids)
+                users = [profiles[uid] for uid in uids if uid in profiles] or search_usernames(search_query)
+            ids, next_after = search_index.search(search_query, limit, cursor)
+            docs = get_documents(db, 'creations', ids)
+            creations = [doc.to_dict() | {'id': doc.id} for doc in docs if doc.to_dict().get('is_public')]
+            next_cursor = encode_cursor(next_after) if next_after else None
         else:
-            creation_query = db.collection('creations').where('is_public', '==', True).order_by('timestamp', direction=firestore.Query.DESCENDING).limit(21)
-            creations = [doc.to_dict() for doc in creation_query.stream()]
+            creation_query = db.collection('creations').where('is_public', '==', True)
+            if search_query:
+                if not cursor: users = search_usernames(search_query)
+                tags = [tag.strip() for tag in search_query.split(',') if tag.strip()]
+                creation_query = creation_query.where('tags', 'array-contains-any', tags) if tags else None
+            if creation_query:
+                docs, next_cursor = paginate(creation_query.select(LIST_FIELDS), 'timestamp', limit, cursor)
+                creations = [doc.to_dict() | {'id': doc.id} for doc in docs]
+    except InvalidCursor as e: abort(400, description=str(e))
     except Exception as e:
+        # Typically a missing composite index (see firestore.indexes.json); say so rather than show an empty page.
         print(f"Error in explore: {e}")
+        return render_template('explore.html', creations=[], users=users, search_query=search_query, next_cursor=None,
+                               error='Creations could not be loaded right now. Please try again later.'), 503
+    else: tag_page('explore')
 
-    return render_template('explore.html', creations=creations, users=users, search_query=search_query)
+    return render_template('explore.html', creations=creations, users=users, search_query=search_query, next_cursor=next_cursor)
+
+def search_usernames(prefix, limit=5):
+    user_query = db.collection('users').where('username', '>=', prefix).where('username', '<=', prefix + '\uf8ff').limit(limit)
+    return [doc.to_dict() for doc in user_query.stream()]
 
 @app.route('/user/<username>')
+@page_cache.cached('user_profile', ttl=60, stale=600, args=('cursor', 'limit'))
 def user_profile(username):
     if not db: abort(503, description="Database service is unavailable.")
-    user_query = db.collection('users').where('username', '==', username).limit(1).get()
-    if not user_query: abort(404, description="User not found")
-    user_data = user_query[0].to_dict()
-    user_id = user_query[0].id
-    user_data['uid'] = user_id
-    creations_query = db.collection('creations').where('user_id', '==', user_id).where('is_public', '==', True).order_by('timestamp', direction=firestore.Query.DESCENDING).stream()
-    public_creations = []
-    for doc in creations_query:
-        c = doc.to_dict(); c['id'] = doc.id
-        public_creations.append(c)
-    return render_template('user_profile.html', user=user_data, creations=public_creations)
+    user_data = user_directory.find_by_username(username)
+    if not user_data: abort(404, description="User not found")
+    user_id = user_data['uid']
+    try: limit, cursor = request_page(default=24)
+    except InvalidCursor as e: abort(400, description=str(e))
+    creations_query = db.collection('creations').where('user_id', '==', user_id).where('is_public', '==', True).select(LIST_FIELDS)
+    try: docs, next_cursor = paginate(creations_query, 'timestamp', limit, cursor)
+    except InvalidCursor as e: abort(400, description=str(e))
+    public_creations = [doc.to_dict() | {'id': doc.id} for doc in docs]
+    tag_page(f'user:{user_id}')
+    return render_template('user_profile.html', user=user_data, creations=public_creations, next_cursor=next_cursor)
 
 @app.route('/creation/<creation_id>')
+@page_cache.cached('view_creation', ttl=300, stale=3600)
 def view_creation(creation_id):
     if not db: abort(503, description="Database service is unavailable.")
     creation_doc = db.collection('creations').document(creation_id).get()
     if not creation_doc.exists: abort(404, description="Creation not found")
     creation_data = creation_doc.to_dict()
-    creator_doc = db.collection('users').document(creation_data['user_id']).get()
-    creator_info = creator_doc.to_dict() if creator_doc.exists else {}
+    creator_info = user_directory.get_profile(creation_data['user_id']) or {}
+    if creation_data.get('is_public'): tag_page(f'creation:{creation_id}', f"user:{creation_data['user_id']}")
     return render_template('view_creation.html', creation=creation_data, creator=creator_info)
 
+@app.route('/api/page-cache/stats')
+def page_cache_stats(): return jsonify(page_cache.stats())
+
 @app.route('/api/check_username', methods=['POST'])
 def check_username():
     if not db: return jsonify({'error': 'Database service is unavailable.'}), 503
     try:
         username = request.get_json().get('username')
         if not username: return jsonify({'error': 'Username not provided'}), 400
-        query = db.collection('users').where('username', '==', username).limit(1).stream()
-        is_available = not any(query)
+        is_available = user_directory.uid_for_username(username) is None
         return jsonify({'isAvailable': is_available})
     except Exception as e:
         print(f"Error in /api/check_username: {e}")
@@ -160,26 +422,135 @@ def upload_cartoon():
     if 'file' not in request.files: return jsonify({'error': 'No file part'}), 400
     file = request.files['file']
     if file.filename == '' or not allowed_file(file.filename): return jsonify({'error': 'Invalid file'}), 400
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filepath)
-    cartoon_result = cartoonize_image(filepath)
-    if cartoon_result is None:
-        os.remove(filepath)
-        return jsonify({'error': 'Failed to process image'}), 500
-    cartoon_base64 = image_to_base64(cartoon_result)
-    creation_id = None
-    if user and db:
-        with open(filepath, "rb") as image_file: original_base64 = base64.b64encode(image_file.read()).decode('utf-8')
-        db.collection('users').document(user['uid']).update({'points': firestore.Increment(1)})
-        doc_ref = db.collection('creations').add({
-            'user_id': user['uid'], 'type': 'cartoon', 'original_image_b64': original_base64,
-            'generated_image_b64': cartoon_base64, 'is_public': False, 'tags': [],
+    original_bytes = file.read()
+    size = read_image_size(original_bytes)
+    error = image_size_error(size)
+    if error: return jsonify({'error': error[0]}), error[1]
+    upload_hash = run_blocking(content_hash, original_bytes)
+    finalize = partial(save_cartoon_creation, user['uid'] if user else None, original_bytes, upload_hash)
+    cached = cartoon_cache.lookup(upload_hash, CARTOON_VARIANT)
+    if cached: return submit_job(user, 'cartoon', cached_cartoon, cached, finalize=finalize)
+    return submit_job(user, 'cartoon', render_cartoon, original_bytes, size, CARTOON_MODE, CARTOON_MAX_DIM, CARTOON_CACHE_DIR,
+                      cpu_bound=True, finalize=finalize)
+
+def image_size_error(size):
+    if size is None: return 'Invalid file', 400
+    if size[0] * size[1] > MAX_IMAGE_PIXELS: return 'Image dimensions are too large', 413
+    return None
+
+def cached_cartoon(rendered):
+    return rendered
+
+@app.route('/api/upload-cartoon/batch', methods=['POST'])
+def upload_cartoon_batch():
+    user = verify_firebase_token(request)
+    request.max_content_length = BATCH_MAX_BYTES
+    try: uploads = read_batch_uploads(request.files)
+    except ValueError as e: return jsonify({'error': str(e)}), 400
+    if not uploads: return jsonify({'error': 'No image files'}), 400
+    if len(uploads) > BATCH_MAX_FILES: return jsonify({'error': f'A batch can hold at most {BATCH_MAX_FILES} images'}), 413
+    user_id = user['uid'] if user else None
+    ready, queued, positions = [], [], {}
+    for index, (filename, data) in enumerate(uploads):
+        size = read_image_size(data)
+        error = image_size_error(size)
+        upload_hash = run_blocking(content_hash, data)
+        finalize = partial(save_cartoon_creation, user_id, data, upload_hash)
+        if error: ready.append((index, filename, None, None, JobFailed(error[0], error[1])))
+        elif cached := cartoon_cache.lookup(upload_hash, CARTOON_VARIANT): ready.append((index, filename, finalize, cached, None))
+        elif upload_hash in positions: queued[positions[upload_hash]][1].append((index, filename, finalize))
+        else:
+            positions[upload_hash] = len(queued)
+            queued.append(((data, size, CARTOON_MODE, CARTOON_MAX_DIM, CARTOON_CACHE_DIR), [(index, filename, finalize)]))
+    owner = f"user:{user_id}" if user else f"guest:{request.remote_addr}"
+    try: results = job_queue.map(owner, render_cartoon, [args for args, _ in queued]) if queued else iter(())
+    except JobRejected as e: return job_rejected_response(e)
+
+    def completed():
+        for position, rendered, error in results:
+            for copy, item in enumerate(queued[position][1]):
+                # Repeats of a file within the batch are rendered once and served from the cache.
+                yield (*item, dict(rendered, cache='memory') if copy and rendered else rendered, error)
+
+    def stream():
+        done = failed = 0
+        for index, filename, finalize, rendered, error in itertools.chain(ready, completed()):
+            line = batch_result(index, filename, finalize, rendered, error)
+            if line['status'] == 'done': done += 1
+            else: failed += 1
+            yield json.dumps(line) + '\n'
+        yield json.dumps({'status': 'complete', 'done': done, 'failed': failed}) + '\n'
+    response = Response(stream_with_context(stream()), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+    if queued: response.call_on_close(results.close)
+    return response
+
+def read_batch_uploads(files):
+    uploads = []
+    for file in files.getlist('files') + files.getlist('file'):
+        if file.filename.lower().endswith('.zip'): uploads.extend(read_zip_uploads(file))
+        elif allowed_file(file.filename): uploads.append((file.filename, file.read()))
+        else: raise ValueError(f"Unsupported file: {file.filename}")
+        if len(uploads) > BATCH_MAX_FILES: break
+    return uploads
+
+def read_zip_uploads(file):
+    """Reads the images in an uploaded zip, skipping other members; sizes are capped like direct uploads."""
+    uploads, total = [], 0
+    try:
+        with zipfile.ZipFile(file.stream) as archive:
+            for info in archive.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or name.startswith('.') or info.filename.startswith('__MACOSX/') or not allowed_file(name): continue
+                total += info.file_size
+                if info.file_size > app.config['MAX_CONTENT_LENGTH'] or total > BATCH_MAX_BYTES:
+                    raise ValueError('The archive contents are too large')
+                uploads.append((info.filename, archive.read(info)))
+                if len(uploads) > BATCH_MAX_FILES: break
+    except zipfile.BadZipFile: raise ValueError('Invalid zip archive')
+    return uploads
+
+def batch_result(index, filename, finalize, rendered, error):
+    line = {'index': index, 'filename': filename}
+    if error is None:
+        try: result = job_result_payload(finalize(rendered))
+        except JobFailed as e: error = e
+        except Exception as e:
+            print(f"Error saving batch item {index}: {e}")
+            error = JobFailed('A server error occurred while processing the image.')
+    if error:
+        line.update(status='failed', error=str(error))
+        return line
+    if result['image_url']: result.pop('cartoon', None)
+    line.update(status='done', **result)
+    return line
+
+def save_cartoon_creation(user_id, original_bytes, upload_hash, rendered):
+    if rendered is None: raise JobFailed('Failed to process image')
+    for stage, seconds in rendered.pop('timings', {}).items(): cartoon_stage_latency.observe(seconds, stage=stage)
+    cartoon_cache.store(upload_hash, CARTOON_VARIANT, rendered)
+    cartoon_bytes, renditions, width = rendered['jpeg'], rendered['renditions'], rendered['width']
+    result = {'cartoon': base64.b64encode(cartoon_bytes).decode('utf-8'), 'creation_id': None, 'generated_image_hash': None,
+              'cache': rendered['cache']}
+    if user_id and db:
+        original_hash = image_store.put(original_bytes, upload_hash)
+        generated_hash = image_store.put(cartoon_bytes)
+        creation_ref = db.collection('creations').document()
+        duplicates = duplicate_index.find(rendered['phash'])
+        creation = {
+            'user_id': user_id, 'type': 'cartoon', 'original_image_hash': original_hash,
+            'generated_image_hash': generated_hash, 'renditions': put_renditions(renditions),
+            'generated_image_width': width, 'is_public': False, 'tags': [],
+            'phash': format(rendered['phash'], '016x'), 'near_duplicate_of': duplicates[0][1] if duplicates else None,
             'timestamp': firestore.SERVER_TIMESTAMP
-        })
-        creation_id = doc_ref[1].id
-    os.remove(filepath)
-    return jsonify({'cartoon': cartoon_base64, 'creation_id': creation_id})
+        }
+        def build(batch):
+            batch.update(db.collection('users').document(user_id), {'points': firestore.Increment(1)})
+            batch.set(creation_ref, creation)
+        commit(db, 'upload_cartoon', build)
+        index_duplicate(creation_ref.id, rendered['phash'])
+        index_creation(creation_ref.id, creation)
+        result.update(creation_id=creation_ref.id, generated_image_hash=generated_hash)
+    return result
 
 @app.route('/api/generate-from-text', methods=['POST'])
 def generate_from_text():
@@ -187,38 +558,79 @@ def generate_from_text():
     prompt = request.get_json().get('prompt')
     if not prompt: return jsonify({'error': 'Prompt is required'}), 400
     if not HUGGINGFACE_API_KEY: return jsonify({'error': 'AI image generation service is not configured.'}), 503
-    
-    API_URL = "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-xl-base-1.0"
-    headers = {"Authorization": f"Bearer {HUGGINGFACE_API_KEY}"}
-    payload = {"inputs": prompt}
-    
+    return submit_job(user, 'text-to-image', request_text_to_image, prompt,
+                      finalize=partial(save_text_creation, user['uid'] if user else None, prompt))
+
+def request_text_to_image(prompt):
+    start, outcome = time.perf_counter(), 'error'
     try:
-        response = requests.post(API_URL, headers=headers, json=payload)
-        
-        if response.status_code == 200 and "image" in response.headers.get("content-type", ""):
-            base64_image = base64.b64encode(response.content).decode("utf-8")
-            image_data_url = f"data:image/jpeg;base64,{base64_image}"
-            creation_id = None
-
-            if user and db:
-                db.collection('users').document(user['uid']).update({'points': firestore.Increment(3)})
-                doc_ref = db.collection('creations').add({
-                    'user_id': user['uid'], 'type': 'text-to-image', 'prompt': prompt,
-                    'generated_image_b64': base64_image, 'is_public': False, 'tags': [],
-                    'timestamp': firestore.SERVER_TIMESTAMP
-                })
-                creation_id = doc_ref[1].id
-            
-            return jsonify({'image_data_url': image_data_url, 'creation_id': creation_id})
-        else:
-            error_data = response.json()
-            error_message = error_data.get('error', 'An unknown error occurred with the AI service.')
-            if 'is currently loading' in error_message:
-                return jsonify({'error': 'The AI model is starting up. Please wait about 30 seconds and try again.'}), 503
-            return jsonify({'error': error_message}), 500
+        image_bytes = inference_client.generate(prompt)
+        outcome = 'ok'
+        return image_bytes
+    except InferenceError as e: raise JobFailed(str(e), e.status_code)
+    finally: inference_latency.observe(time.perf_counter() - start, outcome=outcome)
 
-    except Exception as e:
-        return jsonify({'error': f'A server error occurred while contacting the AI service: {e}'}), 500
+def save_text_creation(user_id, prompt, image_bytes):
+    base64_image = base64.b64encode(image_bytes).decode("utf-8")
+    result = {'image_data_url': f"data:image/jpeg;base64,{base64_image}", 'creation_id': None, 'generated_image_hash': None}
+    if user_id and db:
+        generated_hash = image_store.put(image_bytes)
+        renditions, width = run_blocking(text_image_renditions, image_bytes)
+        creation_ref = db.collection('creations').document()
+        creation = {
+            'user_id': user_id, 'type': 'text-to-image', 'prompt': prompt,
+            'generated_image_hash': generated_hash,
+            'renditions': put_renditions(renditions), 'generated_image_width': width,
+            'is_public': False, 'tags': [],
+            'timestamp': firestore.SERVER_TIMESTAMP
+        }
+        def build(batch):
+            batch.update(db.collection('users').document(user_id), {'points': firestore.Increment(3)})
+            batch.set(creation_ref, creation)
+        commit(db, 'generate_from_text', build)
+        index_creation(creation_ref.id, creation)
+        result.update(creation_id=creation_ref.id, generated_image_hash=generated_hash)
+    return result
+
+def text_image_renditions(image_bytes):
+    image = decode_image(image_bytes)
+    if image is None: return {}, None
+    return build_renditions(image), image.shape[1]
+
+def submit_job(user, kind, work, *args, **kwargs):
+    owner = f"user:{user['uid']}" if user else f"guest:{request.remote_addr}"
+    try: job = job_queue.submit(owner, kind, work, *args, **kwargs)
+    except JobRejected as e: return job_rejected_response(e)
+    response = jsonify({'job_id': job['id'], 'status': job['status']})
+    response.status_code = 202
+    response.headers['Location'] = url_for('get_job', job_id=job['id'])
+    return response
+
+def job_rejected_response(e):
+    response = jsonify({'error': str(e)})
+    response.status_code = e.status_code
+    if e.retry_after: response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def job_result_payload(result):
+    result = dict(result)
+    image_hash = result.pop('generated_image_hash', None)
+    result['image_url'] = url_for('serve_image', image_hash=image_hash) if image_hash else None
+    return result
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job and job['owner'].startswith('user:'):
+        user = verify_firebase_token(request)
+        if not user or job['owner'] != f"user:{user['uid']}": job = None
+    if not job: return jsonify({'error': 'Job not found'}), 404
+    payload = {'job_id': job['id'], 'status': job['status']}
+    if job['status'] == 'done':
+        payload['result'] = job_result_payload(job['result'])
+    elif job['status'] == 'failed':
+        payload['error'] = job['error']
+    return jsonify(payload)
 
 @app.route('/api/firebase-config')
 def firebase_config():
@@ -238,7 +650,7 @@ def get_user_profile():
         user_doc = db.collection('users').document(user['uid']).get()
         user_data = user_doc.to_dict() if user_doc.exists else {}
         creations_query = db.collection('creations').where('user_id', '==', user['uid']).order_by('timestamp', direction=firestore.Query.DESCENDING).limit(6)
-        creations_docs = [doc.to_dict() for doc in creations_query.stream()]
+        creations_docs = [serialize_creation(doc.to_dict(), doc.id) for doc in creations_query.stream()]
         return jsonify({'profile': user_data, 'creations': creations_docs})
     except Exception as e: return jsonify({'error': str(e)}), 500
 
@@ -252,7 +664,11 @@ def post_user_profile():
         'dob': data.get('dob'), 'location': data.get('location'), 'hobbies': data.get('hobbies')
     }
     try:
-        db.collection('users').document(user['uid']).update({k: v for k, v in update_data.items() if v is not None})
+        user_ref = db.collection('users').document(user['uid'])
+        user_ref.update({k: v for k, v in update_data.items() if v is not None})
+        user_directory.invalidate(user['uid'])
+        index_user(user['uid'], user_ref.get().to_dict())
+        invalidate_pages(f"user:{user['uid']}")
         return jsonify({'success': True, 'message': 'Profile updated successfully'})
     except Exception as e: return jsonify({'error': str(e)}), 500
 
@@ -260,6 +676,8 @@ def post_user_profile():
 def get_user_creations():
     user = verify_firebase_token(request)
     if not user or not db: return jsonify({'error': 'Unauthorized'}), 401
+    try: limit, cursor = request_page()
+    except InvalidCursor as e: return jsonify({'error': str(e)}), 400
     try:
         visibility = request.args.get('visibility', 'all')
         folder = request.args.get('folder')
@@ -267,12 +685,10 @@ def get_user_creations():
         if visibility == 'public': query = query.where('is_public', '==', True)
         elif visibility == 'private': query = query.where('is_public', '==', False)
         if folder: query = query.where('folder', '==', folder)
-        docs = query.order_by('timestamp', direction=firestore.Query.DESCENDING).stream()
-        creations = []
-        for doc in docs:
-            creation_data = doc.to_dict(); creation_data['id'] = doc.id
-            creations.append(creation_data)
-        return jsonify({'creations': creations})
+        docs, next_cursor = paginate(query.select(LIST_FIELDS), 'timestamp', limit, cursor)
+        creations = [serialize_creation(doc.to_dict(), doc.id) for doc in docs]
+        return jsonify({'creations': creations, 'next_cursor': next_cursor})
+    except InvalidCursor as e: return jsonify({'error': str(e)}), 400
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 @app.route('/api/creations/<creation_id>', methods=['POST'])
@@ -282,15 +698,23 @@ def update_creation(creation_id):
     data = request.get_json()
     is_public = data.get('is_public')
     tags = [tag.strip() for tag in data.get('tags', '').split(',') if tag.strip()]
-    try:
-        creation_ref = db.collection('creations').document(creation_id)
+    creation_ref = db.collection('creations').document(creation_id)
+    def build(batch):
         creation_doc = creation_ref.get()
-        if not creation_doc.exists or creation_doc.to_dict().get('user_id') != user['uid']:
-            return jsonify({'error': 'Permission denied'}), 403
+        if not creation_doc.exists or creation_doc.to_dict().get('user_id') != user['uid']: raise PermissionError('Permission denied')
+        batch.update(creation_ref, {'is_public': is_public, 'tags': tags}, option=db.write_option(last_update_time=creation_doc.update_time))
+        award_points(batch, user['uid'], is_public, creation_doc.to_dict().get('is_public', False))
+        return creation_doc
+    try:
+        creation_doc = commit(db, 'update_creation', build)
         was_public_before = creation_doc.to_dict().get('is_public', False)
-        creation_ref.update({'is_public': is_public, 'tags': tags})
-        award_points(user['uid'], is_public, was_public_before)
+        index_creation(creation_id, creation_doc.to_dict() | {'is_public': is_public, 'tags': tags})
+        if is_public or was_public_before: invalidate_pages(f'creation:{creation_id}', f"user:{user['uid']}", 'explore')
+        if FEED_MODE == 'fanout':
+            if is_public: feed_service.publish(creation_id, creation_doc.to_dict() | {'tags': tags})
+            elif was_public_before: feed_service.retract(creation_id, user['uid'])
         return jsonify({'success': True, 'message': 'Creation updated.'})
+    except PermissionError as e: return jsonify({'error': str(e)}), 403
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 @app.route('/api/creations/<creation_id>', methods=['DELETE'])
@@ -303,6 +727,10 @@ def delete_creation(creation_id):
         if not creation_doc.exists or creation_doc.to_dict().get('user_id') != user['uid']:
             return jsonify({'error': 'Permission denied'}), 403
         creation_ref.delete()
+        unindex_duplicate(creation_id)
+        unindex_creation(creation_id)
+        if creation_doc.to_dict().get('is_public'): invalidate_pages(f'creation:{creation_id}', f"user:{user['uid']}", 'explore')
+        if FEED_MODE == 'fanout' and creation_doc.to_dict().get('is_public'): feed_service.retract(creation_id, user['uid'])
         return jsonify({'success': True, 'message': 'Creation deleted.'})
     except Exception as e: return jsonify({'error': str(e)}), 500
 
@@ -323,8 +751,10 @@ def send_friend_request(target_user_id):
     if not user or not db: return jsonify({'error': 'Unauthorized'}), 401
     current_user_id = user['uid']
     if current_user_id == target_user_id: return jsonify({'error': 'Cannot add yourself'}), 400
-    db.collection('users').document(current_user_id).update({'friendRequests.sent': firestore.ArrayUnion([target_user_id])})
-    db.collection('users').document(target_user_id).update({'friendRequests.received': firestore.ArrayUnion([current_user_id])})
+    def build(batch):
+        batch.update(db.collection('users').document(current_user_id), {'friendRequests.sent': firestore.ArrayUnion([target_user_id])})
+        batch.update(db.collection('users').document(target_user_id), {'friendRequests.received': firestore.ArrayUnion([current_user_id])})
+    commit(db, 'send_friend_request', build)
     return jsonify({'success': True, 'status': 'sent'})
 
 @app.route('/api/friends/handle/<requester_id>', methods=['POST'])
@@ -333,11 +763,16 @@ def handle_friend_request(requester_id):
     if not user or not db: return jsonify({'error': 'Unauthorized'}), 401
     current_user_id = user['uid']
     action = request.json.get('action')
-    db.collection('users').document(current_user_id).update({'friendRequests.received': firestore.ArrayRemove([requester_id])})
-    db.collection('users').document(requester_id).update({'friendRequests.sent': firestore.ArrayRemove([current_user_id])})
+    current_updates = {'friendRequests.received': firestore.ArrayRemove([requester_id])}
+    requester_updates = {'friendRequests.sent': firestore.ArrayRemove([current_user_id])}
     if action == 'accept':
-        db.collection('users').document(current_user_id).update({'friends': firestore.ArrayUnion([requester_id])})
-        db.collection('users').document(requester_id).update({'friends': firestore.ArrayUnion([current_user_id])})
+        current_updates['friends'] = firestore.ArrayUnion([requester_id])
+        requester_updates['friends'] = firestore.ArrayUnion([current_user_id])
+    def build(batch):
+        batch.update(db.collection('users').document(current_user_id), current_updates)
+        batch.update(db.collection('users').document(requester_id), requester_updates)
+    commit(db, 'handle_friend_request', build)
+    if action == 'accept' and FEED_MODE == 'fanout': feed_service.befriend(current_user_id, requester_id)
     return jsonify({'success': True})
 
 @app.route('/api/friends/requests', methods=['GET'])
@@ -348,9 +783,10 @@ def get_friend_requests():
     received_ids = user_doc.to_dict().get('friendRequests', {}).get('received', [])
     requests_data = []
     if received_ids:
-        users = db.collection('users').where(firestore.FieldPath.document_id(), 'in', received_ids).stream()
-        for u in users:
-            requests_data.append({'uid': u.id, 'username': u.to_dict().get('username'), 'photoURL': u.to_dict().get('photoURL')})
+        profiles = user_directory.get_profiles(received_ids)
+        for uid in received_ids:
+            if uid in profiles:
+                requests_data.append({'uid': uid, 'username': profiles[uid]['username'], 'photoURL': profiles[uid]['photoURL']})
     return jsonify({'requests': requests_data})
 
 @app.route('/api/creations/<creation_id>/favorite', methods=['POST'])
@@ -370,36 +806,36 @@ def get_user_favorites():
     user_doc = db.collection('users').document(user['uid']).get()
     favorite_ids = user_doc.to_dict().get('favorites', [])
     favorited_creations = []
-    if favorite_ids:
-        refs = [db.collection('creations').document(id) for id in favorite_ids[:10]]
-        docs = db.get_all(refs)
-        for doc in docs:
-            if doc.exists:
-                creation_data = doc.to_dict(); creation_data['id'] = doc.id
-                favorited_creations.append(creation_data)
+    for doc in get_documents(db, 'creations', favorite_ids):
+        favorited_creations.append(serialize_creation(doc.to_dict(), doc.id))
     return jsonify({'creations': favorited_creations})
 
 @app.route('/api/feed', methods=['GET'])
 def get_feed():
     user = verify_firebase_token(request)
     if not user or not db: return jsonify({'error': 'Unauthorized'}), 401
-    user_doc = db.collection('users').document(user['uid']).get()
-    friends_list = user_doc.to_dict().get('friends', [])
-    if not friends_list: return jsonify({'feed': []})
-    creations_query = db.collection('creations').where('user_id', 'in', friends_list).where('is_public', '==', True).order_by('timestamp', direction=firestore.Query.DESCENDING).limit(20).stream()
-    feed_items = []; creator_ids = set()
-    for doc in creations_query:
-        item = doc.to_dict(); item['id'] = doc.id
-        feed_items.append(item); creator_ids.add(item['user_id'])
-    creators = {}
-    if creator_ids:
-        creator_docs = db.collection('users').where(firestore.FieldPath.document_id(), 'in', list(creator_ids)).stream()
-        for doc in creator_docs: creators[doc.id] = doc.to_dict()
-    for item in feed_items:
-        creator_info = creators.get(item['user_id'], {})
-        item['creator_username'] = creator_info.get('username', 'Unknown')
-        item['creator_photoURL'] = creator_info.get('photoURL')
-    return jsonify({'feed': feed_items})
+    try: limit, cursor = request_page()
+    except InvalidCursor as e: return jsonify({'error': str(e)}), 400
+    if cursor and not {'timestamp', 'id'} <= cursor.keys(): return jsonify({'error': 'Cursor does not match this listing'}), 400
+    start_after = {'timestamp': cursor['timestamp'], DOCUMENT_ID: cursor['id']} if cursor else None
+    if FEED_MODE == 'fanout':
+        feed_items = [serialize_creation(item, item['id']) for item in feed_service.read(user['uid'], limit, start_after)]
+    else:
+        user_doc = db.collection('users').document(user['uid']).get()
+        friends_list = user_doc.to_dict().get('friends', [])
+        if not friends_list: return jsonify({'feed': [], 'next_cursor': None})
+        creations_query = query_in(lambda: db.collection('creations').where('is_public', '==', True).select(LIST_FIELDS), 'user_id', friends_list,
+                                   order_by='timestamp', descending=True, limit=limit, start_after=start_after)
+        feed_items = [serialize_creation(doc.to_dict(), doc.id) for doc in creations_query]
+        creators = user_directory.get_profiles({item['user_id'] for item in feed_items}) if feed_items else {}
+        for item in feed_items:
+            creator_info = creators.get(item['user_id'], {})
+            item['creator_username'] = creator_info.get('username')
+            item['creator_photoURL'] = creator_info.get('photoURL')
+    for item in feed_items: item['creator_username'] = item.get('creator_username') or 'Unknown'
+    last = feed_items[-1] if len(feed_items) == limit else None
+    next_cursor = encode_cursor({'timestamp': last['timestamp'], 'id': last['id']}) if last else None
+    return jsonify({'feed': feed_items, 'next_cursor': next_cursor})
 
 @app.route('/api/dashboard/folders', methods=['POST'])
 def create_folder():
@@ -426,19 +862,53 @@ def move_creation_to_folder(creation_id):
 def send_message(recipient_username):
     user = verify_firebase_token(request)
     if not user or not db: return jsonify({'error': 'Unauthorized'}), 401
-    recipient_doc = list(db.collection('users').where('username', '==', recipient_username).limit(1).stream())
-    if not recipient_doc: return jsonify({'error': 'Recipient not found'}), 404
-    recipient_id = recipient_doc[0].id
+    recipient_id = user_directory.uid_for_username(recipient_username)
+    if not recipient_id: return jsonify({'error': 'Recipient not found'}), 404
     chat_id = get_chat_id(user['uid'], recipient_id)
     text = request.json.get('text')
     message_data = {'senderId': user['uid'], 'text': text, 'timestamp': firestore.SERVER_TIMESTAMP}
-    db.collection('chats').document(chat_id).collection('messages').add(message_data)
-    db.collection('chats').document(chat_id).set({
-        'participants': [user['uid'], recipient_id], 'lastMessage': text,
-        'lastTimestamp': firestore.SERVER_TIMESTAMP
-    }, merge=True)
+    chat_ref = db.collection('chats').document(chat_id)
+    message_ref = chat_ref.collection('messages').document()
+    def build(batch):
+        batch.set(message_ref, message_data)
+        batch.set(chat_ref, {
+            'participants': [user['uid'], recipient_id], 'lastMessage': text,
+            'lastTimestamp': firestore.SERVER_TIMESTAMP
+        }, merge=True)
+    commit(db, 'send_message', build)
+    publish_message(chat_id, message_ref.id, user['uid'], recipient_id, text, datetime.datetime.now(datetime.timezone.utc))
     return jsonify({'success': True})
 
+def publish_message(chat_id, message_id, sender_id, recipient_id, text, sent_at):
+    message = {'chat_id': chat_id, 'id': message_id, 'senderId': sender_id, 'text': text, 'timestamp': sent_at}
+    profiles = user_directory.get_profiles([sender_id, recipient_id])
+    for uid, other_id in ((sender_id, recipient_id), (recipient_id, sender_id)):
+        other = profiles.get(other_id, {})
+        event_broker.publish(uid, 'message', message)
+        event_broker.publish(uid, 'conversation', {'chat_id': chat_id, 'other_user_id': other_id, 'lastMessage': text,
+                                                   'username': other.get('username') or 'Unknown', 'photoURL': other.get('photoURL')})
+
+@app.route('/api/events', methods=['GET'])
+def event_stream():
+    """Streams ``message`` and ``conversation`` events for the signed-in user as Server-Sent Events.
+
+    ``EventSource`` cannot send headers, so the ID token may be passed as ``?token=``.
+    The stream ends when the token expires; the client reconnects with a fresh one.
+    """
+    user = verify_firebase_token(request, allow_query_token=True)
+    if not user: return jsonify({'error': 'Unauthorized'}), 401
+    subscription = event_broker.subscribe(user['uid'])
+    expires = user.get('exp', time.time() + 3600)
+    def stream():
+        try:
+            yield f"retry: {EVENT_RETRY_MS}\n\n"
+            while time.time() < expires:
+                item = subscription.get(timeout=EVENT_HEARTBEAT)
+                if item is CLOSED: return
+                yield format_sse(*item) if item else ": keep-alive\n\n"
+        finally: subscription.close()
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/messages/conversations', methods=['GET'])
 def get_conversations():
     user = verify_firebase_token(request)
@@ -451,23 +921,176 @@ def get_conversations():
         if other_user_id:
             other_user_ids.append(other_user_id)
             conversations.append({'chat_id': chat.id, 'other_user_id': other_user_id, 'lastMessage': chat_data.get('lastMessage')})
-    other_users_data = {}
-    if other_user_ids:
-        user_docs = db.collection('users').where(firestore.FieldPath.document_id(), 'in', list(other_user_ids)).stream()
-        for doc in user_docs: other_users_data[doc.id] = doc.to_dict()
+    other_users_data = user_directory.get_profiles(other_user_ids) if other_user_ids else {}
     for conv in conversations:
         user_data = other_users_data.get(conv['other_user_id'], {})
-        conv['username'] = user_data.get('username', 'Unknown'); conv['photoURL'] = user_data.get('photoURL')
+        conv['username'] = user_data.get('username') or 'Unknown'; conv['photoURL'] = user_data.get('photoURL')
     return jsonify({'conversations': conversations})
 
 @app.route('/api/messages/chat/<other_user_id>', methods=['GET'])
 def get_chat_history(other_user_id):
     user = verify_firebase_token(request)
     if not user or not db: return jsonify({'error': 'Unauthorized'}), 401
+    try: limit, cursor = request_page(default=CHAT_PAGE_SIZE)
+    except InvalidCursor as e: return jsonify({'error': str(e)}), 400
     chat_id = get_chat_id(user['uid'], other_user_id)
-    messages_query = db.collection('chats').document(chat_id).collection('messages').order_by('timestamp').limit(50).stream()
-    messages = [msg.to_dict() for msg in messages_query]
-    return jsonify({'messages': messages})
+    try: docs, next_cursor = paginate(db.collection('chats').document(chat_id).collection('messages'), 'timestamp', limit, cursor)
+    except InvalidCursor as e: return jsonify({'error': str(e)}), 400
+    messages = [msg.to_dict() for msg in reversed(docs)]
+    return jsonify({'messages': messages, 'next_cursor': next_cursor})
+
+@app.route('/img/<image_hash>')
+def serve_image(image_hash):
+    if not is_valid_hash(image_hash): abort(404)
+    if request.if_none_match.contains(image_hash):
+        response = Response(status=304)
+    else:
+        data = image_store.get(image_hash)
+        if data is None: abort(404)
+        response = Response(data, mimetype=sniff_content_type(data))
+        response = response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+    response.set_etag(image_hash)
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+def iter_pages(collection, batch_size, base_query=None):
+    last_doc = None
+    while True:
+        query = (base_query or db.collection(collection)).limit(batch_size)
+        if last_doc: query = query.start_after(last_doc)
+        docs = list(query.stream())
+        if not docs: return
+        yield docs
+        last_doc = docs[-1]
+
+@app.cli.command('migrate-images')
+@click.option('--batch-size', default=20, help='Creations rewritten per Firestore batch.')
+@click.option('--dry-run', is_flag=True, help='Report what would be migrated without writing.')
+def migrate_images(batch_size, dry_run):
+    """Moves inline base64 creation images into the blob store."""
+    if not db: raise click.ClickException("Database service is unavailable.")
+    migrated = 0
+    for docs in iter_pages('creations', batch_size):
+        batch = db.batch(); pending = 0
+        for doc in docs:
+            data = doc.to_dict(); updates = {}
+            for kind in IMAGE_FIELDS:
+                image_b64 = data.get(f'{kind}_image_b64')
+                if not image_b64: continue
+                updates[f'{kind}_image_hash'] = image_store.put(base64.b64decode(image_b64)) if not dry_run else None
+                updates[f'{kind}_image_b64'] = firestore.DELETE_FIELD
+            if updates:
+                batch.update(doc.reference, updates); pending += 1
+        if pending and not dry_run: batch.commit()
+        migrated += pending
+        click.echo(f"Migrated {migrated} creations...")
+    click.echo(f"Done. {migrated} creations {'would be ' if dry_run else ''}migrated.")
+
+@app.cli.command('backfill-renditions')
+@click.option('--batch-size', default=20, help='Creations rewritten per Firestore batch.')
+@click.option('--force', is_flag=True, help='Rebuild renditions that already exist.')
+def backfill_renditions(batch_size, force):
+    """Generates grid-sized renditions for creations stored before they existed."""
+    if not db: raise click.ClickException("Database service is unavailable.")
+    updated, failed = 0, 0
+    for docs in iter_pages('creations', batch_size):
+        batch = db.batch(); pending = 0
+        for doc in docs:
+            data = doc.to_dict()
+            if 'renditions' in data and not force: continue
+            if data.get('generated_image_hash'): image_bytes = image_store.get(data['generated_image_hash'])
+            elif data.get('generated_image_b64'): image_bytes = base64.b64decode(data['generated_image_b64'])
+            else: image_bytes = None
+            image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR) if image_bytes else None
+            if image is None:
+                failed += 1; continue
+            batch.update(doc.reference, {'renditions': store_renditions(image), 'generated_image_width': image.shape[1]})
+            pending += 1
+        if pending: batch.commit()
+        updated += pending
+        click.echo(f"Backfilled {updated} creations...")
+    click.echo(f"Done. {updated} creations updated, {failed} without a readable image.")
+
+@app.cli.command('index-duplicates')
+@click.option('--batch-size', default=50, help='Creations read per page.')
+@click.option('--dry-run', is_flag=True, help='Report near-duplicates without writing.')
+def index_duplicates(batch_size, dry_run):
+    """Hashes every creation's source image and flags near-duplicates of earlier creations.
+
+    Newly hashed creations reach running workers' duplicate indexes only with EVENT_BROKER=redis;
+    otherwise workers pick them up when they next start.
+    """
+    if not db: raise click.ClickException("Database service is unavailable.")
+    index = NearDuplicateIndex(duplicate_index.max_distance)
+    scanned, flagged, failed = 0, 0, 0
+    for docs in iter_pages('creations', batch_size):
+        batch = db.batch(); pending = 0; hashed = []
+        for doc in docs:
+            data = doc.to_dict(); updates = {}
+            if data.get('phash'): phash = int(data['phash'], 16)
+            else:
+                image_hash = data.get('original_image_hash') or data.get('generated_image_hash')
+                image_bytes = image_store.get(image_hash) if image_hash else None
+                image = decode_image(image_bytes) if image_bytes else None
+                if image is None:
+                    failed += 1; continue
+                phash = dhash(image)
+                updates['phash'] = format(phash, '016x')
+                hashed.append((doc.id, updates['phash']))
+            duplicates = index.find(phash)
+            if duplicates and data.get('near_duplicate_of') != duplicates[0][1]:
+                updates['near_duplicate_of'] = duplicates[0][1]; flagged += 1
+            index.add(doc.id, phash)
+            if updates:
+                batch.update(doc.reference, updates); pending += 1
+        if pending and not dry_run:
+            batch.commit()
+            for creation_id, phash in hashed: event_broker.publish(DUPLICATE_CHANNEL, 'add', {'id': creation_id, 'phash': phash})
+        scanned += len(docs)
+        click.echo(f"Indexed {scanned} creations...")
+    click.echo(f"Done. {flagged} near-duplicates {'would be ' if dry_run else ''}flagged, {failed} without a readable image.")
+
+@app.cli.command('rebuild-feeds')
+@click.option('--batch-size', default=100, help='Users read per page.')
+def rebuild_feeds(batch_size):
+    """Rebuilds every user's fan-out feed timeline from their friends' public creations."""
+    if not db: raise click.ClickException("Database service is unavailable.")
+    users, items = 0, 0
+    for docs in iter_pages('users', batch_size):
+        for doc in docs: feed_service.check_celebrity(doc.id, doc.to_dict().get('friends', []))
+    for docs in iter_pages('users', batch_size):
+        for doc in docs:
+            items += feed_service.rebuild(doc.id, doc.to_dict().get('friends', []))
+            users += 1
+        click.echo(f"Rebuilt {users} feeds...")
+    click.echo(f"Done. {users} feeds rebuilt with {items} items.")
+
+@app.cli.command('rebuild-search-index')
+@click.option('--batch-size', default=500, help='Documents read per page.')
+def rebuild_search_index(batch_size):
+    """Rebuilds the explore search index from Firestore and tells running workers to reload it.
+
+    The reload reaches workers only through a shared broker (EVENT_BROKER=redis); otherwise restart the app.
+    """
+    if not db: raise click.ClickException("Database service is unavailable.")
+    index = SearchIndex(search_index.path)
+    creations, users = 0, 0
+    public = db.collection('creations').where('is_public', '==', True).select(['is_public', 'tags', 'prompt', 'timestamp'])
+    for docs in iter_pages('creations', batch_size, public):
+        for doc in docs: index.add_creation(doc.id, doc.to_dict())
+        creations += len(docs)
+        click.echo(f"Indexed {creations} creations...")
+    for docs in iter_pages('users', batch_size, db.collection('users').select(['username', 'fullName'])):
+        for doc in docs: index.set_user(doc.id, doc.to_dict().get('username'), doc.to_dict().get('fullName'))
+        users += len(docs)
+    index.save()
+    event_broker.publish(SEARCH_CHANNEL, 'reload', {})
+    click.echo(f"Done. Indexed {creations} creations and {users} users into {index.path}.")
+    if os.environ.get('EVENT_BROKER', 'memory') != 'redis':
+        click.echo("EVENT_BROKER is not redis, so running workers were not told to reload. Restart the app now: "
+                   "until then they keep their old index and overwrite the new file on their next save.")
 
 @app.route('/favicon.ico')
 def favicon():
@@ -0,0 +1,74 @@
+"""Batch cartoonization throughput against process-pool size.
+
+    python benchmarks/bench_batch.py [--images 32] [--size 1920x1080] [--workers 1,2,4] [--mode fast]
+
+Renders the same batch of synthetic JPEGs through ``JobQueue.map`` (what
+/api/upload-cartoon/batch uses) with each worker count, once with OpenCV
+capped to one thread per worker (``JOB_CPU_THREADS=1``, the default) and once
+with OpenCV's own default thread pool in every worker, and reports images/sec.
+The first row renders the batch inline, one image after another, like a
+client sending sequential single uploads. Worker counts default to powers of
+two up to the CPUs available to this process; pool start-up is excluded.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path[:0] = [os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.path.dirname(os.path.abspath(__file__))]
+
+import cv2
+
+from bench_cartoon import synthetic_photo
+from cartoon import init_worker, render_cartoon
+from imaging import read_image_size
+from jobs import InMemoryJobStore, JobQueue, available_cpus
+
+MAX_DIM = 2048
+
+
+def default_worker_counts():
+    counts, count = [], 1
+    while count < available_cpus():
+        counts.append(count); count *= 2
+    return counts + [available_cpus()]
+
+
+def run_batch(queue, arg_list):
+    start = time.perf_counter()
+    for _, rendered, error in queue.map('bench', render_cartoon, arg_list):
+        if error or rendered is None: raise RuntimeError(f'render failed: {error}')
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=32)
+    parser.add_argument('--size', default='1920x1080')
+    parser.add_argument('--workers', default=None, help='Comma-separated worker counts.')
+    parser.add_argument('--mode', default='fast')
+    args = parser.parse_args()
+    width, height = (int(n) for n in args.size.split('x'))
+    counts = [int(n) for n in args.workers.split(',')] if args.workers else default_worker_counts()
+
+    uploads = [cv2.imencode('.jpg', synthetic_photo(width, height, seed=i))[1].tobytes() for i in range(args.images)]
+    arg_list = [(data, read_image_size(data), args.mode, MAX_DIM) for data in uploads]
+    print(f"{args.images} x {args.size} images, mode {args.mode}, {available_cpus()} CPUs available")
+    print(f"{'workers':>8}{'cv threads':>12}{'images/s':>10}{'speedup':>9}")
+
+    start = time.perf_counter()
+    for item in arg_list: render_cartoon(*item)
+    baseline = args.images / (time.perf_counter() - start)
+    print(f"{'inline':>8}{'default':>12}{baseline:>10.2f}{1:>9.2f}")
+
+    for workers in counts:
+        for label, threads in (('1', 1), ('default', -1)):
+            queue = JobQueue(InMemoryJobStore(), cpu_workers=workers, cpu_initializer=init_worker, cpu_initargs=(threads,))
+            run_batch(queue, arg_list[:workers])  # start and warm every worker
+            rate = args.images / run_batch(queue, arg_list)
+            queue._pools()[0].shutdown()
+            print(f"{workers:>8}{label:>12}{rate:>10.2f}{rate / baseline:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
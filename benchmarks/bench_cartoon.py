@@ -0,0 +1,115 @@
+"""Benchmarks the cartoon engine modes over a fixed synthetic corpus.
+
+    python benchmarks/bench_cartoon.py [--runs 3] [--sizes 640x480,1920x1080,4000x3000]
+
+For each resolution and mode it reports the median ms/image, the peak memory
+allocated while processing (tracemalloc, which tracks NumPy/OpenCV output
+buffers) and PSNR/SSIM. ``fast`` rows are compared with ``reference`` at the
+same working resolution, which is what the engine's tolerance covers; the
+capped ``reference`` row is upsampled and compared with the full-resolution
+reference to show what the resolution cap alone costs.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+
+from cartoon import FAST_MIN_PSNR, FAST_MIN_SSIM, cartoonize
+
+MODES = [
+    ('reference', dict(mode='reference')),
+    ('fast', dict(mode='fast')),
+    ('reference@2048', dict(mode='reference', max_dim=2048)),
+    ('fast@2048', dict(mode='fast', max_dim=2048)),
+]
+
+
+def synthetic_photo(width, height, seed=0):
+    """Flat shapes, soft gradients, a periodic texture and sensor-like noise."""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 200, np.uint8)
+    for _ in range(40):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.circle(img, center, int(rng.integers(width // 40, width // 6)), [int(c) for c in rng.integers(0, 255, 3)], -1)
+        corners = [(int(rng.integers(0, width)), int(rng.integers(0, height))) for _ in range(2)]
+        cv2.rectangle(img, corners[0], corners[1], [int(c) for c in rng.integers(0, 255, 3)], -1)
+    img = cv2.GaussianBlur(img, (0, 0), width / 400).astype(np.float32)
+    yy, xx = np.mgrid[0:height, 0:width]
+    img += (np.sin(xx / 7.0) * np.cos(yy / 11.0) * 25)[..., None]
+    img += rng.normal(0, 8, img.shape)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def psnr(a, b):
+    # cv2.PSNR reports a large finite number for identical images.
+    return float('inf') if np.array_equal(a, b) else cv2.PSNR(a, b)
+
+
+def ssim(a, b):
+    a = cv2.cvtColor(a, cv2.COLOR_BGR2GRAY).astype(np.float64)
+    b = cv2.cvtColor(b, cv2.COLOR_BGR2GRAY).astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    blur = lambda x: cv2.GaussianBlur(x, (11, 11), 1.5)
+    mu_a, mu_b = blur(a), blur(b)
+    var_a, var_b = blur(a * a) - mu_a ** 2, blur(b * b) - mu_b ** 2
+    covariance = blur(a * b) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * covariance + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim_map.mean())
+
+
+def run(img, options, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = cartoonize(img, **options)
+        timings.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    cartoonize(img, **options)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, statistics.median(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--sizes', default='640x480,1920x1080,4000x3000')
+    args = parser.parse_args()
+
+    print(f"fast-mode tolerance: PSNR >= {FAST_MIN_PSNR} dB, SSIM >= {FAST_MIN_SSIM}\n")
+    print(f"{'size':<12}{'mode':<16}{'ms/image':>10}{'peak MiB':>10}{'PSNR dB':>9}{'SSIM':>7}  ok")
+    failures = 0
+    for index, size in enumerate(args.sizes.split(',')):
+        width, height = (int(v) for v in size.lower().split('x'))
+        img = synthetic_photo(width, height, seed=index)
+        references = {}
+        for label, options in MODES:
+            result, ms, peak = run(img, options, args.runs)
+            max_dim = options.get('max_dim')
+            if options['mode'] == 'reference':
+                references[max_dim] = result
+                baseline, checked = references[None], False
+            else:
+                baseline, checked = references[max_dim], True
+            if result is baseline:
+                print(f"{size:<12}{label:<16}{ms:>10.1f}{peak / 2**20:>10.1f}{'-':>9}{'-':>7}")
+                continue
+            if result.shape != baseline.shape:
+                result = cv2.resize(result, (baseline.shape[1], baseline.shape[0]), interpolation=cv2.INTER_LINEAR)
+            quality_psnr, quality_ssim = psnr(baseline, result), ssim(baseline, result)
+            within = quality_psnr >= FAST_MIN_PSNR and quality_ssim >= FAST_MIN_SSIM
+            failures += checked and not within
+            flag = ('yes' if within else 'NO') if checked else ''
+            print(f"{size:<12}{label:<16}{ms:>10.1f}{peak / 2**20:>10.1f}{quality_psnr:>9.2f}{quality_ssim:>7.3f}  {flag}")
+    if failures: sys.exit(f"{failures} fast-mode result(s) outside tolerance")
+
+
+if __name__ == '__main__':
+    main()
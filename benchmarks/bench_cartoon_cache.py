@@ -0,0 +1,116 @@
+"""Replays an upload workload with repeats against the cartoon result cache.
+
+    python benchmarks/bench_cartoon_cache.py [--photos 12] [--uploads 60] [--size 1920x1080] [--mode fast]
+
+Builds ``--photos`` distinct synthetic JPEGs and a seeded stream of
+``--uploads`` uploads in which about half are repeats: exact re-uploads of the
+same bytes, lossless PNG copies of the decoded pixels (different bytes, same
+result key) and JPEG re-encodes at another quality (a near-duplicate, so a
+cache miss that the difference-hash index should flag). Each upload goes
+through the same steps as /api/upload-cartoon, inline: upload-hash lookup,
+``render_cartoon`` on a miss, ``ResultCache.store`` and the near-duplicate
+check. The stream is replayed without a cache, with the in-memory tier, and
+with a disk tier, then once more with the disk tier behind an empty memory
+tier (as after a restart or in another worker).
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path[:0] = [os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.path.dirname(os.path.abspath(__file__))]
+
+import cv2
+
+from bench_cartoon import synthetic_photo
+from blob_store import content_hash
+from cartoon import pipeline_variant, render_cartoon
+from cartoon_cache import DiskCache, NearDuplicateIndex, ResultCache
+from imaging import decode_image, read_image_size
+
+MAX_DIM = 2048
+
+
+def encode(image, ext, params=()):
+    return cv2.imencode(ext, image, list(params))[1].tobytes()
+
+
+def build_workload(photos, uploads, width, height, seed=0):
+    """Returns ``[(kind, photo, bytes)]``; kind is first, exact, lossless or reencoded."""
+    rng = random.Random(seed)
+    images = [synthetic_photo(width, height, seed=i) for i in range(photos)]
+    originals = [encode(image, '.jpg', (cv2.IMWRITE_JPEG_QUALITY, 90)) for image in images]
+    variants = {
+        'exact': originals,
+        'lossless': [encode(decode_image(data), '.png') for data in originals],
+        'reencoded': [encode(image, '.jpg', (cv2.IMWRITE_JPEG_QUALITY, 70)) for image in images],
+    }
+    stream, seen = [], []
+    for photo in range(photos):
+        stream.append(('first', photo, originals[photo]))
+        seen.append(photo)
+        while len(stream) < uploads * (photo + 1) // photos:
+            kind = rng.choice(('exact', 'exact', 'lossless', 'reencoded'))
+            repeat = rng.choice(seen)
+            stream.append((kind, repeat, variants[kind][repeat]))
+    return stream
+
+
+def replay(stream, cache, cache_dir, mode):
+    variant = pipeline_variant(mode, MAX_DIM)
+    index = NearDuplicateIndex()
+    timings = {}
+    flagged = {}
+    for number, (kind, photo, data) in enumerate(stream):
+        start = time.perf_counter()
+        upload_hash = content_hash(data)
+        rendered = cache.lookup(upload_hash, variant) or render_cartoon(data, read_image_size(data), mode, MAX_DIM, cache_dir)
+        cache.store(upload_hash, variant, rendered)
+        duplicates = index.find(rendered['phash'])
+        index.add((photo, number), rendered['phash'])
+        timings.setdefault(rendered['cache'], []).append((time.perf_counter() - start) * 1000)
+        flagged.setdefault(kind, []).append(bool(duplicates) and all(match[1][0] == photo for match in duplicates))
+    return timings, flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--photos', type=int, default=12)
+    parser.add_argument('--uploads', type=int, default=60)
+    parser.add_argument('--size', default='1920x1080')
+    parser.add_argument('--mode', default='fast')
+    args = parser.parse_args()
+    width, height = (int(n) for n in args.size.split('x'))
+    stream = build_workload(args.photos, args.uploads, width, height)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        runs = [
+            ('no cache', ResultCache(max_entries=0, max_uploads=0), None),
+            ('memory', ResultCache(), None),
+            ('memory+disk', ResultCache(disk=DiskCache(cache_dir)), cache_dir),
+            ('disk, restarted', ResultCache(disk=DiskCache(cache_dir)), cache_dir),
+        ]
+        print(f"{len(stream)} uploads of {args.photos} {args.size} photos, mode {args.mode}")
+        print(f"{'cache':<17}{'total s':>8}{'hit rate':>9}{'memory':>8}{'disk':>6}{'miss ms':>9}{'hit ms':>8}")
+        for label, cache, directory in runs:
+            start = time.perf_counter()
+            timings, flagged = replay(stream, cache, directory, args.mode)
+            elapsed = time.perf_counter() - start
+            stats = cache.stats()
+            hits = timings.get('memory', []) + timings.get('disk', [])
+            print(f"{label:<17}{elapsed:>8.2f}{stats['hit_rate']:>9.1%}{stats['memory_hits']:>8}{stats['disk_hits']:>6}"
+                  f"{statistics.median(timings['miss']) if timings.get('miss') else 0:>9.1f}"
+                  f"{statistics.median(hits) if hits else 0:>8.1f}")
+
+    print("near-duplicate flags (correct photo only):")
+    for kind, flags in flagged.items():
+        print(f"  {kind:<10}{sum(flags):>4} / {len(flags)}")
+    if any(flagged['first']) or not all(all(flags) for kind, flags in flagged.items() if kind != 'first'):
+        sys.exit('near-duplicate index flagged the wrong uploads')
+
+
+if __name__ == '__main__':
+    main()
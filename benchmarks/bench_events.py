@@ -0,0 +1,151 @@
+"""Load test for the /api/events Server-Sent Events stream.
+
+    python benchmarks/bench_events.py [--connections 100,500,1000] [--messages 200] [--server gevent|threaded]
+
+Starts the app in a child process against the in-memory Firestore fake (with
+a stub token verifier: the bearer token is the uid) and opens idle SSE
+connections in steps, reporting the server's resident memory and thread
+count at each step. With all connections open it sends ``--messages`` chat
+messages through /api/messages/send and measures how long each takes to show
+up on the recipient's stream. ``gevent`` serves every connection on a
+greenlet (as the gunicorn config does); ``threaded`` uses one OS thread per
+connection, like gthread or the Werkzeug dev server.
+"""
+import argparse
+import http.client
+import logging
+import os
+import resource
+import selectors
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def serve(port, server, users):
+    if server == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+    raise_fd_limit()
+    os.chdir(ROOT)
+    import app as A
+    from fake_firestore import FakeFirestore
+    from firestore_tracing import trace_client
+
+    class StubVerifier:
+        def verify(self, token): return {'uid': token, 'exp': time.time() + 3600}
+
+    fake = FakeFirestore()
+    for i in range(users): fake.collection('users').document(f'user{i}').set({'username': f'name{i}'})
+    A.db, A.token_verifier = trace_client(fake), StubVerifier()
+    if server == 'gevent':
+        from gevent.pywsgi import WSGIServer
+        # Like gunicorn's listeners; otherwise small SSE frames wait on delayed ACKs.
+        listener = socket.create_server(('127.0.0.1', port), backlog=2048)
+        listener.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        WSGIServer(listener, A.app, log=None).serve_forever()
+    else:
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        make_server('127.0.0.1', port, A.app, threaded=True).serve_forever()
+
+
+def process_stats(pid):
+    fields = dict(line.split(':', 1) for line in open(f'/proc/{pid}/status'))
+    return int(fields['VmRSS'].split()[0]) / 1024, int(fields['Threads'])
+
+
+def connect(port, uid):
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall(f'GET /api/events?token={uid} HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n'.encode())
+    sock.setblocking(False)
+    return sock
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/favicon.ico')
+            conn.getresponse().read()
+            return
+        except OSError: time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connections', default='100,500,1000')
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--server', choices=('gevent', 'threaded'), default='gevent')
+    parser.add_argument('--port', type=int, default=5057)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--users', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    steps = [int(n) for n in args.connections.split(',')]
+    if args.serve: return serve(args.port, args.server, args.users)
+    if args.server == 'gevent':
+        try: import gevent  # noqa: F401
+        except ImportError: sys.exit('gevent is not installed; pip install gevent or use --server threaded')
+
+    raise_fd_limit()
+    child = subprocess.Popen([sys.executable, __file__, '--serve', '--server', args.server, '--port', str(args.port),
+                              '--users', str(max(steps) + 1)], stdout=subprocess.DEVNULL)
+    try:
+        wait_ready(args.port)
+        selector = selectors.DefaultSelector()
+        buffers = {}
+        rss, threads = process_stats(child.pid)
+        print(f"{'connections':>12}{'server RSS MB':>15}{'KB/conn':>9}{'threads':>9}")
+        print(f"{0:>12}{rss:>15.1f}{'':>9}{threads:>9}")
+        baseline = rss
+        for target in steps:
+            while len(buffers) < target:
+                uid = f'user{len(buffers) + 1}'
+                sock = connect(args.port, uid)
+                selector.register(sock, selectors.EVENT_READ, uid)
+                buffers[uid] = b''
+            time.sleep(1)
+            rss, threads = process_stats(child.pid)
+            print(f"{target:>12}{rss:>15.1f}{(rss - baseline) * 1024 / target:>9.1f}{threads:>9}")
+
+        latencies = []
+        sender = http.client.HTTPConnection('127.0.0.1', args.port)
+        sender.connect()
+        sender.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        for i in range(args.messages):
+            recipient = f'user{i % len(buffers) + 1}'
+            text = f'ping-{i}'
+            sent = time.perf_counter()
+            sender.request('POST', f'/api/messages/send/name{recipient[4:]}', body=f'{{"text": "{text}"}}',
+                           headers={'Authorization': 'Bearer user0', 'Content-Type': 'application/json'})
+            sender.getresponse().read()
+            needle = f'"text": "{text}"'.encode()
+            while needle not in buffers[recipient]:
+                if time.perf_counter() - sent > 10: raise RuntimeError(f'{text} was not delivered')
+                for key, _ in selector.select(timeout=1):
+                    buffers[key.data] += key.fileobj.recv(65536)
+            latencies.append((time.perf_counter() - sent) * 1000)
+            buffers[recipient] = b''
+        latencies.sort()
+        print(f"delivery latency over {len(latencies)} messages (send request included): "
+              f"p50 {statistics.median(latencies):.1f} ms, p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f} ms, "
+              f"max {latencies[-1]:.1f} ms")
+    finally:
+        child.terminate()
+        child.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Compares /explore payload size and render latency for inline base64 images
+versus blob-store references with grid renditions.
+
+    python benchmarks/bench_explore.py [--creations 21] [--size 1024] [--runs 20]
+
+"Page bytes" is the HTML document; "image bytes" is what a browser downloads
+for the grid at the default 512w candidate (inline images cost nothing extra
+because they are already inside the HTML).
+"""
+import argparse
+import base64
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import app as art_weaver
+from blob_store import LocalBlobStore
+from fake_firestore import FakeFirestore
+
+
+def synthetic_image(size, seed):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, size, dtype=np.float32)
+    gradient = np.add.outer(x, x[::-1]) / 2
+    image = np.dstack([gradient, np.roll(gradient, seed * 37, axis=1), gradient.T])
+    image += rng.normal(0, 18, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def seed_creations(db, count, size, inline):
+    for i in range(count):
+        image = synthetic_image(size, i)
+        jpeg = art_weaver.encode_image(image)
+        creation = {'user_id': f'user{i % 5}', 'type': 'text-to-image', 'prompt': f'synthetic scene {i}',
+                    'is_public': True, 'tags': ['bench'], 'timestamp': time.time() + i}
+        if inline:
+            creation['generated_image_b64'] = base64.b64encode(jpeg).decode('utf-8')
+        else:
+            creation['generated_image_hash'] = art_weaver.image_store.put(jpeg)
+            creation['renditions'] = art_weaver.store_renditions(image)
+            creation['generated_image_width'] = image.shape[1]
+        db.collection('creations').document(f'creation{i:04d}').set(creation)
+
+
+def measure(client, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = client.get('/explore')
+        timings.append((time.perf_counter() - start) * 1000)
+    return response, timings
+
+
+def grid_image_bytes(db):
+    total = 0
+    for doc in db.collection('creations').stream():
+        renditions = doc.to_dict().get('renditions')
+        if not renditions: continue
+        image_hash = renditions.get(str(art_weaver.GRID_IMAGE_WIDTH)) or doc.to_dict()['generated_image_hash']
+        total += len(art_weaver.image_store.get(image_hash))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--creations', type=int, default=21)
+    parser.add_argument('--size', type=int, default=1024, help='Edge length of the synthetic source images.')
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    art_weaver.page_cache.enabled = False  # time the render, not the page cache
+    client = art_weaver.app.test_client()
+    with tempfile.TemporaryDirectory() as blob_root:
+        art_weaver.image_store = LocalBlobStore(blob_root)
+        print(f"{'mode':<12}{'page bytes':>14}{'image bytes':>14}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for label, inline in (('before', True), ('after', False)):
+            art_weaver.db = FakeFirestore()
+            seed_creations(art_weaver.db, args.creations, args.size, inline)
+            response, timings = measure(client, args.runs)
+            assert response.status_code == 200, response.status_code
+            # Every card must still show its image, inline or by URL, or the byte counts mean nothing.
+            shown = response.data.count(b'src="data:image/') + response.data.count(b'src="/img/')
+            assert shown >= args.creations, f"{label}: {shown} of {args.creations} creations rendered with an image"
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            print(f"{label:<12}{len(response.data):>14,}{grid_image_bytes(art_weaver.db):>14,}"
+                  f"{statistics.mean(timings):>10.2f}{statistics.median(timings):>10.2f}{p95:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Scaling benchmark for the feed query over growing friend lists.
+
+    python benchmarks/bench_fanout.py [--latency 0.01] [--friends 10,30,100,500,1000,5000]
+
+Runs the /api/feed creation query against the in-memory Firestore fake (which
+enforces the 30-value ``in`` limit and sleeps ``latency`` per round trip) using
+a single ``in`` query, sequential chunk queries, and ``query_in``'s concurrent
+chunks with a k-way merge. Each result is checked against a brute-force top 20.
+The fake filters in-process, so with thousands of friends on few cores its own
+CPU time starts to dominate the simulated network latency.
+"""
+import argparse
+import heapq
+import itertools
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_firestore import FakeFirestore
+from firestore_queries import IN_QUERY_LIMIT, chunked, query_in
+
+FEED_LIMIT = 20
+
+
+def seed(db, friends, per_friend):
+    rng = random.Random(friends)
+    expected = []
+    for i in range(friends):
+        for j in range(per_friend):
+            timestamp = rng.random()
+            is_public = j % 3 != 2
+            db.collection('creations').document(f'f{i}c{j}').set({'user_id': f'friend{i}', 'is_public': is_public, 'timestamp': timestamp})
+            if is_public: expected.append((timestamp, f'f{i}c{j}'))
+    return [doc_id for _, doc_id in heapq.nlargest(FEED_LIMIT, expected)]
+
+
+def base_query(db):
+    return db.collection('creations').where('is_public', '==', True)
+
+
+def single_query(db, friend_ids):
+    query = base_query(db).where('user_id', 'in', friend_ids).order_by('timestamp', direction='DESCENDING').limit(FEED_LIMIT)
+    return list(query.stream())
+
+
+def sequential_chunks(db, friend_ids):
+    results = []
+    for chunk in chunked(friend_ids, IN_QUERY_LIMIT):
+        query = base_query(db).where('user_id', 'in', chunk).order_by('timestamp', direction='DESCENDING').limit(FEED_LIMIT)
+        results.append(list(query.stream()))
+    merged = heapq.merge(*results, key=lambda doc: doc.get('timestamp'), reverse=True)
+    return list(itertools.islice(merged, FEED_LIMIT))
+
+
+def parallel_chunks(db, friend_ids):
+    return query_in(lambda: base_query(db), 'user_id', friend_ids, order_by='timestamp', descending=True, limit=FEED_LIMIT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.01, help='Simulated round-trip latency (s).')
+    parser.add_argument('--friends', default='10,30,100,500,1000,5000')
+    parser.add_argument('--per-friend', type=int, default=3, help='Creations per friend.')
+    args = parser.parse_args()
+
+    print(f"{'friends':>8}  {'strategy':<20}{'ms':>10}{'queries':>9}  result")
+    for friends in (int(n) for n in args.friends.split(',')):
+        db = FakeFirestore()
+        expected = seed(db, friends, args.per_friend)
+        db.latency = args.latency
+        friend_ids = [f'friend{i}' for i in range(friends)]
+        for label, strategy in (('single in-query', single_query), ('sequential chunks', sequential_chunks),
+                                ('parallel chunks', parallel_chunks)):
+            db.reset_counters()
+            start = time.perf_counter()
+            try:
+                docs = strategy(db, friend_ids)
+                outcome = 'correct' if [doc.id for doc in docs] == expected else 'WRONG ORDER/LIMIT'
+            except ValueError as e:
+                outcome = f'error: {e}'
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"{friends:>8}  {label:<20}{elapsed:>10.1f}{db.round_trips['query']:>9}  {outcome}")
+
+
+if __name__ == '__main__':
+    main()
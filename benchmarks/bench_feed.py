@@ -0,0 +1,80 @@
+"""Fan-out-on-read vs fan-out-on-write home feed.
+
+    python benchmarks/bench_feed.py [--latency 0.01] [--friends 10,100,1000] [--threshold 500]
+
+For each friend count, seeds friends with public creations and measures one
+/api/feed page built by querying every friend's creations (``read`` mode)
+against reading the precomputed timeline (``fanout`` mode), plus the writes a
+single publish costs in ``fanout`` mode. Friends above ``--threshold`` are
+celebrities and stay on the read path.
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_firestore import FakeFirestore
+from feeds import FeedService
+from firestore_queries import query_in
+from users import UserDirectory
+
+FEED_LIMIT = 20
+EPOCH = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def seed(db, friends, per_friend):
+    friend_ids = [f'friend{i}' for i in range(friends)]
+    db.collection('users').document('reader').set({'username': 'reader', 'friends': friend_ids})
+    for i, friend in enumerate(friend_ids):
+        db.collection('users').document(friend).set({'username': friend, 'friends': ['reader']})
+        for j in range(per_friend):
+            db.collection('creations').document(f'{friend}c{j}').set({
+                'user_id': friend, 'is_public': True, 'tags': [], 'timestamp': EPOCH + datetime.timedelta(seconds=i * per_friend + j)})
+
+
+def read_mode(db, users):
+    friends = db.collection('users').document('reader').get().to_dict()['friends']
+    docs = query_in(lambda: db.collection('creations').where('is_public', '==', True), 'user_id', friends,
+                    order_by='timestamp', descending=True, limit=FEED_LIMIT)
+    users.get_profiles({doc.get('user_id') for doc in docs})
+    return [doc.id for doc in docs]
+
+
+def timed(db, fn):
+    db.reset_counters()
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000, dict(db.round_trips)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.01, help='Simulated round-trip latency (s).')
+    parser.add_argument('--friends', default='10,100,1000')
+    parser.add_argument('--per-friend', type=int, default=2, help='Public creations per friend.')
+    parser.add_argument('--threshold', type=int, default=500, help='Celebrity threshold (friends of the creator).')
+    args = parser.parse_args()
+
+    print(f"{'friends':>8}  {'strategy':<16}{'ms':>9}{'reads':>7}{'queries':>9}{'writes':>8}  result")
+    for friends in (int(n) for n in args.friends.split(',')):
+        db = FakeFirestore()
+        seed(db, friends, args.per_friend)
+        users = UserDirectory(lambda: db, ttl=0)
+        feed = FeedService(lambda: db, users, celebrity_threshold=args.threshold)
+        feed.rebuild('reader', [f'friend{i}' for i in range(friends)])
+        db.latency = args.latency
+        expected, elapsed, trips = timed(db, lambda: read_mode(db, users))
+        print(f"{friends:>8}  {'fan-out on read':<16}{elapsed:>9.1f}{trips['read']:>7}{trips['query']:>9}{trips['write']:>8}")
+        items, elapsed, trips = timed(db, lambda: [item['id'] for item in feed.read('reader', FEED_LIMIT)])
+        outcome = 'matches' if items == expected else 'DIFFERS'
+        print(f"{friends:>8}  {'fan-out on write':<16}{elapsed:>9.1f}{trips['read']:>7}{trips['query']:>9}{trips['write']:>8}  {outcome}")
+        creation = {'user_id': 'reader', 'is_public': True, 'tags': [], 'timestamp': EPOCH}
+        fanned, elapsed, trips = timed(db, lambda: feed.publish('new', creation))
+        print(f"{friends:>8}  {'publish':<16}{elapsed:>9.1f}{trips['read']:>7}{trips['query']:>9}{trips['write']:>8}  {fanned} timelines")
+
+
+if __name__ == '__main__':
+    main()
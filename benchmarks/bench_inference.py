@@ -0,0 +1,72 @@
+"""Compares the pooled InferenceClient with the previous one-off requests.post
+calls against a local fake inference server.
+
+    python benchmarks/bench_inference.py [--latency 0.05] [--requests 40]
+
+Scenarios: distinct prompts in sequence (connection reuse), concurrent
+identical prompts (coalescing), a repeated prompt (result cache) and a
+cold-starting model (503 + estimated_time retries).
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from fake_inference_server import FakeInferenceServer
+from inference import DEFAULT_MODEL, InferenceClient, InferenceError
+
+
+def naive_generate(server, prompt):
+    response = requests.post(server.base_url + DEFAULT_MODEL, headers={'Authorization': 'Bearer test'}, json={'inputs': prompt})
+    if response.status_code != 200: raise InferenceError(response.json().get('error'), response.status_code)
+    return response.content
+
+
+def client_generate(server, cache_entries=128):
+    client = InferenceClient('test', base_url=server.base_url, cache_entries=cache_entries, backoff_base=0.05)
+    return client.generate
+
+
+def run(server, generate, prompts, concurrency=1, loading_responses=0):
+    server.reset(loading_responses)
+    failures = 0
+    start = time.perf_counter()
+
+    def call(prompt):
+        nonlocal failures
+        try: generate(prompt)
+        except InferenceError: failures += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool: list(pool.map(call, prompts))
+    elapsed = (time.perf_counter() - start) * 1000
+    return elapsed, server.requests, len(server.connections), failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.05, help='Fake server latency per image (s).')
+    parser.add_argument('--requests', type=int, default=40)
+    args = parser.parse_args()
+    server = FakeInferenceServer(latency=args.latency).start()
+    n = args.requests
+    scenarios = [
+        ('distinct, sequential', [f'prompt {i}' for i in range(n)], 1, 0),
+        ('identical, concurrent', ['a cat in space'] * n, 16, 0),
+        ('repeated, sequential', ['  A cat   in space '] * n, 1, 0),
+        ('cold model (2x 503)', ['a cold start'], 1, 2),
+    ]
+    print(f"{'scenario':<24}{'client':<10}{'total ms':>10}{'upstream':>10}{'conns':>7}{'failed':>8}")
+    for label, prompts, concurrency, loading in scenarios:
+        for name, generate in (('naive', lambda p: naive_generate(server, p)), ('pooled', client_generate(server))):
+            elapsed, upstream, connections, failures = run(server, generate, prompts, concurrency, loading)
+            print(f"{label:<24}{name:<10}{elapsed:>10.1f}{upstream:>10}{connections:>7}{failures:>8}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
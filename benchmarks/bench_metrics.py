@@ -0,0 +1,78 @@
+"""Cost of the request instrumentation and of scraping /metrics.
+
+    python benchmarks/bench_metrics.py [--requests 2000] [--routes 50]
+
+Reports the per-request overhead of the metrics hooks (timer, latency
+histogram, Firestore counters) on a template route and on a route that makes
+one Firestore query, by serving each with and without the hooks through the
+Flask test client; the per-call overhead of Firestore tracing on a document
+read against the in-memory fake; and how long rendering /metrics takes once
+``--routes`` distinct routes have been recorded.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path[:0] = [os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.path.dirname(os.path.abspath(__file__))]
+
+import app as art_weaver
+from fake_firestore import FakeFirestore
+from firestore_tracing import trace_client
+from metrics import Registry
+
+HOOKS = ('start_request_timer', 'record_request_metrics')
+
+
+def per_call_us(call, runs):
+    samples = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(runs): call()
+        samples.append((time.perf_counter() - start) / runs * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--routes', type=int, default=50)
+    args = parser.parse_args()
+    hooks = (art_weaver.app.before_request_funcs[None], art_weaver.app.after_request_funcs[None])
+    variants = {True: [list(funcs) for funcs in hooks],
+                False: [[hook for hook in funcs if hook.__name__ not in HOOKS] for funcs in hooks]}
+    fake = FakeFirestore()
+    fake.collection('users').document('alice').set({'uid': 'alice', 'username': 'alice'})
+    art_weaver.db = trace_client(fake)
+    art_weaver.verify_firebase_token = lambda request, **kwargs: {'uid': 'alice'}
+    client = art_weaver.app.test_client()
+
+    print(f"{'request':<24}{'without us':>12}{'with us':>10}{'overhead':>10}")
+    for label, url in (('template (/)', '/'), ('firestore query', '/api/user/creations')):
+        timings = {False: [], True: []}
+        for _ in range(3):  # alternate so warm-up and drift do not favour either side
+            for enabled in (False, True):
+                for funcs, variant in zip(hooks, variants[enabled]): funcs[:] = variant
+                client.get(url)
+                timings[enabled].append(per_call_us(lambda: client.get(url), args.requests // 15))
+        timings = {enabled: min(samples) for enabled, samples in timings.items()}
+        print(f"{label:<24}{timings[False]:>12.1f}{timings[True]:>10.1f}{timings[True] - timings[False]:>10.1f}")
+
+    document = fake.collection('users').document('alice')
+    traced = art_weaver.db.collection('users').document('alice')
+    raw, wrapped = per_call_us(document.get, args.requests), per_call_us(traced.get, args.requests)
+    print(f"\nfirestore document get: {raw:.1f} us raw, {wrapped:.1f} us traced (+{wrapped - raw:.1f} us)")
+
+    registry = Registry()
+    latency = registry.histogram('http_request_duration_seconds', 'bench')
+    for i in range(args.routes):
+        for status in (200, 404): latency.observe(0.01 * (i % 7), route=f'/route/{i}', method='GET', status=status)
+    start = time.perf_counter()
+    text = registry.render()
+    print(f"/metrics with {args.routes * 2} latency series: {len(text.splitlines())} lines, "
+          f"rendered in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
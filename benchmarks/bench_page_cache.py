@@ -0,0 +1,96 @@
+"""Public page latency with and without the page cache.
+
+    python benchmarks/bench_page_cache.py [--latency 0.01] [--runs 50] [--requests 2000]
+
+Drives /explore, /user/<username> and /creation/<id> through the Flask test
+client against the in-memory Firestore fake (``--latency`` seconds per round
+trip) and reports p50/p95 latency and Firestore round trips per request for an
+uncached render, a cache hit and an ``If-None-Match`` revalidation (304). The
+mixed run then replays ``--requests`` page views spread Zipf-like over the
+creation pages while one in fifty requests publishes or hides a creation, and
+reports the resulting hit rate and mean render time from ``page_cache.stats()``.
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path[:0] = [os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.path.dirname(os.path.abspath(__file__))]
+
+import app as art_weaver
+from fake_firestore import FakeFirestore
+
+USERS = 20
+CREATIONS = 400
+
+
+def seed(db):
+    base = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    for u in range(USERS):
+        db.collection('users').document(f'user{u}').set({'uid': f'user{u}', 'username': f'artist{u}', 'points': u})
+    for i in range(CREATIONS):
+        db.collection('creations').document(f'creation{i:04d}').set({
+            'user_id': f'user{i % USERS}', 'type': 'text-to-image', 'prompt': f'synthetic scene {i}', 'is_public': i % 5 != 0,
+            'tags': ['bench'], 'timestamp': base + datetime.timedelta(minutes=i), 'generated_image_hash': f'{i:064x}'})
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def timed(client, db, url, runs, headers=None):
+    timings, before = [], sum(db.round_trips.values())
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        timings.append((time.perf_counter() - start) * 1000)
+    return response, timings, (sum(db.round_trips.values()) - before) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+    art_weaver.db = db = FakeFirestore(latency=args.latency)
+    art_weaver.verify_firebase_token = lambda request, **kwargs: {'uid': request.headers['X-Bench-User']}
+    seed(db)
+    client = art_weaver.app.test_client()
+    cache = art_weaver.page_cache
+
+    print(f"{'page':<16}{'mode':<12}{'p50 ms':>9}{'p95 ms':>9}{'trips':>7}")
+    for url in ('/explore', '/user/artist3', '/creation/creation0001'):
+        cache.enabled = False
+        _, uncached, uncached_trips = timed(client, db, url, args.runs)
+        cache.enabled = True
+        response, _, _ = timed(client, db, url, 1)
+        _, hits, hit_trips = timed(client, db, url, args.runs)
+        not_modified, revalidated, _ = timed(client, db, url, args.runs, {'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 200 and not_modified.status_code == 304
+        for mode, timings, trips in (('uncached', uncached, uncached_trips), ('hit', hits, hit_trips), ('304', revalidated, 0)):
+            print(f"{url.split('/')[1] or url:<16}{mode:<12}{statistics.median(timings):>9.2f}{percentile(timings, 0.95):>9.2f}{trips:>7.1f}")
+
+    before = cache.stats()['view_creation']
+    rng = random.Random(0)
+    weights = [1 / (rank + 1) for rank in range(CREATIONS)]
+    start = time.perf_counter()
+    for n in range(args.requests):
+        i = rng.choices(range(CREATIONS), weights)[0]
+        if n % 50 == 49:
+            client.post(f'/api/creations/creation{i:04d}', json={'is_public': rng.random() < 0.8, 'tags': 'bench'},
+                        headers={'X-Bench-User': f'user{i % USERS}'})
+        else: client.get(f'/creation/creation{i:04d}')
+    elapsed = time.perf_counter() - start
+    stats = {name: value - before[name] for name, value in cache.stats()['view_creation'].items()}
+    served = stats['hits'] + stats['stale'] + stats['misses']
+    print(f"\nmixed: {args.requests} requests in {elapsed:.1f} s, hit rate {(served - stats['misses']) / served:.1%}, "
+          f"{stats['renders']} renders averaging {stats['render_seconds'] / max(1, stats['renders']) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
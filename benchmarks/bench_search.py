@@ -0,0 +1,106 @@
+"""Explore search index build, persistence and query latency by corpus size.
+
+    python benchmarks/bench_search.py [--sizes 10000,100000,1000000] [--queries 200]
+
+Indexes a synthetic corpus of public creations (tags and prompts drawn from a
+Zipf-distributed vocabulary, so common words have long postings) and reports
+build time, the index's memory, save/load time and file size, then the
+p50/p95 latency of ranked page-one queries of several shapes and of a page-two
+request through its cursor.
+"""
+import argparse
+import itertools
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import SearchIndex
+
+VOCABULARY_SIZE = 20000
+TAG_VOCABULARY = 2000
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'ze', 'an', 'el', 'or', 'ust', 'ing', 'ar', 'qu']
+
+
+def make_vocabulary(rng):
+    words = set()
+    while len(words) < VOCABULARY_SIZE: words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words, key=lambda word: rng.random())
+
+
+def corpus(size, vocabulary, seed=0):
+    rng = random.Random(seed)
+    weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    tag_weights = weights[:TAG_VOCABULARY]
+    for i in range(size):
+        yield f'creation{i:08d}', {
+            'is_public': True, 'timestamp': 1.7e9 + i * 13.0,
+            'tags': rng.choices(vocabulary[:TAG_VOCABULARY], cum_weights=tag_weights, k=rng.randint(0, 4)),
+            'prompt': ' '.join(rng.choices(vocabulary, cum_weights=weights, k=rng.randint(4, 12))) if i % 3 == 0 else '',
+        }
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def time_queries(index, queries, after=False):
+    latencies = []
+    for query in queries:
+        cursor = index.search(query, 21)[1] if after else None
+        if after and not cursor: continue
+        start = time.perf_counter()
+        index.search(query, 21, cursor)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    rng = random.Random(1)
+    vocabulary = make_vocabulary(rng)
+    shapes = {
+        'common word': lambda: rng.choice(vocabulary[:10]),
+        'rare word': lambda: rng.choice(vocabulary[5000:]),
+        'two words': lambda: f'{rng.choice(vocabulary[:200])} {rng.choice(vocabulary[:2000])}',
+        'prefix': lambda: rng.choice(vocabulary[:500])[:3],
+        'typo': lambda: (lambda word: word[:-1] + 'x')(rng.choice([word for word in vocabulary[:500] if len(word) > 5])),
+    }
+
+    for size in (int(n) for n in args.sizes.split(',')):
+        before = rss_mb()
+        index = SearchIndex()
+        start = time.perf_counter()
+        for creation_id, data in corpus(size, vocabulary): index.add_creation(creation_id, data)
+        build = time.perf_counter() - start
+        grown = rss_mb() - before
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.npz')
+            start = time.perf_counter(); index.save(path); save = time.perf_counter() - start
+            file_mb = os.path.getsize(path) / 1e6
+            start = time.perf_counter(); SearchIndex(path).load(); load = time.perf_counter() - start
+        print(f"\n{size:,} creations: build {build:.1f} s, +{grown:.0f} MB peak RSS, "
+              f"save {save:.2f} s / load {load:.2f} s, {file_mb:.1f} MB on disk")
+        print(f"  {'query':<14}{'p50 ms':>8}{'p95 ms':>8}")
+        for shape, make in shapes.items():
+            latencies = time_queries(index, [make() for _ in range(args.queries)])
+            print(f"  {shape:<14}{statistics.median(latencies):>8.2f}{percentile(latencies, 0.95):>8.2f}")
+        latencies = time_queries(index, [shapes['common word']() for _ in range(args.queries)], after=True)
+        print(f"  {'page two':<14}{statistics.median(latencies):>8.2f}{percentile(latencies, 0.95):>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Gunicorn time-to-first-request and per-worker memory, eager vs lazy start-up.
+
+    python benchmarks/bench_startup.py [--workers 2] [--worker-class gevent] [--runs 3]
+
+Starts gunicorn with ``--workers`` workers in three ways and reports the time
+from launch until the first request for ``/`` is answered, then the mean
+worker RSS and PSS (its proportional share of the pages it shares with the
+master and its siblings) once all workers have booted:
+
+- eager: what every worker did before — import OpenCV, NumPy, the Firebase
+  SDK and requests, load the search index and connect to Firestore at import
+  time (``eager_app`` below reproduces it);
+- lazy: the default, where workers defer all of that to first use;
+- preload: GUNICORN_PRELOAD=1, where the master does the slow imports once and
+  forks workers that share them.
+
+Firestore is not configured here, so connecting fails fast; with credentials
+the eager row also pays the connection set-up in every worker.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+
+def eager_app():
+    import app
+    app.preload()
+    app.db.get()
+    app.token_verifier.get()
+    return app.app
+
+
+def worker_pids(master):
+    pids = []
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit(): continue
+        try:
+            with open(f'/proc/{pid}/stat') as f: parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except OSError: continue
+        if parent == master: pids.append(int(pid))
+    return pids
+
+
+def memory_mb(pid):
+    """Returns ``(rss, pss)`` in MB from ``/proc/<pid>/smaps_rollup``."""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if name in ('Rss', 'Pss'): values[name] = int(rest.split()[0]) / 1024
+    return values['Rss'], values['Pss']
+
+
+def start(mode, port, workers, worker_class):
+    env = dict(os.environ, PORT=str(port), GUNICORN_WORKER_CLASS=worker_class,
+               GUNICORN_PRELOAD='1' if mode == 'preload' else '', PYTHONPATH=os.pathsep.join(sys.path[:2]))
+    target = 'bench_startup:eager_app()' if mode == 'eager' else 'app:app'
+    # --workers rather than WEB_CONCURRENCY: start-up cost does not need the Redis backends that the config
+    # insists on for more than one worker.
+    command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'), '--workers', str(workers), target]
+    return subprocess.Popen(command,
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def measure(mode, port, workers, worker_class):
+    launched = time.perf_counter()
+    server = start(mode, port, workers, worker_class)
+    try:
+        while True:
+            if time.perf_counter() - launched > 60: raise RuntimeError(f'{mode}: no worker came up')
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=5) as response: response.read()
+                break
+            except OSError: time.sleep(0.01)
+        ready = time.perf_counter() - launched
+        time.sleep(2)  # let the remaining workers finish booting
+        memory = [memory_mb(pid) for pid in worker_pids(server.pid)]
+        return ready, memory
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--worker-class', default='gevent')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--port', type=int, default=5099)
+    args = parser.parse_args()
+    print(f"{args.workers} {args.worker_class} workers, median of {args.runs} runs")
+    print(f"{'mode':<10}{'ready s':>9}{'RSS MB':>9}{'PSS MB':>9}")
+    for mode in ('eager', 'lazy', 'preload'):
+        runs = [measure(mode, args.port, args.workers, args.worker_class) for _ in range(args.runs)]
+        rss = statistics.median(statistics.mean(r for r, _ in memory) for _, memory in runs)
+        pss = statistics.median(statistics.mean(p for _, p in memory) for _, memory in runs)
+        print(f"{mode:<10}{statistics.median(ready for ready, _ in runs):>9.2f}{rss:>9.1f}{pss:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Write round trips per endpoint before and after batching, plus a contention run.
+
+    python benchmarks/bench_writes.py [--latency 0.01] [--threads 8]
+
+Drives the app's mutation endpoints through the Flask test client against the
+in-memory Firestore fake and compares their round trips and latency with the
+sequential writes they used to make (replayed here directly against the
+fake). "trips" also counts the endpoints' reads, and both sides make the same
+ones: the replay includes send_message's recipient lookup, and the user
+directory's cache is emptied before each endpoint runs. The profile read
+send_message does afterwards to publish chat events is not part of the write
+path and is reported on its own row. The contention run has ``--threads`` clients publish
+the same private creation at once: its 10 points must still be awarded
+exactly once, with losing writers retried on the ``last_update_time``
+precondition.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+from fake_firestore import FakeFirestore
+from google.cloud.firestore_v1 import transforms
+
+
+def seed(db):
+    for uid in ('alice', 'bob'):
+        db.collection('users').document(uid).set({'username': uid, 'points': 0, 'friends': [],
+                                                  'friendRequests': {'sent': [], 'received': []}})
+    db.collection('creations').document('art').set({'user_id': 'alice', 'is_public': False, 'tags': []})
+
+
+def legacy(db):
+    """The pre-batching write sequences, one round trip per call."""
+    users = db.collection('users')
+    creation = db.collection('creations').document('art')
+    return {
+        'save creation': lambda: (users.document('alice').update({'points': transforms.Increment(1)}),
+                                  db.collection('creations').add({'user_id': 'alice', 'is_public': False})),
+        'update_creation': lambda: (creation.get(), creation.update({'is_public': True, 'tags': []}),
+                                    users.document('alice').update({'points': transforms.Increment(10)})),
+        'handle_friend_request': lambda: (
+            users.document('alice').update({'friendRequests.received': transforms.ArrayRemove(['bob'])}),
+            users.document('bob').update({'friendRequests.sent': transforms.ArrayRemove(['alice'])}),
+            users.document('alice').update({'friends': transforms.ArrayUnion(['bob'])}),
+            users.document('bob').update({'friends': transforms.ArrayUnion(['alice'])})),
+        'send_message': lambda: (list(users.where('username', '==', 'bob').limit(1).stream()),
+                                 db.collection('chats').document('alice_bob').collection('messages').add({'text': 'hi'}),
+                                 db.collection('chats').document('alice_bob').set({'lastMessage': 'hi'}, merge=True)),
+    }
+
+
+def batched(A, client):
+    return {
+        'save creation': lambda: A.save_cartoon_creation('alice', b'original', 'upload', {
+            'jpeg': b'cartoon', 'renditions': {}, 'width': 1, 'key': 'key', 'phash': 0, 'cache': 'miss'}),
+        'update_creation': lambda: client.post('/api/creations/art', json={'is_public': True, 'tags': ''}),
+        'handle_friend_request': lambda: client.post('/api/friends/handle/bob', json={'action': 'accept'}),
+        'send_message': lambda: client.post('/api/messages/send/bob', json={'text': 'hi'}),
+    }
+
+
+def counted(db, action):
+    writes, trips = db.round_trips['write'], sum(db.round_trips.values())
+    start = time.perf_counter()
+    action()
+    return (time.perf_counter() - start) * 1000, db.round_trips['write'] - writes, sum(db.round_trips.values()) - trips
+
+
+def measure(db, action):
+    db.reset_counters()
+    return counted(db, action)
+
+
+def contention(A, db, threads):
+    seed(db)
+    client = A.app.test_client()
+    barrier = threading.Barrier(threads)
+    statuses = []
+
+    def publish():
+        barrier.wait()
+        statuses.append(client.post('/api/creations/art', json={'is_public': True, 'tags': ''}).status_code)
+
+    workers = [threading.Thread(target=publish) for _ in range(threads)]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join()
+    points = db.collection('users').document('alice').get().to_dict()['points']
+    return statuses, points
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.01, help='Simulated round-trip latency (s).')
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    import app as A
+    from firestore_tracing import trace_client
+    from firestore_writes import write_latency
+    A.verify_firebase_token = lambda request, **kwargs: {'uid': 'alice'}
+    A.image_store.put = lambda data, key=None: '0' * 64
+    A.firestore.SERVER_TIMESTAMP  # import the lazily loaded SDK outside the timings
+    published = []
+    publish_message = A.publish_message
+    A.publish_message = lambda *args: published.append(counted(after_db, lambda: publish_message(*args)))
+
+    print(f"{'endpoint':<24}{'before ms':>10}{'writes':>8}{'trips':>7}{'after ms':>10}{'writes':>8}{'trips':>7}")
+    before_db, after_db = FakeFirestore(), FakeFirestore()
+    seed(before_db); seed(after_db)
+    before_db.latency = after_db.latency = args.latency
+    A.db = trace_client(after_db)
+    client = A.app.test_client()
+    client.get('/api/firebase-config')
+    time.sleep(1)  # the first request starts the search-index follower, which imports NumPy; keep that out of the timings
+    before, after = legacy(before_db), batched(A, client)
+    for name in before:
+        old_ms, old_writes, old_trips = measure(before_db, before[name])
+        A.user_directory.uids.clear(); A.user_directory.profiles.clear()
+        published.clear()
+        new_ms, new_writes, new_trips = measure(after_db, after[name])
+        for ms, writes, trips in published: new_ms, new_writes, new_trips = new_ms - ms, new_writes - writes, new_trips - trips
+        print(f"{name:<24}{old_ms:>10.1f}{old_writes:>8}{old_trips:>7}{new_ms:>10.1f}{new_writes:>8}{new_trips:>7}")
+        for ms, writes, trips in published:
+            print(f"{'  + publish_message':<24}{'-':>10}{'-':>8}{'-':>7}{ms:>10.1f}{writes:>8}{trips:>7}")
+
+    db = FakeFirestore(latency=args.latency)
+    A.db = trace_client(db)
+    statuses, points = contention(A, db, args.threads)
+    retries = write_latency.as_dict()['update_creation']['retries']
+    outcome = 'ok' if points == 10 and set(statuses) == {200} else 'WRONG'
+    print(f"\n{args.threads} concurrent publishes: statuses {sorted(set(statuses))}, points {points} (expected 10), "
+          f"{retries} retries  {outcome}")
+    for endpoint, stats in sorted(write_latency.as_dict().items()):
+        print(f"  {endpoint:<24}{stats['commits']:>4} commits, mean {stats['seconds'] / stats['commits'] * 1000:.1f} ms, "
+              f"max {stats['max_seconds'] * 1000:.1f} ms")
+    if outcome != 'ok': sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
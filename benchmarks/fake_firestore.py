@@ -0,0 +1,318 @@
+"""A small in-memory stand-in for the Firestore client used by the benchmarks.
+
+It implements the subset of the google-cloud-firestore API that app.py relies
+on (collections, documents, simple queries, batches, transforms) and counts
+round trips so benchmarks can compare access patterns without a network.
+"""
+import copy
+import datetime
+import itertools
+import threading
+import time
+
+from google.api_core.exceptions import FailedPrecondition
+from google.cloud.firestore_v1 import transforms
+
+DOCUMENT_ID = '__name__'
+DESCENDING = 'DESCENDING'
+_auto_ids = itertools.count(1)
+
+
+def _get_path(data, path):
+    for part in path.split('.'):
+        if not isinstance(data, dict) or part not in data: return None
+        data = data[part]
+    return data
+
+
+def _set_path(data, path, value):
+    parts = path.split('.')
+    for part in parts[:-1]: data = data.setdefault(part, {})
+    current = data.get(parts[-1])
+    if value is transforms.DELETE_FIELD: data.pop(parts[-1], None)
+    elif value is transforms.SERVER_TIMESTAMP: data[parts[-1]] = datetime.datetime.now(datetime.timezone.utc)
+    elif isinstance(value, transforms.Increment): data[parts[-1]] = (current or 0) + value.value
+    elif isinstance(value, transforms.ArrayUnion):
+        current = list(current or [])
+        data[parts[-1]] = current + [v for v in value.values if v not in current]
+    elif isinstance(value, transforms.ArrayRemove):
+        data[parts[-1]] = [v for v in (current or []) if v not in value.values]
+    else: data[parts[-1]] = copy.deepcopy(value)
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, fields=None, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.update_time = update_time
+        self._data = data
+        self._fields = fields
+
+    def to_dict(self):
+        if self._data is None: return None
+        data = copy.deepcopy(self._data)
+        if self._fields is not None: data = {k: v for k, v in data.items() if k in self._fields}
+        return data
+
+    def get(self, field):
+        return _get_path(self._data or {}, field)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def collection(self, name):
+        return FakeCollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None):
+        self._client._round_trip('read')
+        return self._snapshot(field_paths)
+
+    def _snapshot(self, field_paths=None):
+        with self._client._lock:
+            data = copy.deepcopy(self._client._docs.get(self.path))
+            return FakeSnapshot(self, data, field_paths, self._client._update_times.get(self.path))
+
+    def set(self, data, merge=False):
+        self._client._round_trip('write')
+        self._apply_set(data, merge)
+
+    def _apply_set(self, data, merge=False):
+        with self._client._lock:
+            doc = self._client._docs.get(self.path) if merge else None
+            doc = doc if doc is not None else {}
+            for key, value in data.items(): _set_path(doc, key, value)
+            self._client._docs[self.path] = doc
+            self._client._touch(self.path)
+        self._client._notify(self.path)
+
+    def create(self, data):
+        self._client._round_trip('write')
+        self._apply_set(data)
+
+    def update(self, data):
+        self._client._round_trip('write')
+        self._apply_update(data)
+
+    def _apply_update(self, data):
+        with self._client._lock:
+            doc = self._client._docs.get(self.path)
+            if doc is None: raise KeyError(f"No document to update: {self.path}")
+            for key, value in data.items(): _set_path(doc, key, value)
+            self._client._touch(self.path)
+        self._client._notify(self.path)
+
+    def delete(self):
+        self._client._round_trip('write')
+        self._apply_delete()
+
+    def _apply_delete(self):
+        with self._client._lock:
+            self._client._docs.pop(self.path, None)
+            self._client._update_times.pop(self.path, None)
+        self._client._notify(self.path)
+
+
+class FakeQuery:
+    def __init__(self, client, path, filters=(), orders=(), limit=None, fields=None, cursor=None):
+        self._client = client
+        self._path = path
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit
+        self._fields = fields
+        self._cursor = cursor
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, limit=self._limit,
+                     fields=self._fields, cursor=self._cursor)
+        state.update(changes)
+        return FakeQuery(self._client, self._path, **state)
+
+    def where(self, field=None, op=None, value=None, filter=None):
+        if filter is not None: field, op, value = filter.field_path, filter.op_string, filter.value
+        if op in ('in', 'array-contains-any') and len(value) > self._client.in_limit:
+            raise ValueError(f"'{op}' filters support at most {self._client.in_limit} values")
+        return self._copy(filters=self._filters + [(field, op, value)])
+
+    def order_by(self, field, direction='ASCENDING'):
+        return self._copy(orders=self._orders + [(field, direction)])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._client, f"{self._path}/{doc_id or 'auto%08d' % next(_auto_ids)}")
+
+    def _value(self, doc_path, data, field):
+        return doc_path.rsplit('/', 1)[-1] if field == DOCUMENT_ID else _get_path(data, field)
+
+    def _matches(self, doc_path, data):
+        for field, op, value in self._filters:
+            actual = self._value(doc_path, data, field)
+            if op == '==' and actual != value: return False
+            if op == 'in' and actual not in value: return False
+            if op == 'array-contains' and value not in (actual or []): return False
+            if op == 'array-contains-any' and not set(value) & set(actual or []): return False
+            if op in ('>=', '<=', '>', '<'):
+                if actual is None: return False
+                if op == '>=' and not actual >= value: return False
+                if op == '<=' and not actual <= value: return False
+                if op == '>' and not actual > value: return False
+                if op == '<' and not actual < value: return False
+        return True
+
+    def _after_cursor(self, doc_path, data):
+        for field, direction in self._orders:
+            if field not in self._cursor: return False
+            value, bound = self._value(doc_path, data, field), self._cursor[field]
+            if value == bound: continue
+            if value is None: return direction == DESCENDING
+            return value < bound if direction == DESCENDING else value > bound
+        return False
+
+    def _results(self):
+        prefix = self._path + '/'
+        with self._client._lock:
+            docs = [(path, data) for path, data in self._client._docs.items()
+                    if path.startswith(prefix) and '/' not in path[len(prefix):] and self._matches(path, data)]
+        docs.sort(key=lambda item: item[0])
+        for field, direction in reversed(self._orders):
+            docs.sort(key=lambda item: (self._value(item[0], item[1], field) is None, self._value(item[0], item[1], field)),
+                      reverse=direction == DESCENDING)
+        if isinstance(self._cursor, dict):
+            docs = [item for item in docs if self._after_cursor(*item)]
+        elif self._cursor is not None:
+            paths = [path for path, _ in docs]
+            if self._cursor.reference.path in paths: docs = docs[paths.index(self._cursor.reference.path) + 1:]
+        if self._limit is not None: docs = docs[:self._limit]
+        return [FakeSnapshot(FakeDocumentReference(self._client, path), copy.deepcopy(data), self._fields, self._client._update_times.get(path))
+                for path, data in docs]
+
+    def stream(self, transaction=None):
+        self._client._round_trip('query')
+        yield from self._results()
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.id = path.rsplit('/', 1)[-1]
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return datetime.datetime.now(datetime.timezone.utc), ref
+
+
+class FakeWriteOption:
+    def __init__(self, last_update_time=None, exists=None):
+        self.last_update_time = last_update_time
+        self.exists = exists
+
+    def check(self, ref):
+        if self.exists is not None and (ref.path in ref._client._docs) != self.exists:
+            raise FailedPrecondition(f"Document {'does not exist' if self.exists else 'already exists'}: {ref.path}")
+        if self.last_update_time is not None and ref._client._update_times.get(ref.path) != self.last_update_time:
+            raise FailedPrecondition(f"Document changed since it was read: {ref.path}")
+
+
+class FakeWriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class FakeWriteBatch:
+    """Applies all operations atomically on ``commit`` after checking every write option."""
+
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, ref, data, merge=False): self._ops.append((ref, None, lambda: ref._apply_set(data, merge)))
+    def create(self, ref, data): self._ops.append((ref, FakeWriteOption(exists=False), lambda: ref._apply_set(data)))
+    def update(self, ref, data, option=None): self._ops.append((ref, option, lambda: ref._apply_update(data)))
+    def delete(self, ref, option=None): self._ops.append((ref, option, lambda: ref._apply_delete()))
+
+    def commit(self):
+        self._client._round_trip('write')
+        with self._client._lock:
+            for ref, option, _ in self._ops:
+                if option is not None: option.check(ref)
+            for _, _, apply in self._ops: apply()
+            results = [FakeWriteResult(self._client._update_times.get(ref.path)) for ref, _, _ in self._ops]
+        self._ops = []
+        return results
+
+
+class FakeTransaction(FakeWriteBatch):
+    """Transactions behave like batches; reads go through ``ref.get(transaction=...)``."""
+
+    def __init__(self, client):
+        super().__init__(client)
+        self._max_attempts = 5
+        self._id = None
+        self._read_only = False
+
+
+class FakeFirestore:
+    """In-memory Firestore client.
+
+    ``latency`` adds a sleep to every round trip; ``in_limit`` mirrors the
+    server-side cap on ``in``/``array-contains-any`` values.
+    """
+
+    def __init__(self, latency=0.0, in_limit=30):
+        self.latency = latency
+        self.in_limit = in_limit
+        self._docs = {}
+        self._update_times = {}
+        self._clock = itertools.count(1)
+        self._lock = threading.RLock()
+        self._listeners = []
+        self.round_trips = {'read': 0, 'query': 0, 'write': 0}
+
+    def _round_trip(self, kind):
+        with self._lock: self.round_trips[kind] += 1
+        if self.latency: time.sleep(self.latency)
+
+    def _touch(self, path):
+        self._update_times[path] = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(microseconds=next(self._clock))
+
+    def _notify(self, path):
+        for callback in list(self._listeners): callback(path)
+
+    def reset_counters(self):
+        self.round_trips = {key: 0 for key in self.round_trips}
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def document(self, path):
+        return FakeDocumentReference(self, path)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        self._round_trip('read')
+        for ref in references: yield ref._snapshot(field_paths)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def write_option(self, **kwargs):
+        return FakeWriteOption(**kwargs)
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
@@ -0,0 +1,73 @@
+"""Local stand-in for the hosted text-to-image API.
+
+Serves ``POST /<model>`` with a small PNG after ``latency`` seconds. The first
+``loading_responses`` requests get the 503 "is currently loading" answer (with
+``estimated_time``) that the real service sends while a model cold-starts.
+The server counts requests and distinct client connections.
+"""
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+
+class FakeInferenceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.05, loading_responses=0, estimated_time=0.1, port=0):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.latency = latency
+        self.loading_responses = loading_responses
+        self.estimated_time = estimated_time
+        self.requests = 0
+        self.connections = set()
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def reset(self, loading_responses=0):
+        with self.lock:
+            self.requests = 0
+            self.connections = set()
+            self.loading_responses = loading_responses
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        prompt = json.loads(body or b'{}').get('inputs', '')
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+            loading = server.loading_responses > 0
+            if loading: server.loading_responses -= 1
+        if loading:
+            payload = json.dumps({'error': 'Model is currently loading', 'estimated_time': server.estimated_time}).encode()
+            return self._send(503, 'application/json', payload)
+        threading.Event().wait(server.latency)
+        seed = int(hashlib.sha256(prompt.encode()).hexdigest()[:8], 16)
+        image = np.random.default_rng(seed).integers(0, 255, (64, 64, 3), dtype=np.uint8)
+        self._send(200, 'image/png', cv2.imencode('.png', image)[1].tobytes())
+
+    def _send(self, status, content_type, payload):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import re
+import tempfile
+
+HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def is_valid_hash(key):
+    return bool(key) and bool(HASH_PATTERN.match(key))
+
+def sniff_content_type(data):
+    for signature, content_type in IMAGE_SIGNATURES:
+        if data.startswith(signature): return content_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP': return 'image/webp'
+    return 'application/octet-stream'
+
+
+class LocalBlobStore:
+    """Stores blobs on local disk under ``root/<hash[:2]>/<hash>``."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, data, key=None):
+        key = key or content_hash(data)
+        path = self._path(key)
+        if os.path.exists(path): return key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f: f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            raise
+        return key
+
+    def get(self, key):
+        if not is_valid_hash(key): return None
+        try:
+            with open(self._path(key), 'rb') as f: return f.read()
+        except FileNotFoundError: return None
+
+    def exists(self, key):
+        return is_valid_hash(key) and os.path.exists(self._path(key))
+
+    def delete(self, key):
+        if self.exists(key): os.remove(self._path(key))
+
+
+class S3BlobStore:
+    """Stores blobs in an S3-compatible bucket (AWS S3, MinIO, LocalStack...)."""
+
+    def __init__(self, bucket, endpoint_url=None, prefix='img/'):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("The 's3' blob store requires boto3 (pip install boto3).")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def _object_key(self, key):
+        return f"{self.prefix}{key}"
+
+    def put(self, data, key=None):
+        key = key or content_hash(data)
+        if not self.exists(key):
+            self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data,
+                                   ContentType=sniff_content_type(data))
+        return key
+
+    def get(self, key):
+        if not is_valid_hash(key): return None
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))['Body'].read()
+        except self.client.exceptions.NoSuchKey: return None
+
+    def exists(self, key):
+        if not is_valid_hash(key): return False
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except Exception: return False
+
+    def delete(self, key):
+        if is_valid_hash(key): self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+
+def create_blob_store(backend=None):
+    """Builds the blob store selected by the BLOB_STORE environment variable."""
+    backend = backend or os.environ.get('BLOB_STORE', 'local')
+    if backend == 'local':
+        return LocalBlobStore(os.environ.get('BLOB_STORE_PATH', 'blobs'))
+    if backend == 's3':
+        bucket = os.environ.get('BLOB_STORE_BUCKET')
+        if not bucket: raise RuntimeError("BLOB_STORE_BUCKET must be set for the 's3' blob store.")
+        return S3BlobStore(bucket, endpoint_url=os.environ.get('BLOB_STORE_ENDPOINT_URL'))
+    raise RuntimeError(f"Unknown blob store backend: {backend}")
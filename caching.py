@@ -0,0 +1,53 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after ``ttl`` seconds.
+
+    ``on_evict(key, value)``, if given, is called (outside the cache's lock)
+    for entries dropped to make room or found expired.
+    """
+
+    def __init__(self, max_entries=128, ttl=3600, on_evict=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry: del self._entries[key]
+            self.misses += 1
+        if entry and self.on_evict: self.on_evict(key, entry[1])
+        return None
+
+    def put(self, key, value, ttl=None):
+        if self.max_entries <= 0: return
+        evicted = []
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries: evicted.append(self._entries.popitem(last=False))
+        if self.on_evict:
+            for evicted_key, (_, evicted_value) in evicted: self.on_evict(evicted_key, evicted_value)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock: self._entries.clear()
@@ -0,0 +1,147 @@
+"""Cartoon effect engine.
+
+Two modes are available:
+
+* ``reference`` - the original pipeline: median blur + adaptive threshold for
+  edges and a single 9px bilateral filter (sigma 250) at working resolution.
+* ``fast`` - downsamples the image through a Gaussian pyramid, runs repeated
+  small (5px) bilateral passes and the edge detection on the reduced image,
+  then upsamples both back to working resolution. By default the pyramid only
+  descends while the reduced image keeps a long side of at least 1280px, so
+  small images are filtered at full size. That includes everything under the
+  app's default ``CARTOON_MAX_DIM`` of 2048: there ``fast`` is the two small
+  bilateral passes alone, and the pyramid only engages with a larger cap (or
+  ``CARTOON_MAX_DIM=0``). A threshold of 1024 would pyramid 2048px images
+  too, but then misses the tolerance below on large photos.
+
+``max_dim`` caps the working resolution (longest side, in pixels) for either
+mode; the result is returned at the working resolution.
+
+``render_cartoon`` reports the result key and difference hash used by
+``cartoon_cache`` and the seconds spent in each stage (decode, cache for
+hashing and the disk lookup, resize, pyramid, blur, threshold, bilateral,
+upsample, mask, encode, renditions). Bump ``PIPELINE_VERSION`` whenever a
+change alters the output, so cached results from the old pipeline stop
+matching.
+
+Against ``reference`` at the same working resolution, ``fast`` is expected to
+stay within PSNR >= 30 dB and SSIM >= 0.95 (see benchmarks/bench_cartoon.py).
+"""
+import time
+
+from cartoon_cache import DiskCache, result_key
+from imaging import build_renditions, decode_image, dhash
+from lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+
+MODES = ('reference', 'fast')
+FAST_MIN_PSNR = 30.0
+FAST_MIN_SSIM = 0.95
+FAST_MIN_PYRAMID_DIM = 1280
+PIPELINE_VERSION = 1
+
+class StageTimer:
+    """Adds the time since the previous ``lap`` (or creation) to the named stage."""
+
+    def __init__(self):
+        self.seconds = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + now - self._last
+        self._last = now
+
+def resize_to_max_dim(img, max_dim):
+    height, width = img.shape[:2]
+    if not max_dim or max(height, width) <= max_dim: return img
+    scale = max_dim / max(height, width)
+    return cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+def _reference(img, timer):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gray = cv2.medianBlur(gray, 5)
+    timer.lap('blur')
+    edges = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 9, 9)
+    timer.lap('threshold')
+    color = cv2.bilateralFilter(img, 9, 250, 250)
+    timer.lap('bilateral')
+    result = cv2.bitwise_and(color, color, mask=edges)
+    timer.lap('mask')
+    return result
+
+def auto_pyramid_levels(img):
+    levels, long_side = 0, max(img.shape[:2])
+    while long_side // 2 >= FAST_MIN_PYRAMID_DIM:
+        levels += 1; long_side //= 2
+    return levels
+
+def _fast(img, pyramid_levels, bilateral_passes, timer):
+    size = (img.shape[1], img.shape[0])
+    if pyramid_levels is None: pyramid_levels = auto_pyramid_levels(img)
+    small = img
+    for _ in range(pyramid_levels): small = cv2.pyrDown(small)
+    timer.lap('pyramid')
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    gray = cv2.medianBlur(gray, 5 if pyramid_levels == 0 else 3)
+    timer.lap('blur')
+    block_size = max(3, (9 >> pyramid_levels) | 1)
+    edges = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block_size, 9)
+    timer.lap('threshold')
+    color = small
+    for _ in range(bilateral_passes): color = cv2.bilateralFilter(color, 5, 250, 250)
+    timer.lap('bilateral')
+    if pyramid_levels:
+        color = cv2.resize(color, size, interpolation=cv2.INTER_LINEAR)
+        edges = cv2.resize(edges, size, interpolation=cv2.INTER_LINEAR)
+        _, edges = cv2.threshold(edges, 127, 255, cv2.THRESH_BINARY)
+        timer.lap('upsample')
+    result = cv2.bitwise_and(color, color, mask=edges)
+    timer.lap('mask')
+    return result
+
+def cartoonize(img, mode='reference', max_dim=None, pyramid_levels=None, bilateral_passes=2, timer=None):
+    """Applies the cartoon effect to a BGR image array and returns the result.
+
+    Pass a ``StageTimer`` as ``timer`` to collect per-stage timings.
+    """
+    if mode not in MODES: raise ValueError(f"Unknown cartoon mode: {mode}")
+    timer = timer or StageTimer()
+    img = resize_to_max_dim(img, max_dim)
+    timer.lap('resize')
+    if mode == 'fast': return _fast(img, pyramid_levels, bilateral_passes, timer)
+    return _reference(img, timer)
+
+def init_worker(threads=1):
+    """Process-pool initializer; caps OpenCV's threads so one worker per core doesn't oversubscribe."""
+    cv2.setNumThreads(threads)
+
+def pipeline_variant(mode, max_dim):
+    return f'{mode}:{max_dim or 0}:v{PIPELINE_VERSION}'
+
+def render_cartoon(image_bytes, size=None, mode='reference', max_dim=None, cache_dir=None):
+    """Decodes, cartoonizes and encodes an upload; safe to run in a worker process.
+
+    Returns ``{'jpeg', 'renditions', 'width', 'key', 'phash', 'cache', 'timings'}``
+    or ``None`` if the image cannot be decoded. With ``cache_dir`` the decoded
+    image's result is looked up in (and added to) that ``DiskCache`` first.
+    """
+    timer = StageTimer()
+    img = decode_image(image_bytes, size=size, max_dim=max_dim)
+    timer.lap('decode')
+    if img is None: return None
+    key, phash = result_key(img, pipeline_variant(mode, max_dim)), dhash(img)
+    disk = DiskCache(cache_dir) if cache_dir else None
+    cached = disk.get(key) if disk else None
+    timer.lap('cache')
+    if cached: return dict(cached, phash=phash, cache='disk', timings=timer.seconds)
+    result = cartoonize(img, mode=mode, max_dim=max_dim, timer=timer)
+    ok, buffer = cv2.imencode('.jpg', result)
+    timer.lap('encode')
+    if not ok: return None
+    rendered = {'jpeg': buffer.tobytes(), 'renditions': build_renditions(result), 'width': result.shape[1],
+                'key': key, 'phash': phash}
+    timer.lap('renditions')
+    if disk: disk.put(key, rendered)
+    return dict(rendered, cache='miss', timings=timer.seconds)
@@ -0,0 +1,218 @@
+"""Cartoon result cache and near-duplicate index.
+
+Results are keyed by ``result_key``: a hash of the decoded pixels plus the
+pipeline variant (mode, working resolution and ``cartoon.PIPELINE_VERSION``),
+so a re-encoded or re-tagged copy of a photo reuses the same result and a
+pipeline change invalidates everything. ``ResultCache`` keeps recent results
+in memory and, optionally, in a ``DiskCache`` directory shared by every worker
+process. It also remembers which upload bytes produced which key, so an exact
+re-upload is answered in the web process without decoding anything.
+
+``NearDuplicateIndex`` finds creations whose difference hashes lie within a
+small Hamming distance of a new one, flagging them for storage dedup. Its
+follower thread warms it from the hashes stored on creations and keeps it in
+step across workers through an ``events`` broker channel.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from caching import TTLCache
+from events import Follower
+from imaging import hamming
+
+CACHE_SOURCES = ('memory', 'disk', 'miss')
+HASH_BANDS = 8
+
+
+def result_key(image, variant):
+    digest = hashlib.sha256(f'{variant}:{image.shape}'.encode())
+    digest.update(image.data if image.flags.c_contiguous else image.tobytes())
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """Stores rendered results under ``root/<key[:2]>/<key>/``; prune it with any file-age sweep."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f: meta = json.load(f)
+            with open(os.path.join(path, 'cartoon.jpg'), 'rb') as f: jpeg = f.read()
+            renditions = {}
+            for width in meta['renditions']:
+                with open(os.path.join(path, f'{width}.webp'), 'rb') as f: renditions[width] = f.read()
+        except (OSError, ValueError, KeyError): return None
+        return {'jpeg': jpeg, 'renditions': renditions, 'width': meta['width'], 'key': key, 'phash': meta.get('phash')}
+
+    def put(self, key, rendered):
+        path = self._path(key)
+        if os.path.exists(path): return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path))
+        try:
+            with open(os.path.join(tmp_path, 'cartoon.jpg'), 'wb') as f: f.write(rendered['jpeg'])
+            for width, data in rendered['renditions'].items():
+                with open(os.path.join(tmp_path, f'{width}.webp'), 'wb') as f: f.write(data)
+            with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+                json.dump({'width': rendered['width'], 'renditions': sorted(rendered['renditions']),
+                           'phash': rendered.get('phash')}, f)
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process stored the same key first.
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+class ResultCache:
+    """In-memory LRU of rendered results in front of an optional ``DiskCache``."""
+
+    def __init__(self, max_entries=64, ttl=86400, disk=None, max_uploads=10000):
+        self.disk = disk
+        self._results = TTLCache(max_entries, ttl)
+        self._uploads = TTLCache(max_uploads, ttl)
+        self._counts = dict.fromkeys(CACHE_SOURCES, 0)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns ``(rendered, source)`` for a result key, or ``(None, 'miss')``."""
+        rendered = self._results.get(key)
+        if rendered is not None: return rendered, 'memory'
+        rendered = self.disk.get(key) if self.disk else None
+        if rendered is None: return None, 'miss'
+        self._results.put(key, rendered)
+        return rendered, 'disk'
+
+    def lookup(self, upload_hash, variant):
+        """Returns the cached result for previously seen upload bytes, tagged with its ``cache`` source."""
+        key = self._uploads.get((upload_hash, variant))
+        if key is None: return None
+        rendered, source = self.get(key)
+        return dict(rendered, cache=source) if rendered else None
+
+    def store(self, upload_hash, variant, rendered):
+        """Records a finished render (or worker-side hit) and counts where it came from."""
+        with self._lock: self._counts[rendered.get('cache', 'miss')] += 1
+        self._results.put(rendered['key'], {k: v for k, v in rendered.items() if k != 'cache'})
+        self._uploads.put((upload_hash, variant), rendered['key'])
+
+    def stats(self):
+        with self._lock: counts = dict(self._counts)
+        lookups = sum(counts.values())
+        return {'hits': lookups - counts['miss'], 'misses': counts['miss'], 'memory_hits': counts['memory'],
+                'disk_hits': counts['disk'], 'hit_rate': (lookups - counts['miss']) / lookups if lookups else 0.0,
+                'entries': len(self._results)}
+
+
+class NearDuplicateIndex:
+    """Finds 64-bit difference hashes within ``max_distance`` bits of a query.
+
+    Hashes are split into eight byte-wide bands and bucketed per band. Two hashes
+    at most seven bits apart must agree on at least one whole band, so only the
+    bucketed candidates need a full Hamming comparison.
+
+    ``load``, if given, returns the stored ``(item_id, hash)`` pairs. ``follow``
+    adds them from its thread as they arrive, so a fresh worker learns the
+    creations made before it started without holding up a request, then applies
+    the ``add`` and ``remove`` events other workers publish. Until the load
+    finishes, ``find`` only sees the hashes added so far.
+    """
+
+    def __init__(self, max_distance=6, load=None, retry_delay=60):
+        if not 0 <= max_distance < HASH_BANDS: raise ValueError(f"max_distance must be below {HASH_BANDS}")
+        self.max_distance = max_distance
+        self._hashes = {}
+        self._buckets = [{} for _ in range(HASH_BANDS)]
+        self._lock = threading.Lock()
+        self._load = load
+        self.retry_delay = retry_delay
+        self.ready = load is None
+        self._removed = set()
+        self._load_lock = threading.Lock()
+        self._retry_at = 0.0
+        self._follower = Follower('duplicate-index', self._apply, self._reset, on_start=self.warm, on_tick=self.warm)
+
+    def __len__(self):
+        return len(self._hashes)
+
+    @staticmethod
+    def _bands(value):
+        return [(value >> (8 * band)) & 0xFF for band in range(HASH_BANDS)]
+
+    def add(self, item_id, value):
+        with self._lock:
+            self._discard(item_id)
+            self._add(item_id, value)
+
+    def _add(self, item_id, value):
+        self._hashes[item_id] = value
+        for bucket, band in zip(self._buckets, self._bands(value)): bucket.setdefault(band, set()).add(item_id)
+
+    def remove(self, item_id):
+        with self._lock:
+            self._discard(item_id)
+            # Loading may still return the removed item; remember it so the load skips it.
+            if not self.ready: self._removed.add(item_id)
+
+    def _discard(self, item_id):
+        value = self._hashes.pop(item_id, None)
+        if value is None: return
+        for bucket, band in zip(self._buckets, self._bands(value)):
+            bucket[band].discard(item_id)
+            if not bucket[band]: del bucket[band]
+
+    def warm(self):
+        """Adds the pairs returned by ``load`` once; returns False if loading failed (retried after ``retry_delay``).
+
+        Pairs are added as ``load`` yields them, so searches in the meantime see
+        those loaded so far and only wait for one pair's insertion at a time.
+        """
+        if self.ready: return True
+        with self._load_lock:
+            if self.ready: return True
+            if time.monotonic() < self._retry_at: return False
+            try:
+                for item_id, value in self._load():
+                    with self._lock:
+                        # Items added while loading are newer than what was loaded.
+                        if item_id not in self._hashes and item_id not in self._removed: self._add(item_id, value)
+            except Exception as e:
+                print(f"Loading the near-duplicate index failed: {e}")
+                self._retry_at = time.monotonic() + self.retry_delay
+                return False
+            with self._lock:
+                self._removed.clear()
+                self.ready = True
+        return True
+
+    def find(self, value):
+        """Returns ``[(distance, item_id)]`` for indexed hashes near ``value``, closest first."""
+        with self._lock:
+            candidates = set()
+            for bucket, band in zip(self._buckets, self._bands(value)): candidates.update(bucket.get(band, ()))
+            matches = [(hamming(value, self._hashes[item_id]), item_id) for item_id in candidates]
+        return sorted(match for match in matches if match[0] <= self.max_distance)
+
+    def _reset(self):
+        with self._lock:
+            self._hashes.clear()
+            for bucket in self._buckets: bucket.clear()
+            self.ready = self._load is None
+
+    def follow(self, broker, channel):
+        """Loads the stored hashes (retrying every ``retry_delay`` until it succeeds) and applies those other workers add and remove."""
+        self._follower.start(broker, channel, interval=self.retry_delay)
+
+    def _apply(self, event, data):
+        if event == 'add': self.add(data['id'], int(data['phash'], 16))
+        elif event == 'remove': self.remove(data['id'])
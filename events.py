@@ -0,0 +1,182 @@
+"""Per-user event streams for real-time messaging.
+
+Handlers ``publish(uid, event, data)``; every connection of that user that is
+``subscribe``d receives it through its own bounded queue and relays it as a
+Server-Sent Event. ``EventBroker`` delivers within one process (dev, a single
+worker). ``RedisEventBroker`` publishes through Redis pub/sub, and a listener
+thread in each worker hands the events to that worker's local subscribers. A
+subscriber that falls ``queue_size`` events behind is closed; its client
+reconnects and refetches instead of stalling everyone. ``Follower`` keeps
+in-process state (search index, page cache, duplicate index) in step with a
+channel from a daemon thread in each worker.
+"""
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+
+from redis_client import connect_redis, redis_url
+
+CLOSED = object()
+
+
+class Subscription:
+    def __init__(self, broker, channel, queue_size):
+        self.broker = broker
+        self.channel = channel
+        self._queue = queue.Queue(queue_size)
+        self.closed = False
+
+    def deliver(self, item):
+        """Queues ``item``, closing the subscription and returning False if it has fallen behind."""
+        if self.closed: return False
+        try: self._queue.put_nowait(item)
+        except queue.Full:
+            self.close()
+            return False
+        return True
+
+    def get(self, timeout=None):
+        """Returns the next ``(event_id, event, data)``, ``None`` on timeout or ``CLOSED``."""
+        if self.closed: return CLOSED
+        try: return self._queue.get(timeout=timeout)
+        except queue.Empty: return None
+
+    def close(self):
+        if self.closed: return
+        self.closed = True
+        self.broker.unsubscribe(self)
+        try: self._queue.put_nowait(CLOSED)
+        except queue.Full: pass
+
+
+class EventBroker:
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.queue_size)
+        with self._lock: self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is None or subscription not in subscribers: return
+            subscribers.discard(subscription)
+            if not subscribers: del self._subscribers[subscription.channel]
+
+    def connections(self):
+        with self._lock: return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, channel, event, data):
+        self._dispatch(channel, event, data)
+
+    def _dispatch(self, channel, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+            self.published += 1
+        item = (next(self._ids), event, data)
+        dropped = sum(not subscription.deliver(item) for subscription in subscribers)
+        if dropped:
+            with self._lock: self.dropped += dropped
+
+
+class RedisEventBroker(EventBroker):
+    """Event broker over Redis pub/sub, shared by every worker."""
+
+    def __init__(self, url, queue_size=100, prefix='events:'):
+        super().__init__(queue_size)
+        self.client = connect_redis(url, 'event broker')
+        self.prefix = prefix
+        self._listener = None
+
+    def subscribe(self, channel):
+        self._start_listener()
+        return super().subscribe(channel)
+
+    def publish(self, channel, event, data):
+        self.client.publish(self.prefix + channel, json.dumps({'event': event, 'data': data}, default=str))
+
+    def _start_listener(self):
+        with self._lock:
+            if self._listener and self._listener.is_alive(): return
+            self._listener = threading.Thread(target=self._listen, name='event-broker', daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + '*')
+                for message in pubsub.listen():
+                    payload = json.loads(message['data'])
+                    self._dispatch(message['channel'].decode()[len(self.prefix):], payload['event'], payload['data'])
+            except Exception as e:
+                print(f"Event listener failed, resubscribing: {e}")
+                time.sleep(1)
+
+
+class Follower:
+    """Applies the events published on a broker channel to in-process state, from a daemon thread.
+
+    ``on_event(event, data)`` runs for each event. If the subscription falls
+    behind and is closed, the follower subscribes again and runs
+    ``on_missed()`` to recover what was lost. ``on_start()`` runs once
+    subscribed, so nothing published meanwhile is missed, and ``on_tick()``
+    after every event and at least every ``interval`` seconds. A callback that
+    raises is reported and the thread carries on.
+    """
+
+    def __init__(self, name, on_event, on_missed, on_start=None, on_tick=None):
+        self.name = name
+        self.on_event = on_event
+        self.on_missed = on_missed
+        self.on_start = on_start
+        self.on_tick = on_tick
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, broker, channel, interval=None):
+        """Starts following ``channel`` unless already running; cheap enough for a request hook (re-created after a fork)."""
+        with self._lock:
+            if self._thread and self._thread.is_alive(): return
+            self._thread = threading.Thread(target=self._run, args=(broker, channel, interval), name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self, broker, channel, interval):
+        subscription = broker.subscribe(channel)
+        self._call(self.on_start)
+        while True:
+            item = subscription.get(timeout=interval)
+            if item is CLOSED:
+                print(f"{self.name} fell behind its update stream; recovering.")
+                subscription = broker.subscribe(channel)
+                self._call(self.on_missed)
+            elif item: self._call(self.on_event, item[1], item[2])
+            self._call(self.on_tick)
+
+    def _call(self, callback, *args):
+        if callback is None: return
+        try: callback(*args)
+        except Exception as e: print(f"{self.name} update failed: {e}")
+
+
+def format_sse(event_id, event, data):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def create_event_broker(backend=None):
+    """Builds the event broker selected by the EVENT_BROKER environment variable."""
+    backend = backend or os.environ.get('EVENT_BROKER', 'memory')
+    queue_size = int(os.environ.get('EVENT_QUEUE_SIZE', 100))
+    if backend == 'memory': return EventBroker(queue_size)
+    if backend == 'redis': return RedisEventBroker(redis_url(), queue_size)
+    raise RuntimeError(f"Unknown event broker backend: {backend}")
@@ -0,0 +1,131 @@
+"""Home feed timelines built by fan-out on write.
+
+In ``fanout`` mode each public creation is copied, with its creator's username
+and photo, into ``feeds/<uid>/items/<creation_id>`` for every friend of the
+creator, so reading a feed is one ordered query over the reader's own
+timeline. Creators with more than ``celebrity_threshold`` friends are not
+fanned out: they are listed in ``feed_meta/celebrities`` and their creations
+are merged into their friends' feeds at read time instead. Denormalized
+creator fields are refreshed on the next fan-out of each creation.
+"""
+import heapq
+
+from caching import TTLCache
+from firestore_queries import DOCUMENT_ID, query_in
+from lazy import lazy_import
+
+firestore = lazy_import('firebase_admin.firestore')
+
+FEED_MODES = ('read', 'fanout')
+FEED_ITEM_FIELDS = ('user_id', 'type', 'prompt', 'tags', 'original_image_hash', 'generated_image_hash',
+                    'renditions', 'generated_image_width', 'timestamp')
+BATCH_LIMIT = 500
+
+
+class FeedService:
+    def __init__(self, get_db, user_directory, celebrity_threshold=500, backfill=20, rebuild_limit=200,
+                 celebrity_ttl=60):
+        self._get_db = get_db
+        self.users = user_directory
+        self.celebrity_threshold = celebrity_threshold
+        self.backfill = backfill
+        self.rebuild_limit = rebuild_limit
+        self._celebrities = TTLCache(1, celebrity_ttl)
+
+    def _items(self, uid):
+        return self._get_db().collection('feeds').document(uid).collection('items')
+
+    def _commit(self, operations):
+        """Applies ``(method, ref, data)`` operations in batches of at most ``BATCH_LIMIT`` writes."""
+        db = self._get_db()
+        for start in range(0, len(operations), BATCH_LIMIT):
+            batch = db.batch()
+            for method, ref, *data in operations[start:start + BATCH_LIMIT]: getattr(batch, method)(ref, *data)
+            batch.commit()
+
+    def celebrities(self):
+        uids = self._celebrities.get('uids')
+        if uids is None:
+            doc = self._get_db().collection('feed_meta').document('celebrities').get()
+            uids = frozenset((doc.to_dict() or {}).get('uids', []) if doc.exists else [])
+            self._celebrities.put('uids', uids)
+        return uids
+
+    def _friends(self, uid):
+        doc = self._get_db().collection('users').document(uid).get()
+        return (doc.to_dict() or {}).get('friends', []) if doc.exists else []
+
+    def check_celebrity(self, uid, friends):
+        """Records ``uid`` as a celebrity once it outgrows the threshold; returns whether it is one."""
+        if len(friends) <= self.celebrity_threshold: return uid in self.celebrities()
+        if uid not in self.celebrities():
+            self._get_db().collection('feed_meta').document('celebrities').set({'uids': firestore.ArrayUnion([uid])}, merge=True)
+            self._celebrities.clear()
+        return True
+
+    def feed_item(self, creation_id, creation):
+        creator = self.users.get_profile(creation['user_id']) or {}
+        item = {field: creation.get(field) for field in FEED_ITEM_FIELDS}
+        item.update(creation_id=creation_id, creator_username=creator.get('username'), creator_photoURL=creator.get('photoURL'))
+        return item
+
+    def publish(self, creation_id, creation, friends=None):
+        """Pushes a public creation into the timelines of its creator's friends."""
+        owner = creation['user_id']
+        friends = self._friends(owner) if friends is None else friends
+        if self.check_celebrity(owner, friends) or not friends: return 0
+        item = self.feed_item(creation_id, creation)
+        self._commit([('set', self._items(uid).document(creation_id), item) for uid in friends])
+        return len(friends)
+
+    def retract(self, creation_id, owner, friends=None):
+        """Removes a creation that was unpublished or deleted from every friend's timeline."""
+        friends = self._friends(owner) if friends is None else friends
+        self._commit([('delete', self._items(uid).document(creation_id)) for uid in friends])
+
+    def recent_public(self, owner_ids, limit):
+        if not owner_ids: return []
+        return query_in(lambda: self._get_db().collection('creations').where('is_public', '==', True).select(FEED_ITEM_FIELDS), 'user_id', owner_ids,
+                        order_by='timestamp', descending=True, limit=limit)
+
+    def befriend(self, uid, friend_uid):
+        """Backfills two new friends' timelines with each other's recent public creations."""
+        operations = []
+        for reader, creator in ((uid, friend_uid), (friend_uid, uid)):
+            if self.check_celebrity(creator, self._friends(creator)): continue
+            for doc in self.recent_public([creator], self.backfill):
+                operations.append(('set', self._items(reader).document(doc.id), self.feed_item(doc.id, doc.to_dict())))
+        self._commit(operations)
+
+    def rebuild(self, uid, friends):
+        """Rewrites ``uid``'s timeline from its friends' recent public creations."""
+        celebrities = self.celebrities()
+        stale = [doc.reference for doc in self._items(uid).select([]).stream()]
+        fanned_out = [friend for friend in friends if friend not in celebrities]
+        docs = self.recent_public(fanned_out, self.rebuild_limit)
+        self._commit([('delete', ref) for ref in stale] +
+                     [('set', self._items(uid).document(doc.id), self.feed_item(doc.id, doc.to_dict())) for doc in docs])
+        return len(docs)
+
+    def read(self, uid, limit, start_after=None):
+        """Returns up to ``limit`` feed items after ``start_after`` (``{'timestamp', '__name__'}``), newest first.
+
+        Reads ``uid``'s timeline in one ordered query and merges in creations of
+        celebrity friends, which are never fanned out.
+        """
+        query = self._items(uid).order_by('timestamp', direction='DESCENDING').order_by(DOCUMENT_ID, direction='DESCENDING')
+        if start_after: query = query.start_after(start_after)
+        timeline = [doc.to_dict() | {'id': doc.id} for doc in query.limit(limit).stream()]
+        celebrities = self.celebrities()
+        followed = [friend for friend in self._friends(uid) if friend in celebrities] if celebrities else []
+        if not followed: return timeline
+        docs = query_in(lambda: self._get_db().collection('creations').where('is_public', '==', True).select(FEED_ITEM_FIELDS), 'user_id', followed,
+                        order_by='timestamp', descending=True, limit=limit, start_after=start_after)
+        pulled = [self.feed_item(doc.id, doc.to_dict()) | {'id': doc.id} for doc in docs]
+        merged, seen = [], set()
+        for item in heapq.merge(timeline, pulled, key=lambda item: (item['timestamp'], item['id']), reverse=True):
+            if item['id'] in seen: continue
+            seen.add(item['id'])
+            merged.append(item)
+            if len(merged) == limit: break
+        return merged
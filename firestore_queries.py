@@ -0,0 +1,72 @@
+"""Helpers for Firestore queries over arbitrarily long id lists.
+
+Firestore rejects ``in`` filters with more than 30 values. ``query_in`` splits
+the values into chunks, runs one query per chunk concurrently on a shared
+thread pool and k-way merges the ordered chunk results, so ordering and
+``limit`` behave as if a single query had been issued.
+"""
+import contextvars
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DOCUMENT_ID = '__name__'
+IN_QUERY_LIMIT = 30
+GET_ALL_CHUNK_SIZE = 300
+MAX_WORKERS = 8
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None: _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='firestore-fanout')
+    return _executor
+
+
+def chunked(values, size):
+    values = list(dict.fromkeys(values))
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+def _map(fn, chunks):
+    if len(chunks) <= 1: return [fn(chunk) for chunk in chunks]
+    futures = [_pool().submit(contextvars.copy_context().run, fn, chunk) for chunk in chunks]
+    return [future.result() for future in futures]
+
+
+def query_in(build_query, field, values, order_by=None, descending=False, limit=None, start_after=None,
+             chunk_size=IN_QUERY_LIMIT):
+    """Returns snapshots matching ``build_query().where(field, 'in', values)``.
+
+    ``build_query`` returns the base query (filters only) for each chunk. When
+    ``order_by`` is given each chunk is ordered on that field and then document
+    id, limited and resumed after ``start_after`` (``{order_by: value,
+    '__name__': id}``) the same way, and the chunks are merged on that order,
+    so at most ``limit`` overall results come back.
+    """
+    def run(chunk):
+        query = build_query().where(field, 'in', chunk)
+        if order_by:
+            direction = 'DESCENDING' if descending else 'ASCENDING'
+            query = query.order_by(order_by, direction=direction).order_by(DOCUMENT_ID, direction=direction)
+            if start_after: query = query.start_after(start_after)
+        if limit: query = query.limit(limit)
+        return list(query.stream())
+
+    results = _map(run, chunked(values, chunk_size))
+    if order_by: merged = heapq.merge(*results, key=lambda doc: (doc.get(order_by), doc.id), reverse=descending)
+    else: merged = itertools.chain.from_iterable(results)
+    return list(itertools.islice(merged, limit))
+
+
+def get_documents(db, collection, ids, chunk_size=GET_ALL_CHUNK_SIZE):
+    """Fetches ``collection/<id>`` for every id with concurrent ``get_all`` batches, in ``ids`` order."""
+    def run(chunk):
+        return list(db.get_all([db.collection(collection).document(doc_id) for doc_id in chunk]))
+
+    docs = {doc.id: doc for batch in _map(run, chunked(ids, chunk_size)) for doc in batch if doc.exists}
+    return [docs[doc_id] for doc_id in dict.fromkeys(ids) if doc_id in docs]
@@ -0,0 +1,120 @@
+"""Counts Firestore operations per request.
+
+``trace_client`` wraps a Firestore client (and every reference, query and
+batch it hands out) and records document reads, queries and writes, and the
+time spent waiting on them, into the ``FirestoreStats`` that is active in the
+current context. Operations outside a request still update the process-wide
+totals.
+"""
+import contextvars
+import threading
+import time
+
+_current = contextvars.ContextVar('firestore_stats', default=None)
+
+WRITE_METHODS = {'set', 'update', 'delete', 'create', 'add'}
+
+
+class FirestoreStats:
+    def __init__(self):
+        self.reads = 0
+        self.queries = 0
+        self.writes = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, reads=0, queries=0, writes=0, seconds=0.0):
+        with self._lock:
+            self.reads += reads
+            self.queries += queries
+            self.writes += writes
+            self.seconds += seconds
+
+    def as_dict(self):
+        return {'reads': self.reads, 'queries': self.queries, 'writes': self.writes, 'seconds': self.seconds}
+
+
+totals = FirestoreStats()
+
+
+def start_request():
+    stats = FirestoreStats()
+    _current.set(stats)
+    return stats
+
+
+def current_stats():
+    return _current.get()
+
+
+def _record(**counts):
+    totals.record(**counts)
+    stats = _current.get()
+    if stats is not None: stats.record(**counts)
+
+
+def _unwrap(value):
+    if isinstance(value, _Traced): return value._target
+    if isinstance(value, (list, tuple)): return type(value)(_unwrap(v) for v in value)
+    return value
+
+
+def _wrap(value):
+    if isinstance(value, tuple): return tuple(_wrap(v) for v in value)
+    if any(hasattr(value, name) for name in ('stream', 'collection', 'commit')) and not isinstance(value, _Traced):
+        return _Traced(value)
+    return value
+
+
+def _count_stream(results, is_query, seconds):
+    count = 0
+    results = iter(results)
+    try:
+        while True:
+            start = time.perf_counter()
+            try: snapshot = next(results)
+            except StopIteration: break
+            finally: seconds += time.perf_counter() - start
+            count += 1
+            yield snapshot
+    finally:
+        _record(reads=max(count, 1) if is_query else count, queries=1 if is_query else 0, seconds=seconds)
+
+
+class _Traced:
+    __slots__ = ('_target',)
+
+    def __init__(self, target):
+        object.__setattr__(self, '_target', target)
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr): return attr
+        target = self._target
+
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            result = attr(*_unwrap(args), **{k: _unwrap(v) for k, v in kwargs.items()})
+            seconds = time.perf_counter() - start
+            is_document = hasattr(target, 'collection') and not hasattr(target, 'stream')
+            if name == 'stream' or name == 'get_all':
+                return _count_stream(result, name == 'stream', seconds)
+            if name == 'get':
+                if isinstance(result, list): _record(reads=max(len(result), 1), queries=1, seconds=seconds)
+                else: _record(reads=1, seconds=seconds)
+            elif name in WRITE_METHODS and is_document or name == 'add':
+                _record(writes=1, seconds=seconds)
+            elif name == 'commit':
+                _record(writes=max(len(result or []), 1), seconds=seconds)
+            return _wrap(result)
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    def __repr__(self):
+        return f"Traced({self._target!r})"
+
+
+def trace_client(client):
+    return _Traced(client) if client is not None else None
@@ -0,0 +1,61 @@
+"""Atomic, single-round-trip Firestore writes.
+
+``commit`` lets an endpoint stage all of its mutations on one ``WriteBatch``
+and commits them together, so related documents (a creation and its author's
+points, both sides of a friendship) change atomically in one round trip.
+Writes that depend on a prior read guard it with a ``last_update_time``
+precondition instead of a transaction, which would cost an extra round trip
+to begin. When a precondition fails or the commit is aborted under
+contention, the batch is rebuilt (re-reading) and retried with jittered
+backoff. Per-endpoint commit latency and retry counts are kept in
+``write_latency``.
+"""
+import random
+import threading
+import time
+
+from lazy import lazy_import
+
+exceptions = lazy_import('google.api_core.exceptions')
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.05
+
+
+class WriteLatency:
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, attempts):
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, {'commits': 0, 'retries': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            stats['commits'] += 1
+            stats['retries'] += attempts - 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+    def as_dict(self):
+        with self._lock: return {endpoint: dict(stats) for endpoint, stats in self._endpoints.items()}
+
+
+write_latency = WriteLatency()
+
+
+def commit(db, endpoint, build, max_attempts=MAX_ATTEMPTS, backoff=BACKOFF_BASE):
+    """Stages writes with ``build(batch)``, commits them atomically and returns what ``build`` returned.
+
+    ``build`` runs again for every attempt, so any reads it makes are fresh. It
+    may raise to abandon the write before anything is committed.
+    """
+    start = time.perf_counter()
+    for attempt in range(1, max_attempts + 1):
+        batch = db.batch()
+        result = build(batch)
+        try: batch.commit()
+        except (exceptions.Aborted, exceptions.FailedPrecondition):
+            if attempt == max_attempts: raise
+            time.sleep(random.uniform(0, backoff * 2 ** attempt))
+        else:
+            write_latency.record(endpoint, time.perf_counter() - start, attempt)
+            return result
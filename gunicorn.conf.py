@@ -0,0 +1,53 @@
+"""Gunicorn settings (picked up automatically by ``gunicorn app:app``).
+
+The default gevent worker serves each request on a greenlet, so long-lived
+``/api/events`` streams cost a few kilobytes each instead of pinning a sync
+worker. Set GUNICORN_WORKER_CLASS=sync (or gthread) to opt out.
+
+One worker runs by default. More (WEB_CONCURRENCY) need the job store, event
+broker and page cache on Redis (or the page cache off), and gunicorn refuses
+to start otherwise.
+
+Workers import the app without OpenCV, NumPy or the Firebase SDK and connect
+to Firestore on first use (see ``lazy``). With GUNICORN_PRELOAD=1 the master
+imports the app and those modules and loads the search index once, and the
+workers it forks share those pages; clients are still created in each worker
+after the fork.
+"""
+import os
+
+# Job status, chat events and cached pages stay in process memory unless these
+# backends are Redis; a second worker would then answer job polls, hold event
+# streams and serve cached pages without seeing the first worker's jobs,
+# messages and invalidations. PAGE_CACHE_ENTRIES=0 turns the page cache off.
+SHARED_BACKENDS = ('JOB_STORE', 'EVENT_BROKER', 'PAGE_CACHE_STORE')
+in_process = [name for name in SHARED_BACKENDS if os.environ.get(name, 'memory') != 'redis'
+              and not (name == 'PAGE_CACHE_STORE' and os.environ.get('PAGE_CACHE_ENTRIES') == '0')]
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1 if in_process else 2))
+if workers > 1 and in_process:
+    raise RuntimeError(f"{workers} workers need {', '.join(f'{name}=redis' for name in in_process)}, or set WEB_CONCURRENCY=1.")
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 2000))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+keepalive = 5
+preload_app = os.environ.get('GUNICORN_PRELOAD', '').lower() in ('1', 'true', 'yes')
+
+if preload_app and worker_class == 'gevent':
+    # The master imports the app, so patch first: its locks and sockets must cooperate with greenlets.
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def when_ready(server):
+    if preload_app:
+        import app
+        app.preload()
+
+
+def post_worker_init(worker):
+    # Firestore talks gRPC, which needs its gevent integration before the first call.
+    if worker_class == 'gevent':
+        from grpc.experimental import gevent as grpc_gevent
+        grpc_gevent.init_gevent()
@@ -0,0 +1,172 @@
+"""Cached verification of Firebase ID tokens.
+
+``TokenVerifier`` checks ID tokens the way ``firebase_admin.auth.verify_id_token``
+does (RS256 signature against Google's published certificates, audience,
+issuer, subject and expiry) and keeps verified claims in a bounded cache keyed
+by the SHA-256 of the token until the token expires, so repeat requests skip
+the signature check. ``CertificateStore`` keeps the signing certificates warm
+from a background thread that refreshes them before their ``max-age`` runs
+out. Both take injectable fetch/lookup callables so tests and benchmarks can
+use locally minted keys without talking to Google.
+"""
+import hashlib
+import re
+import threading
+import time
+
+from caching import TTLCache
+from lazy import lazy_import
+
+requests = lazy_import('requests')
+jwt = lazy_import('google.auth.jwt')
+
+ID_TOKEN_CERT_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+ID_TOKEN_ISSUER_PREFIX = 'https://securetoken.google.com/'
+
+
+class InvalidTokenError(Exception):
+    pass
+
+
+class RevokedTokenError(InvalidTokenError):
+    pass
+
+
+def fetch_certificates(url=ID_TOKEN_CERT_URL, timeout=10):
+    """Returns ``({kid: pem}, max_age)`` for the certificates published at ``url``."""
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    match = re.search(r'max-age=(\d+)', response.headers.get('cache-control', ''))
+    return response.json(), int(match.group(1)) if match else 3600
+
+
+class CertificateStore:
+    def __init__(self, fetch=fetch_certificates, refresh_margin=300, retry_interval=30):
+        self._fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self._certs = None
+        self._expires = 0
+        self._refreshed = -retry_interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def refresh(self):
+        certs, max_age = self._fetch()
+        with self._lock:
+            self._refreshed = time.monotonic()
+            self._certs, self._expires = certs, self._refreshed + max_age
+            self.refreshes += 1
+        return max_age
+
+    def _next_refresh(self):
+        with self._lock: return self._expires - self.refresh_margin - time.monotonic()
+
+    def _refresh_loop(self):
+        while True:
+            if self._next_refresh() <= 0:
+                try: self.refresh()
+                except Exception as e:
+                    self.refresh_failures += 1
+                    print(f"Certificate refresh failed: {e}")
+            time.sleep(max(self._next_refresh(), self.retry_interval))
+
+    def start(self):
+        """Starts the background refresher for this process (again after a fork)."""
+        with self._lock:
+            if self._thread and self._thread.is_alive(): return
+            self._thread = threading.Thread(target=self._refresh_loop, name='id-token-certs', daemon=True)
+            self._thread.start()
+
+    def certificates(self, kid=None):
+        """Returns the current certificates, fetching them first if they expired or ``kid`` is unknown.
+
+        Unknown key ids (a key rotation the refresher has not seen yet) trigger at
+        most one fetch per ``retry_interval``.
+        """
+        with self._lock:
+            now = time.monotonic()
+            certs = self._certs if self._expires > now else None
+            if certs is not None and kid and kid not in certs and now - self._refreshed > self.retry_interval: certs = None
+        if certs is None:
+            self.refresh()
+            certs = self._certs
+        self.start()
+        return certs
+
+
+def firebase_valid_after(uid, app=None):
+    """Returns when ``uid``'s tokens were last revoked (epoch seconds), looked up on ``app`` (default app if None)."""
+    from firebase_admin import auth
+    valid_after_ms = auth.get_user(uid, app=app).tokens_valid_after_timestamp
+    return valid_after_ms / 1000 if valid_after_ms else None
+
+
+class TokenVerifier:
+    def __init__(self, project_id, certificates=None, check_revoked=False, valid_after=firebase_valid_after,
+                 max_entries=10000, revocation_ttl=300, clock_skew=0):
+        self.project_id = project_id
+        self.certificates = certificates or CertificateStore()
+        self.check_revoked = check_revoked
+        self._valid_after = valid_after
+        self.clock_skew = clock_skew
+        self.revocation_ttl = revocation_ttl
+        self.tokens = TTLCache(max_entries, 3600)
+        self.revocations = TTLCache(max_entries, revocation_ttl)
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.verifications = 0
+        self.verify_seconds = 0.0
+        self.max_verify_seconds = 0.0
+
+    def verify(self, id_token):
+        """Returns the claims of a valid ID token (with ``uid``), raising ``InvalidTokenError``."""
+        key = hashlib.sha256(id_token.encode()).hexdigest()
+        claims = self.tokens.get(key)
+        if claims is not None and claims['exp'] + self.clock_skew > time.time(): return dict(claims)
+        start = time.perf_counter()
+        try: claims = self._verify(id_token)
+        except Exception:
+            with self._lock: self.failures += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.verifications += 1
+                self.verify_seconds += elapsed
+                self.max_verify_seconds = max(self.max_verify_seconds, elapsed)
+        ttl = claims['exp'] + self.clock_skew - time.time()
+        if self.check_revoked: ttl = min(ttl, self.revocation_ttl)
+        if ttl > 0: self.tokens.put(key, claims, ttl)
+        return dict(claims)
+
+    def _verify(self, id_token):
+        try:
+            header = jwt.decode_header(id_token)
+            if header.get('alg') != 'RS256' or not header.get('kid'): raise InvalidTokenError('Token is not an RS256 ID token')
+            claims = jwt.decode(id_token, certs=self.certificates.certificates(header['kid']), audience=self.project_id,
+                                clock_skew_in_seconds=self.clock_skew)
+        except ValueError as e: raise InvalidTokenError(str(e)) from e
+        if claims.get('iss') != ID_TOKEN_ISSUER_PREFIX + self.project_id: raise InvalidTokenError('Token has an incorrect issuer')
+        subject = claims.get('sub')
+        if not isinstance(subject, str) or not 0 < len(subject) <= 128: raise InvalidTokenError('Token has an invalid subject')
+        claims['uid'] = subject
+        if self.check_revoked: self._check_revoked(claims)
+        return claims
+
+    def _check_revoked(self, claims):
+        valid_after = self.revocations.get(claims['uid'])
+        if valid_after is None:
+            valid_after = self._valid_after(claims['uid']) or 0
+            self.revocations.put(claims['uid'], valid_after)
+        if claims.get('auth_time', claims['iat']) < valid_after: raise RevokedTokenError('Token has been revoked')
+
+    def stats(self):
+        lookups = self.tokens.hits + self.tokens.misses
+        return {'hits': self.tokens.hits, 'misses': self.tokens.misses, 'hit_rate': self.tokens.hits / lookups if lookups else 0.0,
+                'verifications': self.verifications, 'failures': self.failures, 'cached': len(self.tokens),
+                'verify_seconds': self.verify_seconds, 'max_verify_seconds': self.max_verify_seconds,
+                'certificate_refreshes': self.certificates.refreshes,
+                'certificate_refresh_failures': self.certificates.refresh_failures}
@@ -0,0 +1,77 @@
+import struct
+
+from lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+RENDITION_WIDTHS = (256, 512, 1024)
+RENDITION_FORMAT = '.webp'
+RENDITION_QUALITY = 80
+
+def resize_to_width(image, width):
+    height = max(1, round(image.shape[0] * width / image.shape[1]))
+    return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+def build_renditions(image, widths=RENDITION_WIDTHS):
+    """Encodes downscaled copies of ``image`` as ``{width: bytes}``.
+
+    Widths at or above the source width are skipped; the original image is
+    always the largest candidate, so upscaled renditions would only waste bytes.
+    """
+    renditions = {}
+    for width in sorted(widths):
+        if width >= image.shape[1]: break
+        ok, buffer = cv2.imencode(RENDITION_FORMAT, resize_to_width(image, width),
+                                  [cv2.IMWRITE_WEBP_QUALITY, RENDITION_QUALITY])
+        if ok: renditions[width] = buffer.tobytes()
+    return renditions
+
+def read_image_size(data):
+    """Returns ``(width, height)`` from a PNG or JPEG header without decoding pixels."""
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and data[12:16] == b'IHDR':
+        return struct.unpack('>II', data[16:24])
+    if data[:2] != b'\xff\xd8': return None
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            offset += 1; continue
+        marker = data[offset + 1]
+        if marker in (0xFF, 0x01) or 0xD0 <= marker <= 0xD7:
+            offset += 1 if marker == 0xFF else 2; continue
+        segment_length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if offset + 9 > len(data): return None
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + segment_length
+    return None
+
+def decode_image(data, size=None, max_dim=None):
+    """Decodes encoded image bytes into a BGR array.
+
+    When the header ``size`` is known and ``max_dim`` is set, the largest
+    power-of-two reduction that keeps the long side at or above ``max_dim`` is
+    requested from the decoder (libjpeg scales during IDCT, so large JPEGs never
+    materialise at full resolution).
+    """
+    flags = cv2.IMREAD_COLOR
+    if size and max_dim:
+        for factor, reduced_flags in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if max(size) // factor >= max_dim:
+                flags = reduced_flags; break
+    return cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+
+def dhash(image, bits=8):
+    """Returns the ``bits * bits``-bit difference hash of an image as an int.
+
+    Each bit records whether a pixel of the grayscale thumbnail is brighter than
+    its right-hand neighbour, so re-encoding, rescaling and small colour shifts
+    change few bits; compare hashes with ``hamming``.
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (bits + 1, bits), interpolation=cv2.INTER_AREA)
+    return int.from_bytes(np.packbits(small[:, 1:] > small[:, :-1]).tobytes(), 'big')
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
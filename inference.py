@@ -0,0 +1,124 @@
+"""Client for the hosted text-to-image inference API.
+
+One ``InferenceClient`` is shared by the whole process: it keeps a pooled
+keep-alive session, retries "model is loading" (503) answers with backoff that
+honours the server's ``estimated_time``, coalesces identical in-flight prompts
+into a single upstream call and caches recent results by normalized prompt and
+model. ``base_url`` can point at a local fake server for tests and benchmarks.
+"""
+import threading
+import time
+
+from caching import TTLCache
+from lazy import lazy_import
+
+requests = lazy_import('requests')
+
+HUGGINGFACE_BASE_URL = 'https://api-inference.huggingface.co/models/'
+DEFAULT_MODEL = 'stabilityai/stable-diffusion-xl-base-1.0'
+
+
+class InferenceError(Exception):
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ModelLoadingError(InferenceError):
+    def __init__(self, message='The AI model is starting up. Please wait about 30 seconds and try again.'):
+        super().__init__(message, 503)
+
+
+def normalize_prompt(prompt):
+    return ' '.join(prompt.split()).casefold()
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class InferenceClient:
+    def __init__(self, api_key, model=DEFAULT_MODEL, base_url=HUGGINGFACE_BASE_URL, connect_timeout=5,
+                 read_timeout=120, max_retries=3, backoff_base=2, max_backoff=60, retry_budget=120,
+                 cache_entries=128, cache_ttl=3600, pool_size=16, session=None):
+        self.model = model
+        self.url = base_url.rstrip('/') + '/' + model
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.retry_budget = retry_budget
+        self.cache = TTLCache(cache_entries, cache_ttl)
+        self.session = session or requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Authorization': f'Bearer {api_key}'})
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+        self.coalesced = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def generate(self, prompt):
+        """Returns image bytes for ``prompt``, raising ``InferenceError`` on failure."""
+        key = (self.model, normalize_prompt(prompt))
+        cached = self.cache.get(key)
+        if cached is not None: return cached
+        with self._lock:
+            pending = self._inflight.get(key)
+            owner = pending is None
+            if owner: pending = self._inflight[key] = _InFlight()
+            else: self.coalesced += 1
+        if not owner:
+            pending.done.wait()
+            if pending.error: raise pending.error
+            return pending.result
+        try:
+            pending.result = self._request(prompt)
+            self.cache.put(key, pending.result)
+            return pending.result
+        except InferenceError as e:
+            pending.error = e
+            raise
+        except Exception as e:
+            pending.error = InferenceError(f'A server error occurred while contacting the AI service: {e}')
+            raise pending.error
+        finally:
+            with self._lock: self._inflight.pop(key, None)
+            pending.done.set()
+
+    def stats(self):
+        return {'upstream_calls': self.upstream_calls, 'upstream_seconds': self.upstream_seconds, 'coalesced': self.coalesced,
+                'cache_hits': self.cache.hits, 'cache_misses': self.cache.misses}
+
+    def _backoff(self, attempt, estimated_time=None):
+        delay = estimated_time if estimated_time else self.backoff_base * 2 ** attempt
+        return min(self.max_backoff, delay)
+
+    def _request(self, prompt):
+        deadline = time.monotonic() + self.retry_budget
+        for attempt in range(self.max_retries + 1):
+            with self._lock: self.upstream_calls += 1
+            start = time.perf_counter()
+            try:
+                response = self.session.post(self.url, json={'inputs': prompt}, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error, delay = InferenceError(f'A server error occurred while contacting the AI service: {e}'), self._backoff(attempt)
+            else:
+                if response.status_code == 200 and 'image' in response.headers.get('content-type', ''):
+                    return response.content
+                try: error_data = response.json()
+                except ValueError: error_data = {}
+                message = error_data.get('error', 'An unknown error occurred with the AI service.')
+                if response.status_code != 503 and 'is currently loading' not in message:
+                    raise InferenceError(message)
+                error = ModelLoadingError() if 'is currently loading' in message else InferenceError(message, 503)
+                delay = self._backoff(attempt, error_data.get('estimated_time'))
+            finally:
+                with self._lock: self.upstream_seconds += time.perf_counter() - start
+            if attempt == self.max_retries or time.monotonic() + delay > deadline: raise error
+            time.sleep(delay)
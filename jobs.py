@@ -0,0 +1,273 @@
+"""Background job queue for image generation.
+
+CPU-bound work (OpenCV) runs in a process pool, remote calls run in a thread
+pool, and every job finishes with an optional ``finalize`` step on the thread
+pool so that Firestore/blob-store writes stay in the web process. Job state
+lives in a pluggable store: ``InMemoryJobStore`` for a single process (dev,
+tests) or ``RedisJobStore`` so any gunicorn worker can answer status polls and
+per-user limits are shared. ``map`` runs a batch of CPU-bound calls across
+the process pool inside one job slot and yields each result as it finishes.
+``run_blocking`` keeps smaller CPU-bound steps in the web process from
+stalling a gevent worker.
+"""
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from caching import TTLCache
+from redis_client import connect_redis, redis_url
+
+
+class JobRejected(Exception):
+    """Raised by ``submit`` when a job cannot be accepted right now."""
+
+    def __init__(self, message, status_code, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class JobFailed(Exception):
+    """Raised by job work to fail a job with a user-facing message."""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class InMemoryJobStore:
+    """Keeps the most recent ``max_entries`` jobs of this process for up to ``ttl`` seconds.
+
+    Finished cartoon jobs hold their base64 result (often megabytes), so the
+    entry cap is what bounds a worker's memory, not the TTL.
+    """
+
+    def __init__(self, ttl=3600, max_entries=100):
+        self.ttl = ttl
+        self._jobs = TTLCache(max_entries=max_entries, ttl=ttl)
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def save(self, job):
+        self._jobs.put(job['id'], dict(job))
+
+    def load(self, job_id):
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    def acquire(self, owner, limit):
+        with self._lock:
+            if self._active.get(owner, 0) >= limit: return False
+            self._active[owner] = self._active.get(owner, 0) + 1
+            return True
+
+    def release(self, owner):
+        with self._lock:
+            remaining = self._active.get(owner, 0) - 1
+            if remaining > 0: self._active[owner] = remaining
+            else: self._active.pop(owner, None)
+
+
+class RedisJobStore:
+    """Job store in Redis, shared by every worker."""
+
+    def __init__(self, url, ttl=3600, prefix='jobs:'):
+        self.client = connect_redis(url, 'job store')
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def save(self, job):
+        self.client.set(f"{self.prefix}{job['id']}", json.dumps(job), ex=self.ttl)
+
+    def load(self, job_id):
+        data = self.client.get(f"{self.prefix}{job_id}")
+        return json.loads(data) if data else None
+
+    def acquire(self, owner, limit):
+        key = f"{self.prefix}active:{owner}"
+        count = self.client.incr(key)
+        self.client.expire(key, self.ttl)
+        if count > limit:
+            self.client.decr(key)
+            return False
+        return True
+
+    def release(self, owner):
+        self.client.decr(f"{self.prefix}active:{owner}")
+
+
+def run_blocking(work, *args):
+    """Runs CPU-bound ``work(*args)`` on a real OS thread when gevent has patched threading.
+
+    Under the gevent worker, threads (the I/O pool included) are greenlets on
+    one OS thread, so decoding, encoding or hashing there stalls every other
+    request and event stream in the worker. gevent's threadpool runs real
+    threads, and OpenCV and hashlib release the GIL, so the hub keeps serving
+    meanwhile. Keep network calls out of ``work``; they belong on the hub.
+    Without gevent this just calls ``work``.
+    """
+    if 'gevent' in sys.modules:
+        from gevent import get_hub, monkey
+        if monkey.is_module_patched('threading'): return get_hub().threadpool.apply(work, args)
+    return work(*args)
+
+
+def available_cpus():
+    """CPUs this process may run on, which can be fewer than the host has (affinity, cpusets)."""
+    try: return len(os.sched_getaffinity(0))
+    except AttributeError: return multiprocessing.cpu_count()
+
+
+class JobQueue:
+    """Runs jobs on bounded pools with per-owner concurrency limits and backpressure.
+
+    Pools are created on first use so that a preloaded app never forks a
+    process that already owns worker threads or child processes.
+    """
+
+    def __init__(self, store, cpu_workers=None, io_workers=8, per_user_limit=2, max_pending=32,
+                 cpu_initializer=None, cpu_initargs=()):
+        self.store = store
+        self.cpu_workers = cpu_workers or available_cpus()
+        self.cpu_initializer = cpu_initializer
+        self.cpu_initargs = cpu_initargs
+        self.io_workers = io_workers
+        self.per_user_limit = per_user_limit
+        self.max_pending = max_pending
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._cpu_pool = None
+        self._io_pool = None
+
+    def _pools(self):
+        with self._lock:
+            if self._io_pool is None:
+                self._io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix='jobs-io')
+            if self._cpu_pool is None:
+                self._cpu_pool = ProcessPoolExecutor(max_workers=self.cpu_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=self.cpu_initializer, initargs=self.cpu_initargs)
+        return self._cpu_pool, self._io_pool
+
+    def pending(self):
+        """Returns how many admitted jobs (or batches) have not finished yet."""
+        with self._lock: return self._pending
+
+    def _discard_cpu_pool(self, pool):
+        with self._lock:
+            if self._cpu_pool is pool: self._cpu_pool = None
+        pool.shutdown(wait=False)
+
+    def _admit(self, owner):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobRejected('The server is busy. Please try again shortly.', 503, retry_after=5)
+            self._pending += 1
+        if not self.store.acquire(owner, self.per_user_limit):
+            with self._lock: self._pending -= 1
+            raise JobRejected('Too many jobs in progress. Wait for one to finish.', 429, retry_after=2)
+
+    def submit(self, owner, kind, work, *args, cpu_bound=False, finalize=None):
+        """Queues ``work(*args)`` and returns the new job record immediately."""
+        self._admit(owner)
+        job = {'id': uuid.uuid4().hex, 'owner': owner, 'kind': kind, 'status': 'pending', 'created_at': time.time()}
+        try:
+            self.store.save(job)
+            cpu_pool, io_pool = self._pools()
+            try:
+                future = (cpu_pool if cpu_bound else io_pool).submit(work, *args)
+            except BrokenProcessPool:
+                self._discard_cpu_pool(cpu_pool)
+                cpu_pool, io_pool = self._pools()
+                future = cpu_pool.submit(work, *args)
+        except Exception:
+            self._release(owner)
+            raise
+        future.add_done_callback(lambda f: io_pool.submit(self._complete, job, f, finalize, cpu_pool if cpu_bound else None))
+        return job
+
+    def _complete(self, job, future, finalize, cpu_pool=None):
+        try:
+            try: result = future.result()
+            except BrokenProcessPool:
+                self._discard_cpu_pool(cpu_pool)
+                raise
+            if finalize: result = finalize(result)
+            job.update(status='done', result=result)
+        except JobFailed as e:
+            job.update(status='failed', error=str(e), status_code=e.status_code)
+        except Exception as e:
+            print(f"Job {job['id']} ({job['kind']}) failed: {e}")
+            job.update(status='failed', error='A server error occurred while processing the job.', status_code=500)
+        finally:
+            job['finished_at'] = time.time()
+            try: self.store.save(job)
+            finally: self._release(job['owner'])
+
+    def map(self, owner, work, arg_list, window=None):
+        """Runs ``work(*args)`` on the process pool for each tuple in ``arg_list``.
+
+        Returns an iterator of ``(index, result, error)`` in completion order,
+        where ``error`` is a ``JobFailed`` for items that failed. The batch takes
+        one of the owner's job slots (raising ``JobRejected`` up front like
+        ``submit``) and keeps at most ``window`` items in the pool, one per
+        worker by default, so other jobs are not starved. Closing the iterator
+        early cancels the items that have not started.
+        """
+        self._admit(owner)
+        results = self._map(owner, work, arg_list, window or self.cpu_workers)
+        next(results)
+        return results
+
+    def _map(self, owner, work, arg_list, window):
+        items = enumerate(arg_list)
+        running = {}
+        try:
+            yield
+            while True:
+                for index, args in items:
+                    future, pool = self._submit_cpu(work, args)
+                    running[future] = index, pool
+                    if len(running) >= window: break
+                if not running: return
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, pool = running.pop(future)
+                    try: yield index, future.result(), None
+                    except JobFailed as e: yield index, None, e
+                    except Exception as e:
+                        if isinstance(e, BrokenProcessPool): self._discard_cpu_pool(pool)
+                        print(f"Batch item {index} failed: {e}")
+                        yield index, None, JobFailed('A server error occurred while processing the image.')
+        finally:
+            for future in running: future.cancel()
+            self._release(owner)
+
+    def _submit_cpu(self, work, args):
+        cpu_pool, _ = self._pools()
+        try: return cpu_pool.submit(work, *args), cpu_pool
+        except BrokenProcessPool:
+            self._discard_cpu_pool(cpu_pool)
+            cpu_pool, _ = self._pools()
+            return cpu_pool.submit(work, *args), cpu_pool
+
+    def _release(self, owner):
+        self.store.release(owner)
+        with self._lock: self._pending -= 1
+
+    def get(self, job_id):
+        return self.store.load(job_id)
+
+
+def create_job_store(backend=None):
+    """Builds the job store selected by the JOB_STORE environment variable."""
+    backend = backend or os.environ.get('JOB_STORE', 'memory')
+    if backend == 'memory': return InMemoryJobStore(max_entries=int(os.environ.get('JOB_STORE_ENTRIES', 100)))
+    if backend == 'redis': return RedisJobStore(redis_url())
+    raise RuntimeError(f"Unknown job store backend: {backend}")
@@ -0,0 +1,98 @@
+"""Deferred imports and clients, so a worker can boot without paying for them.
+
+``lazy_import(name)`` returns a stand-in for a module that imports it on first
+attribute access. OpenCV, NumPy, the Firebase SDK (with gRPC) and requests
+make up most of the app's import time and memory; a worker that only serves
+templates never loads them.
+
+``LazyClient(connect, name)`` stands in for a client built by ``connect()`` on
+first use. If ``connect`` fails, the error is printed and the stand-in is
+falsy; it tries again on a later use once an exponentially growing delay has
+passed, instead of staying unavailable for the life of the process. A client
+created before a ``fork`` is dropped in the child, which connects afresh:
+gRPC channels and pooled sockets must not be shared across processes.
+"""
+import importlib
+import os
+import threading
+import time
+import weakref
+
+
+class LazyModule:
+    def __init__(self, name):
+        self.__dict__['_lazy_name'] = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._lazy_name)
+        # Later lookups find the module's attributes on the stand-in itself.
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._lazy_name!r}>"
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+_clients = weakref.WeakSet()
+
+
+def _forget_clients():
+    for client in list(_clients): client.reset()
+
+
+if hasattr(os, 'register_at_fork'): os.register_at_fork(after_in_child=_forget_clients)
+
+
+class LazyClient:
+    def __init__(self, connect, name, retry_delay=1.0, max_retry_delay=60.0):
+        self._connect = connect
+        self.name = name
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._client = None
+        self._lock = threading.Lock()
+        self._delay = retry_delay
+        self._retry_at = 0.0
+        self.connects = 0
+        self.connect_failures = 0
+        _clients.add(self)
+
+    def get(self):
+        """Returns the client, connecting if needed, or None while it is unavailable."""
+        client = self._client
+        if client is not None or time.monotonic() < self._retry_at: return client
+        with self._lock:
+            if self._client is None and time.monotonic() >= self._retry_at:
+                try:
+                    self._client = self._connect()
+                    self._delay = self.retry_delay
+                    self.connects += 1
+                except Exception as e:
+                    print(f"{self.name} initialization failed: {e}")
+                    self.connect_failures += 1
+                    self._retry_at = time.monotonic() + self._delay
+                    self._delay = min(self._delay * 2, self.max_retry_delay)
+            return self._client
+
+    def current(self):
+        """Returns the client if it has been created, without connecting."""
+        return self._client
+
+    def reset(self):
+        """Drops the client so the next use connects again."""
+        self._lock = threading.Lock()
+        self._client = None
+        self._delay = self.retry_delay
+        self._retry_at = 0.0
+
+    def __bool__(self):
+        return self.get() is not None
+
+    def __getattr__(self, attr):
+        client = self.get()
+        if client is None: raise RuntimeError(f"{self.name} is unavailable.")
+        return getattr(client, attr)
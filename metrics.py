@@ -0,0 +1,151 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+A ``Registry`` holds labelled ``Counter`` and ``Histogram`` metrics that code
+updates as it runs, plus collectors: callables run at scrape time that turn
+the counters other components already keep (caches, token verifier, commit
+latency...) into samples, so those components need not know about metrics.
+``render`` returns the exposition text for a ``/metrics`` endpoint.
+``profile_when_requested`` profiles single requests on demand during
+development.
+
+Values are per process. Behind gunicorn each worker keeps its own, and a
+scrape sees whichever worker answers it, so run one worker per scrape target
+(or scrape workers individually) when the numbers must add up.
+"""
+import bisect
+import threading
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(labels):
+    if not labels: return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'): return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock: self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self):
+        with self._lock: values = dict(self._values)
+        for labels, value in sorted(values.items()): yield self.name, labels, value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None: series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock: series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', labels + (('le', _format_value(float(bound))),), cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+def stats_metrics(prefix, what, rows, counters):
+    """Turns ``[(labels, stats dict), ...]`` into collector output.
+
+    Each stats key becomes the metric ``<prefix>_<key>``: a ``_total`` counter
+    if it is in ``counters``, otherwise a gauge.
+    """
+    metrics = {}
+    for labels, stats in rows:
+        for key, value in stats.items(): metrics.setdefault(key, []).append((labels, value))
+    for key, samples in metrics.items():
+        help = f"{what}: {key.replace('_', ' ')}."
+        if key in counters: yield f'{prefix}_{key}_total', 'counter', help, samples
+        else: yield f'{prefix}_{key}', 'gauge', help, samples
+
+
+def profile_when_requested(wsgi_app, header='X-Profile', **options):
+    """Runs requests that carry ``header`` under werkzeug's cProfile middleware; for development only.
+
+    ``options`` go to ``ProfilerMiddleware``: by default the slowest calls are
+    printed to stdout, and with ``profile_dir`` a ``.prof`` file is written per
+    request.
+    """
+    from werkzeug.middleware.profiler import ProfilerMiddleware
+    options.setdefault('sort_by', ('cumulative',))
+    options.setdefault('restrictions', (40,))
+    profiled = ProfilerMiddleware(wsgi_app, **options)
+    key = 'HTTP_' + header.upper().replace('-', '_')
+
+    def dispatch(environ, start_response):
+        return (profiled if environ.get(key) else wsgi_app)(environ, start_response)
+    return dispatch
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help):
+        metric = Counter(name, help)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, collect):
+        """Registers ``collect()``, which yields ``(name, kind, help, [(labels dict, value), ...])`` per metric."""
+        self._collectors.append(collect)
+        return collect
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            samples = list(metric.samples())
+            if not samples: continue
+            lines += [f'# HELP {metric.name} {metric.help}', f'# TYPE {metric.name} {metric.kind}']
+            lines += [f'{name}{_format_labels(labels)} {_format_value(value)}' for name, labels, value in samples]
+        for collect in self._collectors:
+            try: collected = list(collect())
+            except Exception as e:
+                print(f"Metrics collector {collect.__name__} failed: {e}")
+                continue
+            for name, kind, help, samples in collected:
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+                lines += [f'{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}' for labels, value in samples]
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,253 @@
+"""Shared cache for rendered public pages.
+
+``PageCache.cached`` wraps a Flask view. A view opts a response into the cache
+by calling ``tag_page(*tags)`` while rendering; only successful ``GET``
+responses without an ``Authorization`` header are stored, keyed by the path
+and the query arguments the view declares it reads (others are ignored, so
+junk query strings cannot fill the cache). Each route has a ``ttl`` during which the stored page is served
+as is and a ``stale`` window after it during which the stale page is still
+served while one background render refreshes it. Concurrent misses for the
+same page wait for a single render. Every cached response carries an ETag and
+Last-Modified, so revalidating browsers get a 304.
+
+Entries live in a bounded in-process LRU and, with ``RedisPageStore``, in
+Redis shared by all workers. ``invalidate(*tags)`` drops every page tagged
+with one of ``tags`` from both tiers and broadcasts the tags on an ``events``
+broker channel that each worker ``follow``s to evict its own copies. That
+only reaches other workers through a shared (Redis) broker, so
+gunicorn.conf.py runs a single worker unless both are on Redis.
+"""
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from flask import current_app, g, make_response, request
+
+from caching import TTLCache
+from events import Follower
+from redis_client import connect_redis, redis_url
+
+RENDER_WAIT_TIMEOUT = 10
+X_CACHE = {'hits': 'HIT', 'stale': 'STALE', 'misses': 'MISS'}
+
+
+def tag_page(*tags):
+    """Marks the response being rendered as cacheable under ``tags``."""
+    g.page_tags = g.get('page_tags', ()) + tags
+
+
+class RedisPageStore:
+    """Page store in Redis, shared by every worker."""
+
+    def __init__(self, url, prefix='pages:'):
+        self.client = connect_redis(url, 'page cache')
+        self.prefix = prefix
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        if not data: return None
+        header, body = data.split(b'\n', 1)
+        return dict(json.loads(header), body=body)
+
+    def put(self, key, entry, ttl):
+        header = json.dumps({field: value for field, value in entry.items() if field != 'body'}).encode()
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, header + b'\n' + entry['body'], ex=max(1, int(ttl)))
+        for tag in entry['tags']:
+            pipe.sadd(f'{self.prefix}tag:{tag}', key)
+            pipe.expire(f'{self.prefix}tag:{tag}', max(1, int(ttl)))
+        pipe.execute()
+
+    def invalidate(self, tags):
+        tag_keys = [f'{self.prefix}tag:{tag}' for tag in tags]
+        keys = {key.decode() for tag_key in tag_keys for key in self.client.smembers(tag_key)}
+        self.client.delete(*tag_keys, *(self.prefix + key for key in keys))
+
+
+def create_page_store(backend=None):
+    """Builds the shared page store selected by the PAGE_CACHE_STORE environment variable, if any."""
+    backend = backend or os.environ.get('PAGE_CACHE_STORE', 'memory')
+    if backend == 'memory': return None
+    if backend == 'redis': return RedisPageStore(redis_url())
+    raise RuntimeError(f"Unknown page cache store backend: {backend}")
+
+
+class PageCache:
+    def __init__(self, max_entries=1000, store=None):
+        self.enabled = max_entries > 0
+        self.store = store
+        self._entries = TTLCache(max_entries, ttl=0, on_evict=self._evicted)
+        self._tags = {}
+        self._key_tags = {}
+        self._rendering = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._refresh_pool = None
+        self._follower = Follower('page-cache', self._apply, self._forget)
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None and self.store:
+            try: entry = self.store.get(key)
+            except Exception as e: print(f"Page cache store read failed: {e}")
+            if entry and entry['stale_until'] > time.time(): self._remember(key, entry)
+        return entry
+
+    def _remember(self, key, entry):
+        self._entries.put(key, entry, ttl=entry['stale_until'] - time.time())
+        with self._lock:
+            self._untag(key)
+            self._key_tags[key] = entry, entry['tags']
+            for tag in entry['tags']: self._tags.setdefault(tag, set()).add(key)
+
+    def _untag(self, key):
+        _, tags = self._key_tags.pop(key, (None, ()))
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is None: continue
+            keys.discard(key)
+            if not keys: del self._tags[tag]
+
+    def _evicted(self, key, entry):
+        with self._lock:
+            # The key may have been cached again since this entry was dropped.
+            if self._key_tags.get(key, (None,))[0] is entry: self._untag(key)
+
+    def _put(self, key, entry):
+        self._remember(key, entry)
+        if self.store:
+            try: self.store.put(key, entry, entry['stale_until'] - time.time())
+            except Exception as e: print(f"Page cache store write failed: {e}")
+
+    def _record(self, route, outcome, render_seconds=None):
+        with self._lock:
+            stats = self._stats.setdefault(route, {'hits': 0, 'stale': 0, 'misses': 0, 'not_modified': 0, 'renders': 0,
+                                                   'render_seconds': 0.0, 'max_render_seconds': 0.0})
+            if outcome: stats[outcome] += 1
+            if render_seconds is not None:
+                stats['renders'] += 1
+                stats['render_seconds'] += render_seconds
+                stats['max_render_seconds'] = max(stats['max_render_seconds'], render_seconds)
+
+    def stats(self):
+        """Per-route hit/miss counts and render times, with an overall hit rate."""
+        with self._lock: routes = {route: dict(stats) for route, stats in self._stats.items()}
+        for stats in routes.values():
+            served = stats['hits'] + stats['stale'] + stats['misses']
+            stats['hit_rate'] = (stats['hits'] + stats['stale']) / served if served else 0.0
+        return routes
+
+    def _render(self, route, key, view, view_args, ttl, stale):
+        """Renders the view and stores the result if it tagged itself; returns ``(response, entry)``."""
+        g.pop('page_tags', None)
+        start = time.perf_counter()
+        response = make_response(view(**view_args))
+        elapsed = time.perf_counter() - start
+        self._record(route, None, elapsed)
+        tags = g.pop('page_tags', None)
+        if tags is None or response.status_code != 200 or response.is_streamed: return response, None
+        now = time.time()
+        body = response.get_data()
+        entry = {'body': body, 'mimetype': response.mimetype, 'etag': hashlib.sha256(body).hexdigest()[:32],
+                 'last_modified': now, 'fresh_until': now + ttl, 'stale_until': now + ttl + stale, 'tags': sorted(set(tags)),
+                 'render_ms': round(elapsed * 1000, 2)}
+        self._put(key, entry)
+        return response, entry
+
+    def _render_once(self, route, key, view, view_args, ttl, stale):
+        """Renders on behalf of every request missing ``key`` at the same time."""
+        with self._lock:
+            done = self._rendering.get(key)
+            if done is None: self._rendering[key] = threading.Event()
+        if done is not None:
+            done.wait(RENDER_WAIT_TIMEOUT)
+            entry = self._get(key)
+            if entry: return None, entry
+            return self._render(route, key, view, view_args, ttl, stale)
+        try: return self._render(route, key, view, view_args, ttl, stale)
+        finally:
+            with self._lock: self._rendering.pop(key).set()
+
+    def _refresh(self, app, route, key, view, view_args, ttl, stale):
+        with self._lock:
+            if key in self._rendering: return
+            self._rendering[key] = threading.Event()
+        if self._refresh_pool is None: self._refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='page-cache')
+
+        def run():
+            try:
+                with app.test_request_context(key): self._render(route, key, view, view_args, ttl, stale)
+            except Exception as e: print(f"Refreshing {key} failed: {e}")
+            finally:
+                with self._lock: self._rendering.pop(key).set()
+        self._refresh_pool.submit(run)
+
+    def _respond(self, entry):
+        response = current_app.response_class(entry['body'], mimetype=entry['mimetype'])
+        response.set_etag(entry['etag'])
+        response.last_modified = entry['last_modified']
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    def cached(self, route, ttl, stale=0, args=()):
+        """Decorates a view so the pages it tags are served from the cache.
+
+        ``args`` names the query arguments the view reads; they and the path make up the cache key.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(**view_args):
+                if not self.enabled or request.method != 'GET' or 'Authorization' in request.headers: return view(**view_args)
+                query = urlencode([(name, request.args[name]) for name in sorted(args) if request.args.get(name)])
+                key = f'{request.path}?{query}' if query else request.path
+                entry = self._get(key)
+                if entry and entry['fresh_until'] > time.time(): outcome = 'hits'
+                elif entry and entry['stale_until'] > time.time():
+                    outcome = 'stale'
+                    self._refresh(current_app._get_current_object(), route, key, view, view_args, ttl, stale)
+                else:
+                    outcome = 'misses'
+                    response, entry = self._render_once(route, key, view, view_args, ttl, stale)
+                    if entry is None:
+                        self._record(route, outcome)
+                        return response
+                response = self._respond(entry)
+                if outcome == 'misses': response.headers['Server-Timing'] = f"render;dur={entry['render_ms']}"
+                self._record(route, 'not_modified' if response.status_code == 304 else None)
+                self._record(route, outcome)
+                response.headers['X-Cache'] = X_CACHE[outcome]
+                return response
+            return wrapper
+        return decorator
+
+    def invalidate(self, *tags, broker=None, channel=None):
+        """Drops pages tagged with any of ``tags`` here and in the store, and tells other workers to."""
+        self.evict(tags)
+        if self.store:
+            try: self.store.invalidate(tags)
+            except Exception as e: print(f"Page cache store invalidation failed: {e}")
+        if broker: broker.publish(channel, 'invalidate', {'tags': list(tags)})
+
+    def evict(self, tags):
+        with self._lock:
+            keys = set().union(*(self._tags.get(tag, ()) for tag in tags))
+            for key in keys: self._untag(key)
+        for key in keys: self._entries.pop(key)
+
+    def follow(self, broker, channel):
+        """Evicts pages invalidated by other workers."""
+        self._follower.start(broker, channel)
+
+    def _apply(self, event, data):
+        if event == 'invalidate': self.evict(data['tags'])
+
+    def _forget(self):
+        # Missed invalidations; only the shared store can be trusted now.
+        self._entries.clear()
+        with self._lock: self._tags.clear(); self._key_tags.clear()
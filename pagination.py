@@ -0,0 +1,75 @@
+"""Opaque cursor tokens and ``start_after`` pagination for listings.
+
+A cursor is the URL-safe base64 of a small JSON object holding the sort key
+(and document id) of the last item on the previous page. Datetimes (Firestore
+timestamps) are round-tripped explicitly so they can be fed straight back
+into a query.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from firestore_queries import DOCUMENT_ID
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime): return {'$ts': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and set(value) == {'$ts'}: return datetime.datetime.fromisoformat(value['$ts'])
+    return value
+
+
+def encode_cursor(values):
+    if values is None: return None
+    payload = json.dumps({k: _encode_value(v) for k, v in values.items()}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Returns the values stored in ``token`` (``None`` for an empty token), raising ``InvalidCursor``."""
+    if not token: return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if not isinstance(values, dict): raise ValueError('cursor is not an object')
+        return {k: _decode_value(v) for k, v in values.items()}
+    except (ValueError, binascii.Error, TypeError) as e:
+        raise InvalidCursor(f'Invalid cursor: {e}') from None
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    try: size = int(value) if value is not None else default
+    except (TypeError, ValueError): size = default
+    return max(1, min(size, maximum))
+
+
+def paginate(query, order_by, limit, cursor=None, descending=True):
+    """Returns ``(snapshots, next_cursor)`` for one page of ``query`` ordered by ``order_by``.
+
+    The document id breaks ties, so items sharing a sort value are neither
+    skipped nor repeated across pages. ``cursor`` is a decoded cursor from a
+    previous page; ``next_cursor`` is ``None`` on the last page.
+
+    Filtering on one field while ordering on another needs a composite index;
+    the ones the app's listings use are declared in ``firestore.indexes.json``
+    (``firebase deploy --only firestore:indexes``).
+    """
+    direction = 'DESCENDING' if descending else 'ASCENDING'
+    query = query.order_by(order_by, direction=direction).order_by(DOCUMENT_ID, direction=direction)
+    if cursor:
+        if order_by not in cursor or 'id' not in cursor: raise InvalidCursor('Cursor does not match this listing')
+        query = query.start_after({order_by: cursor[order_by], DOCUMENT_ID: cursor['id']})
+    docs = list(query.limit(limit + 1).stream())
+    if len(docs) <= limit: return docs, None
+    last = docs[limit - 1]
+    return docs[:limit], encode_cursor({order_by: last.get(order_by), 'id': last.id})
@@ -0,0 +1,23 @@
+"""Redis connections for the shared backends.
+
+The job store, event broker and page cache can each keep their state in Redis
+or any server speaking its protocol (Valkey, KeyDB...) so that every gunicorn
+worker sees it. The redis package is only needed when one of them is
+configured to (``JOB_STORE``, ``EVENT_BROKER``, ``PAGE_CACHE_STORE`` = redis).
+"""
+import os
+
+DEFAULT_URL = 'redis://localhost:6379/0'
+
+
+def redis_url():
+    return os.environ.get('REDIS_URL', DEFAULT_URL)
+
+
+def connect_redis(url, backend):
+    """Returns a client for ``url``; ``backend`` names the feature in the error raised when redis is missing."""
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError(f"The 'redis' {backend} requires the redis package (pip install redis).") from None
+    return redis.Redis.from_url(url)
@@ -0,0 +1,384 @@
+"""In-process search index for public creations and users.
+
+``SearchIndex`` keeps an inverted index from normalized words to the public
+creations whose tags or prompt contain them, plus a sorted username list for
+prefix lookups. A query word matches indexed words exactly, as a prefix
+(search-as-you-type) or, when neither exists, by shared trigrams (typos).
+Matches are scored by field weight, match quality and IDF, summed across
+query words, and returned best first (newest first among ties) with keyset
+cursors, like the timestamp-ordered listings.
+
+Creations are numbered in insertion order and postings are append-only arrays
+of those numbers. Updating or removing a creation leaves a dead number behind,
+and the postings are compacted once a quarter of them are dead. ``save`` and
+``load`` persist the whole index to one ``.npz`` file. ``follow`` loads the
+saved index if it is not loaded yet, then applies updates published on an
+``events`` broker channel, so every worker's copy sees every write, and saves
+on an interval while there are unsaved changes; only one process at a time
+writes the file, and only an index that is complete (loaded from the file or
+rebuilt, never one that only holds the updates seen since start-up). Workers see each other's writes only with a broker shared
+across processes (Redis).
+"""
+import bisect
+import datetime
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from array import array
+
+from events import Follower
+from jobs import run_blocking
+from lazy import lazy_import
+from pagination import InvalidCursor
+
+np = lazy_import('numpy')
+
+FIELD_WEIGHTS = {'tag': 3.0, 'prompt': 1.0}
+PREFIX_QUALITY = 0.6
+FUZZY_QUALITY = 0.5
+MIN_TRIGRAM_SIMILARITY = 0.4
+MAX_EXPANSIONS = 32
+COMPACT_RATIO = 0.25
+WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    text = unicodedata.normalize('NFKD', text or '').lower()
+    return WORD.findall(''.join(char for char in text if not unicodedata.combining(char)))
+
+
+def trigrams(word):
+    padded = f'${word}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def as_epoch(value):
+    if isinstance(value, datetime.datetime): return value.timestamp()
+    return value if isinstance(value, (int, float)) else time.time()
+
+
+def search_document(data):
+    """The JSON-safe subset of a creation the index needs."""
+    return {'is_public': bool(data.get('is_public')), 'tags': list(data.get('tags') or []),
+            'prompt': data.get('prompt') or '', 'timestamp': as_epoch(data.get('timestamp'))}
+
+
+def top(candidates, scores, timestamps, k):
+    """Narrows ``candidates`` to the best ``k`` by score, then timestamp, keeping exact ties, in O(n)."""
+    if len(candidates) <= k: return candidates
+    candidate_scores = scores[candidates]
+    threshold = np.partition(candidate_scores, len(candidates) - k)[len(candidates) - k]
+    above, tied = candidates[candidate_scores > threshold], candidates[candidate_scores == threshold]
+    needed = k - len(above)
+    if len(tied) > needed:
+        tied_timestamps = timestamps[tied]
+        cutoff = np.partition(tied_timestamps, len(tied) - needed)[len(tied) - needed]
+        tied = tied[tied_timestamps >= cutoff]
+    return np.concatenate([above, tied])
+
+
+class Vocabulary:
+    """Sorted words with a trigram index, for prefix and fuzzy expansion."""
+
+    def __init__(self):
+        self.words = []
+        self._trigrams = {}
+
+    def add(self, word):
+        position = bisect.bisect_left(self.words, word)
+        if position < len(self.words) and self.words[position] == word: return
+        self.words.insert(position, word)
+        for gram in trigrams(word): self._trigrams.setdefault(gram, set()).add(word)
+
+    def prefixed(self, prefix, limit=MAX_EXPANSIONS):
+        position = bisect.bisect_left(self.words, prefix)
+        matches = []
+        while position < len(self.words) and self.words[position].startswith(prefix) and len(matches) < limit:
+            matches.append(self.words[position]); position += 1
+        return matches
+
+    def similar(self, word, limit=MAX_EXPANSIONS):
+        """Returns ``[(similarity, word)]`` by trigram Jaccard similarity, best first."""
+        grams = trigrams(word)
+        shared = {}
+        for gram in grams:
+            for candidate in self._trigrams.get(gram, ()): shared[candidate] = shared.get(candidate, 0) + 1
+        scored = []
+        for candidate, count in shared.items():
+            similarity = count / (len(grams) + len(candidate) - count)
+            if similarity >= MIN_TRIGRAM_SIMILARITY: scored.append((similarity, candidate))
+        return sorted(scored, reverse=True)[:limit]
+
+
+class SearchIndex:
+    def __init__(self, path=None):
+        self.path = path
+        self.ready = False
+        self.dirty = False
+        self._lock = threading.RLock()
+        self._follower = Follower('search-index', self.apply, self._reload, on_start=self._started, on_tick=self._save_due)
+        self.save_interval = 60
+        self._saved_at = 0.0
+        self._save_claim = None
+        self._clear()
+
+    def _clear(self):
+        self._ids = []
+        self._numbers = {}
+        self._timestamps = array('d')
+        self._alive = bytearray()
+        self._postings = {}
+        self._dead = 0
+        self._vocabulary = Vocabulary()
+        self._usernames = []
+        self._users = {}
+        self._user_words = Vocabulary()
+        self._word_users = {}
+
+    def __len__(self):
+        return len(self._numbers)
+
+    # Creations
+
+    def add_creation(self, creation_id, data):
+        """Indexes (or re-indexes) a creation; non-public creations are removed instead."""
+        with self._lock:
+            self._remove(creation_id)
+            self.dirty = True
+            if not data.get('is_public'): return
+            number = len(self._ids)
+            self._ids.append(creation_id)
+            self._numbers[creation_id] = number
+            self._timestamps.append(as_epoch(data.get('timestamp')))
+            self._alive.append(1)
+            words = {('tag', word) for tag in data.get('tags') or [] for word in tokenize(tag)}
+            words.update(('prompt', word) for word in tokenize(data.get('prompt')))
+            for field, word in words:
+                self._postings.setdefault((field, word), array('I')).append(number)
+                self._vocabulary.add(word)
+
+    def remove_creation(self, creation_id):
+        with self._lock:
+            if self._remove(creation_id): self.dirty = True
+
+    def _remove(self, creation_id):
+        number = self._numbers.pop(creation_id, None)
+        if number is None: return False
+        self._alive[number] = 0
+        self._dead += 1
+        if self._dead > max(1000, len(self._ids) * COMPACT_RATIO): self._compact()
+        return True
+
+    def _compact(self):
+        live = [number for number in range(len(self._ids)) if self._alive[number]]
+        renumber = np.full(len(self._ids), -1, np.int64)
+        renumber[live] = np.arange(len(live))
+        postings = {}
+        for key, numbers in self._postings.items():
+            kept = renumber[np.frombuffer(numbers, np.uint32)]
+            kept = kept[kept >= 0]
+            if len(kept): postings[key] = array('I', kept.astype(np.uint32).tobytes())
+        self._ids = [self._ids[number] for number in live]
+        self._numbers = {creation_id: number for number, creation_id in enumerate(self._ids)}
+        self._timestamps = array('d', (self._timestamps[number] for number in live))
+        self._alive = bytearray(b'\x01' * len(live))
+        self._postings = postings
+        self._dead = 0
+        self._vocabulary = Vocabulary()
+        for word in sorted({word for _, word in postings}): self._vocabulary.add(word)
+
+    def _expand(self, word):
+        """Returns ``[(indexed word, quality)]`` for one query word."""
+        expansions = [(word, 1.0)] if any((field, word) in self._postings for field in FIELD_WEIGHTS) else []
+        expansions += [(match, PREFIX_QUALITY) for match in self._vocabulary.prefixed(word) if match != word]
+        if expansions or len(word) < 3: return expansions
+        return [(match, FUZZY_QUALITY * similarity) for similarity, match in self._vocabulary.similar(word)]
+
+    def search(self, query, limit=20, after=None):
+        """Returns ``(creation ids, next_after)`` for one page of ranked results.
+
+        ``after`` is the previous page's ``next_after``: ``{'score', 'timestamp', 'id'}``.
+        """
+        words = tokenize(query)
+        if not words: return [], None
+        with self._lock:
+            total = len(self._ids)
+            if not total: return [], None
+            scores = np.zeros(total, np.float32)
+            for word in dict.fromkeys(words):
+                best = np.zeros(total, np.float32)
+                for match, quality in self._expand(word):
+                    for field, weight in FIELD_WEIGHTS.items():
+                        numbers = self._postings.get((field, match))
+                        if not numbers: continue
+                        numbers = np.frombuffer(numbers, np.uint32)
+                        idf = math.log(1 + len(self._numbers) / len(numbers))
+                        best[numbers] = np.maximum(best[numbers], weight * quality * idf)
+                scores += best
+            scores *= np.frombuffer(self._alive, np.uint8)
+            timestamps = np.frombuffer(self._timestamps, np.float64)
+            candidates = np.flatnonzero(scores)
+            if after: candidates = self._after(candidates, scores, timestamps, after)
+            candidates = top(candidates, scores, timestamps, limit + 1)
+            ranked = sorted(((-float(scores[number]), -float(timestamps[number]), self._ids[number]) for number in candidates))
+        page = ranked[:limit]
+        next_after = None
+        if len(ranked) > limit:
+            score, timestamp, creation_id = page[-1]
+            next_after = {'score': -score, 'timestamp': -timestamp, 'id': creation_id}
+        return [creation_id for _, _, creation_id in page], next_after
+
+    def _after(self, candidates, scores, timestamps, after):
+        try: score, timestamp, after_id = np.float32(after['score']), float(after['timestamp']), str(after['id'])
+        except (KeyError, TypeError, ValueError): raise InvalidCursor('Invalid cursor: not a search cursor') from None
+        candidate_scores, candidate_timestamps = scores[candidates], timestamps[candidates]
+        keep = (candidate_scores < score) | ((candidate_scores == score) & (candidate_timestamps < timestamp))
+        tied = np.flatnonzero((candidate_scores == score) & (candidate_timestamps == timestamp))
+        keep[tied] = [self._ids[number] > after_id for number in candidates[tied]]
+        return candidates[keep]
+
+    # Users
+
+    def set_user(self, uid, username, full_name=None):
+        with self._lock:
+            self._remove_user(uid)
+            self.dirty = True
+            if not username: return
+            key = username.lower()
+            bisect.insort(self._usernames, (key, uid))
+            self._users[uid] = (key, full_name or '')
+            for word in {key, *tokenize(full_name)}:
+                self._user_words.add(word)
+                self._word_users.setdefault(word, set()).add(uid)
+
+    def remove_user(self, uid):
+        with self._lock:
+            if self._remove_user(uid): self.dirty = True
+
+    def _remove_user(self, uid):
+        entry = self._users.pop(uid, None)
+        if entry is None: return False
+        position = bisect.bisect_left(self._usernames, (entry[0], uid))
+        if position < len(self._usernames) and self._usernames[position] == (entry[0], uid): del self._usernames[position]
+        for word in {entry[0], *tokenize(entry[1])}: self._word_users.get(word, set()).discard(uid)
+        return True
+
+    def search_users(self, query, limit=5):
+        """Returns uids whose username starts with ``query`` (shortest first), then fuzzy username/name matches."""
+        prefix = query.strip().lower()
+        if not prefix: return []
+        with self._lock:
+            position = bisect.bisect_left(self._usernames, (prefix, ''))
+            matches = []
+            while position < len(self._usernames) and self._usernames[position][0].startswith(prefix) and len(matches) < 10 * limit:
+                matches.append(self._usernames[position]); position += 1
+            uids = [uid for _, uid in sorted(matches, key=lambda match: (len(match[0]), match[0]))[:limit]]
+            if len(uids) < limit and len(prefix) >= 3:
+                for _, word in self._user_words.similar(prefix):
+                    for uid in sorted(self._word_users.get(word, ())):
+                        if uid not in uids: uids.append(uid)
+                    if len(uids) >= limit: break
+        return uids[:limit]
+
+    # Persistence
+
+    def save(self, path=None):
+        path = path or self.path
+        with self._lock:
+            keys = sorted(self._postings)
+            postings = [self._postings[key] for key in keys]
+            arrays = {
+                'ids': np.array([creation_id if alive else '' for creation_id, alive in zip(self._ids, self._alive)], str),
+                'timestamps': np.frombuffer(self._timestamps, np.float64).copy(),
+                'fields': np.array([field for field, _ in keys], str),
+                'words': np.array([word for _, word in keys], str),
+                'offsets': np.cumsum([0] + [len(numbers) for numbers in postings], dtype=np.int64),
+                'postings': np.concatenate([np.frombuffer(numbers, np.uint32) for numbers in postings] or [np.zeros(0, np.uint32)]),
+                'user_ids': np.array(list(self._users), str),
+                'usernames': np.array([username for username, _ in self._users.values()], str),
+                'full_names': np.array([full_name for _, full_name in self._users.values()], str),
+            }
+            self.dirty = False
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npz')
+        try:
+            with os.fdopen(fd, 'wb') as f: np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            raise
+
+    def load(self, path=None):
+        """Replaces the index with the one saved at ``path``; returns False if there is none."""
+        path = path or self.path
+        try: data = np.load(path, allow_pickle=False)
+        except FileNotFoundError: return False
+        with data, self._lock:
+            self._clear()
+            self._ids = [creation_id or None for creation_id in data['ids'].tolist()]
+            self._numbers = {creation_id: number for number, creation_id in enumerate(self._ids) if creation_id}
+            self._timestamps = array('d', data['timestamps'].tobytes())
+            self._alive = bytearray(creation_id is not None for creation_id in self._ids)
+            self._dead = len(self._ids) - len(self._numbers)
+            offsets, postings = data['offsets'], data['postings']
+            for i, (field, word) in enumerate(zip(data['fields'].tolist(), data['words'].tolist())):
+                self._postings[(field, word)] = array('I', postings[offsets[i]:offsets[i + 1]].tobytes())
+            for word in sorted({word for _, word in self._postings}): self._vocabulary.add(word)
+            for uid, username, full_name in zip(data['user_ids'].tolist(), data['usernames'].tolist(), data['full_names'].tolist()):
+                self.set_user(uid, username, full_name)
+            self.ready = True
+            self.dirty = False
+        return True
+
+    # Keeping workers in sync
+
+    def follow(self, broker, channel, save_interval=60):
+        """Applies updates published on ``channel``, saving at most every ``save_interval`` seconds."""
+        self.save_interval = save_interval
+        self._follower.start(broker, channel, interval=save_interval)
+
+    def _claim_saves(self):
+        """Returns whether this process writes ``path``: the one holding an exclusive lock on ``path.lock``.
+
+        Workers save their own copies, so without the lock the last one to save
+        would overwrite the others'. A worker that exits releases the lock and
+        the next one to try takes over.
+        """
+        if self._save_claim: return True
+        try: import fcntl
+        except ImportError: return True
+        claim = open(f'{self.path}.lock', 'a')
+        try: fcntl.flock(claim, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            claim.close()
+            return False
+        self._save_claim = claim
+        return True
+
+    def _started(self):
+        # A claim inherited across a fork belongs to the parent.
+        self._save_claim = None
+        self._saved_at = time.monotonic()
+        if self.path and not self.ready: run_blocking(self.load)
+
+    def _reload(self):
+        # Updates were lost, so reload what was last saved.
+        if self.path: run_blocking(self.load)
+
+    def _save_due(self):
+        # Without a loaded file this copy only holds recent updates; saving it would replace the full index.
+        if not (self.path and self.ready and self.dirty and time.monotonic() - self._saved_at >= self.save_interval): return
+        try:
+            if self._claim_saves(): run_blocking(self.save)
+        except OSError as e: print(f"Saving the search index failed: {e}")
+        self._saved_at = time.monotonic()
+
+    def apply(self, event, data):
+        if event == 'creation': self.add_creation(data['id'], data['document'])
+        elif event == 'creation-removed': self.remove_creation(data['id'])
+        elif event == 'user': self.set_user(data['uid'], data.get('username'), data.get('full_name'))
+        elif event == 'reload' and self.path: run_blocking(self.load)
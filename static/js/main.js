@@ -55,6 +55,23 @@ document.addEventListener('firebase-ready', () => {
         if (document.getElementById('dashboard-content')) {
             loadDashboard(user);
         }
+        if (document.body.dataset.page === 'messages') {
+            openEventStream(user);
+        }
+    };
+
+    // Relays server-sent chat events as `aw:message` / `aw:conversation` DOM events.
+    // The server ends the stream when the ID token expires, so reconnect with a fresh one.
+    const openEventStream = async (user) => {
+        const token = await user.getIdToken();
+        const source = new EventSource(`/api/events?token=${encodeURIComponent(token)}`);
+        ['message', 'conversation'].forEach(type => source.addEventListener(type, e => {
+            document.dispatchEvent(new CustomEvent(`aw:${type}`, { detail: JSON.parse(e.data) }));
+        }));
+        source.onerror = () => {
+            source.close();
+            setTimeout(() => openEventStream(user), 3000);
+        };
     };
     
     auth.onAuthStateChanged(user => {
@@ -99,6 +116,19 @@ document.addEventListener('firebase-ready', () => {
         resultsArea.scrollIntoView({ behavior: 'smooth' });
     };
 
+    const waitForJob = async (jobId, authorization) => {
+        const headers = authorization ? { Authorization: authorization } : {};
+        while (true) {
+            const response = await fetch(`/api/jobs/${jobId}`, { headers });
+            const job = await response.json();
+            if (!response.ok || job.status === 'failed') {
+                throw new Error(job.error || 'An unknown error occurred.');
+            }
+            if (job.status === 'done') return job.result;
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    };
+
     async function handleGeneratorSubmit(endpoint, body, isFormData = false) {
         loadingModal.style.display = 'flex';
         let headers = {};
@@ -116,8 +146,9 @@ document.addEventListener('firebase-ready', () => {
             if (!response.ok || data.error) {
                 throw new Error(data.error || 'An unknown error occurred.');
             }
-            const imgSrc = isFormData ? `data:image/jpeg;base64,${data.cartoon}` : data.image_data_url;
-            showResult(imgSrc, data.creation_id);
+            const result = await waitForJob(data.job_id, headers.Authorization);
+            const imgSrc = isFormData ? `data:image/jpeg;base64,${result.cartoon}` : result.image_data_url;
+            showResult(imgSrc, result.creation_id);
         } catch (error) {
             showApiError(error.message);
         } finally {
@@ -149,21 +180,30 @@ document.addEventListener('firebase-ready', () => {
         });
     }
 
-    const loadDashboard = async (user) => {
+    const loadDashboard = async (user, cursor = null) => {
         const token = await user.getIdToken();
         const container = document.getElementById('dashboard-creations');
         if (!container) return;
 
-        const res = await fetch('/api/user/creations', { headers: { Authorization: `Bearer ${token}` } });
+        const url = cursor ? `/api/user/creations?cursor=${encodeURIComponent(cursor)}` : '/api/user/creations';
+        const res = await fetch(url, { headers: { Authorization: `Bearer ${token}` } });
         const data = await res.json();
         
-        document.getElementById('dashboard-loader').style.display = 'none';
+        const loader = document.getElementById('dashboard-loader');
+        if (loader) loader.style.display = 'none';
+        document.getElementById('dashboard-load-more')?.remove();
         if (data.creations && data.creations.length > 0) {
-            container.innerHTML = data.creations.map(c => `
+            const cards = data.creations.map(c => `
                 <div class="bg-gray-100 dark:bg-gray-800 rounded-lg shadow-md overflow-hidden group">
-                     <a href="/creation/${c.id}"><img src="data:image/png;base64,${c.generated_image_b64}" class="w-full h-64 object-cover"></a>
+                     <a href="/creation/${c.id}"><img src="${c.thumbnail_url}" ${c.srcset ? `srcset="${c.srcset}" sizes="(min-width: 1280px) 25vw, (min-width: 1024px) 33vw, (min-width: 768px) 50vw, 100vw"` : ''} loading="lazy" class="w-full h-64 object-cover"></a>
                 </div>`).join('');
-        } else {
+            if (cursor) container.insertAdjacentHTML('beforeend', cards);
+            else container.innerHTML = cards;
+            if (data.next_cursor) {
+                container.insertAdjacentHTML('afterend', `<div id="dashboard-load-more" class="mt-8 text-center"><button class="bg-blue-500 text-white px-6 py-2 rounded-full hover:bg-blue-600">Load more</button></div>`);
+                document.querySelector('#dashboard-load-more button').addEventListener('click', () => loadDashboard(user, data.next_cursor));
+            }
+        } else if (!cursor) {
             container.innerHTML = `<p class="col-span-full text-center text-gray-500">You haven't made any creations yet.</p>`;
         }
     };
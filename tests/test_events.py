@@ -0,0 +1,71 @@
+"""Drives ``RedisEventBroker`` end to end against an in-process stand-in for a Redis server.
+
+    python -m pytest tests
+"""
+import datetime
+import os
+import queue
+import sys
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from events import RedisEventBroker, format_sse  # noqa: E402
+
+
+class FakeRedis:
+    """Just enough of ``redis.Redis`` for the broker: ``publish`` and a pattern ``pubsub``."""
+
+    def __init__(self):
+        self.published = []
+        self._listeners = []
+
+    def publish(self, channel, payload):
+        if not isinstance(payload, (bytes, str)): raise TypeError(f"Invalid input of type {type(payload).__name__}")
+        self.published.append((channel, payload))
+        for prefix, messages in self._listeners:
+            if channel.startswith(prefix): messages.put({'channel': channel.encode(), 'data': payload.encode()})
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        client = self
+        messages = queue.Queue()
+
+        class PubSub:
+            def psubscribe(self, pattern): client._listeners.append((pattern.rstrip('*'), messages))
+
+            def listen(self):
+                while True: yield messages.get()
+
+        return PubSub()
+
+
+class RedisEventBrokerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeRedis()
+        redis = types.SimpleNamespace(Redis=types.SimpleNamespace(from_url=lambda url: self.server))
+        with mock.patch.dict(sys.modules, {'redis': redis}):
+            self.broker = RedisEventBroker('redis://localhost:6379/0')
+
+    def test_message_with_datetime_reaches_subscriber(self):
+        subscription = self.broker.subscribe('bob')
+        sent_at = datetime.datetime(2024, 5, 1, 12, 30, tzinfo=datetime.timezone.utc)
+        message = {'chat_id': 'c1', 'id': 'm1', 'senderId': 'alice', 'text': 'hi', 'timestamp': sent_at}
+        self.broker.publish('bob', 'message', message)
+
+        event_id, event, data = subscription.get(timeout=2)
+        self.assertEqual(event, 'message')
+        self.assertEqual(data, message | {'timestamp': str(sent_at)})
+        self.assertEqual(format_sse(event_id, event, data), format_sse(event_id, event, message))
+
+    def test_events_stay_on_their_channel(self):
+        alice, bob = self.broker.subscribe('alice'), self.broker.subscribe('bob')
+        self.broker.publish('alice', 'conversation', {'chat_id': 'c1'})
+        self.assertEqual(alice.get(timeout=2)[1:], ('conversation', {'chat_id': 'c1'}))
+        self.assertIsNone(bob.get(timeout=0.1))
+        self.assertEqual([channel for channel, _ in self.server.published], ['events:alice'])
+
+
+if __name__ == '__main__':
+    unittest.main()
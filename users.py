@@ -0,0 +1,65 @@
+"""Shared, cached lookups of public user data.
+
+``UserDirectory`` resolves usernames to uids and uids to public profiles
+through bounded TTL caches, hydrating misses with batched ``get_all`` calls.
+Writers call ``invalidate(uid)`` after changing a user document. Only positive
+username lookups are cached: usernames are claimed client-side, so a cached
+"not found" could hide a freshly registered user.
+"""
+from caching import TTLCache
+from firestore_queries import get_documents
+
+PUBLIC_PROFILE_FIELDS = ('username', 'photoURL', 'aboutMe', 'points', 'gender')
+
+
+def public_profile(uid, data):
+    profile = {field: data.get(field) for field in PUBLIC_PROFILE_FIELDS}
+    profile['uid'] = uid
+    return profile
+
+
+class UserDirectory:
+    def __init__(self, get_db, max_entries=10000, ttl=300):
+        self._get_db = get_db
+        self.uids = TTLCache(max_entries, ttl)
+        self.profiles = TTLCache(max_entries, ttl)
+
+    def _remember(self, uid, data):
+        profile = public_profile(uid, data)
+        self.profiles.put(uid, profile)
+        if profile['username']: self.uids.put(profile['username'], uid)
+        return profile
+
+    def uid_for_username(self, username):
+        profile = self.find_by_username(username)
+        return profile['uid'] if profile else None
+
+    def find_by_username(self, username):
+        """Returns the public profile for ``username`` or ``None``."""
+        uid = self.uids.get(username)
+        if uid:
+            profile = self.get_profile(uid)
+            if profile and profile['username'] == username: return profile
+            self.uids.pop(username)
+        docs = self._get_db().collection('users').where('username', '==', username).limit(1).get()
+        if not docs: return None
+        return dict(self._remember(docs[0].id, docs[0].to_dict()))
+
+    def get_profile(self, uid):
+        return self.get_profiles([uid]).get(uid)
+
+    def get_profiles(self, uids):
+        """Returns ``{uid: public profile}`` for the uids that exist."""
+        profiles, missing = {}, []
+        for uid in dict.fromkeys(uids):
+            profile = self.profiles.get(uid)
+            if profile: profiles[uid] = dict(profile)
+            else: missing.append(uid)
+        if missing:
+            for doc in get_documents(self._get_db(), 'users', missing):
+                profiles[doc.id] = dict(self._remember(doc.id, doc.to_dict()))
+        return profiles
+
+    def invalidate(self, uid):
+        profile = self.profiles.pop(uid)
+        if profile and profile['username']: self.uids.pop(profile['username'])